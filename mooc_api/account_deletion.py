@@ -0,0 +1,351 @@
+# account_deletion.py
+"""
+Account deletion in small batches, off the request path.
+
+DELETE /api/auth/delete only checks the password and writes a tombstone row
+to `account_deletions` (migration 007), then answers 202. While a tombstone
+is not 'done', chat turns and login.php refuse the account.
+
+An AccountDeleter thread in each worker claims pending tombstones. For each
+table in DEPENDENT_TABLES it deletes the user's rows ACCOUNT_DELETE_BATCH at
+a time, as one primary-key range per transaction, and records the progress
+in the same commit. Each batch holds its row locks for one short transaction
+and leaves other learners' rows alone, so their chat inserts never wait
+behind a large DELETE. The users row goes last, and its ON DELETE CASCADE
+only has to clean up stragglers. A claim that stops making progress (a
+worker died) is picked up again after ACCOUNT_DELETE_CLAIM_TIMEOUT.
+
+Each worker also keeps the set of tombstoned user ids, re-read every
+ACCOUNT_DELETE_POLL_INTERVAL seconds. To drain pending deletions from
+cron or a shell:
+
+    python account_deletion.py run
+    python account_deletion.py status <user_id>
+"""
+import os
+import sys
+import time
+import uuid
+import socket
+import threading
+
+import mysql.connector
+from mysql.connector import errorcode
+
+from db_pool import get_db, PoolTimeoutError
+from chat_archive import CHAT_ARCHIVE_CHUNK_ROWS
+
+# --------------------------
+# Deletion configuration
+# --------------------------
+ACCOUNT_PURGE_ENABLED = os.environ.get("ACCOUNT_PURGE_ENABLED", "1") == "1"        # 0: only track tombstones here
+ACCOUNT_DELETE_BATCH = int(os.environ.get("ACCOUNT_DELETE_BATCH", 500))               # rows per DELETE
+ACCOUNT_DELETE_PAUSE = float(os.environ.get("ACCOUNT_DELETE_PAUSE", 0.05))           # seconds between batches
+ACCOUNT_DELETE_POLL_INTERVAL = float(os.environ.get("ACCOUNT_DELETE_POLL_INTERVAL", 5))   # 0 disables the thread
+ACCOUNT_DELETE_CLAIM_TIMEOUT = int(os.environ.get("ACCOUNT_DELETE_CLAIM_TIMEOUT", 120))  # reclaim a stalled purge
+ACCOUNT_DELETE_RETRY = int(os.environ.get("ACCOUNT_DELETE_RETRY", 60))               # wait after a failed purge
+ACCOUNT_DELETE_KEEP_DAYS = int(os.environ.get("ACCOUNT_DELETE_KEEP_DAYS", 7))         # finished tombstones kept
+
+# (table, primary key, rows per batch). An archive row holds up to
+# CHAT_ARCHIVE_CHUNK_ROWS turns, so its batches count turns, not rows.
+DEPENDENT_TABLES = (
+    ("password_reset_tokens", "id", ACCOUNT_DELETE_BATCH),
+    ("chat_history", "id", ACCOUNT_DELETE_BATCH),
+    ("chat_history_archive", "chunk_id", max(1, ACCOUNT_DELETE_BATCH // CHAT_ARCHIVE_CHUNK_ROWS)),
+    ("progress", "id", ACCOUNT_DELETE_BATCH),
+    ("enrollments", "id", ACCOUNT_DELETE_BATCH),
+    ("tra_user_courses", "id", ACCOUNT_DELETE_BATCH),
+    ("tra_comment", "comment_id", ACCOUNT_DELETE_BATCH),
+)
+
+_missing_tables = set()
+
+
+class ClaimLost(Exception):
+    """Another worker took over the purge (this one stalled past the claim timeout)."""
+
+
+def request_deletion(cursor, user_id):
+    """Writes the tombstone with the caller's cursor, inside its transaction."""
+    cursor.execute("INSERT IGNORE INTO account_deletions (user_id) VALUES (%s)", (user_id,))
+
+
+def progress(user_id):
+    """The tombstone of one account as a dict, or None if none was requested."""
+    with get_db() as db:
+        cursor = db.cursor(dictionary=True)
+        try:
+            cursor.execute(
+                "SELECT user_id, state, current_table, rows_deleted, attempts, requested_at, finished_at "
+                "FROM account_deletions WHERE user_id=%s",
+                (user_id,)
+            )
+            row = cursor.fetchone()
+            db.commit()
+        finally:
+            cursor.close()
+    if row is None:
+        return None
+    for key in ("requested_at", "finished_at"):
+        if row[key] is not None:
+            row[key] = row[key].isoformat()
+    return row
+
+
+def _delete_batch(user_id, claim_id, table, key, batch):
+    """Deletes the lowest `batch` keys of one user's rows in `table`. Returns (rows deleted, more left)."""
+    with get_db() as db:
+        cursor = db.cursor()
+        try:
+            db.start_transaction()
+            cursor.execute(
+                f"SELECT {key} FROM {table} WHERE user_id=%s ORDER BY {key} LIMIT %s", (user_id, batch)
+            )
+            keys = [row[0] for row in cursor.fetchall()]
+            if not keys:
+                db.rollback()
+                return 0, False
+            cursor.execute(
+                f"DELETE FROM {table} WHERE user_id=%s AND {key} BETWEEN %s AND %s", (user_id, keys[0], keys[-1])
+            )
+            deleted = cursor.rowcount
+            # Progress commits with the rows it counts; the claim doubles as a heartbeat.
+            cursor.execute(
+                "UPDATE account_deletions SET rows_deleted=rows_deleted+%s, current_table=%s, claimed_at=NOW() "
+                "WHERE user_id=%s AND claimed_by=%s AND state='running'",
+                (deleted, table, user_id, claim_id)
+            )
+            if cursor.rowcount == 0:
+                db.rollback()
+                raise ClaimLost(user_id)
+            db.commit()
+            return deleted, len(keys) == batch
+        except mysql.connector.Error:
+            if db.in_transaction:
+                db.rollback()
+            raise
+        finally:
+            cursor.close()
+
+
+def _delete_user_row(user_id, claim_id):
+    with get_db() as db:
+        cursor = db.cursor()
+        try:
+            db.start_transaction()
+            cursor.execute("DELETE FROM users WHERE id=%s", (user_id,))
+            cursor.execute(
+                "UPDATE account_deletions SET state='done', current_table=NULL, finished_at=NOW(), "
+                "rows_deleted=rows_deleted+%s, claimed_by=NULL, last_error=NULL "
+                "WHERE user_id=%s AND claimed_by=%s AND state='running'",
+                (cursor.rowcount, user_id, claim_id)
+            )
+            if cursor.rowcount == 0:
+                db.rollback()
+                raise ClaimLost(user_id)
+            db.commit()
+        except mysql.connector.Error:
+            if db.in_transaction:
+                db.rollback()
+            raise
+        finally:
+            cursor.close()
+
+
+def purge_account(user_id, claim_id, pause=ACCOUNT_DELETE_PAUSE):
+    """Deletes everything of one claimed account, batch by batch. Returns (rows deleted, batches)."""
+    total = batches = 0
+    for table, key, batch in DEPENDENT_TABLES:
+        if table in _missing_tables:
+            continue
+        more = True
+        while more:
+            try:
+                deleted, more = _delete_batch(user_id, claim_id, table, key, batch)
+            except mysql.connector.Error as err:
+                if err.errno != errorcode.ER_NO_SUCH_TABLE:
+                    raise
+                _missing_tables.add(table)   # e.g. migration 006 not applied
+                break
+            if deleted:
+                total += deleted
+                batches += 1
+            if more and pause:
+                time.sleep(pause)
+    _delete_user_row(user_id, claim_id)
+    return total, batches + 1
+
+
+class AccountDeleter:
+    def __init__(self):
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+        self._pid = None
+        self._lock = threading.Lock()
+        self._tombstones = frozenset()
+
+        self.accounts_deleted = 0
+        self.rows_deleted = 0
+        self.batches = 0
+        self.failures = 0
+        self.last_purge_ms = 0.0
+
+    # ---- tombstones ----
+    def is_deleting(self, user_id):
+        """True while this account's deletion is pending or running (as of the last poll)."""
+        return user_id in self._tombstones
+
+    def requested(self, user_id):
+        """Called after the tombstone commits: block the account here at once and start purging."""
+        self._tombstones = self._tombstones | {user_id}
+        self.wake()
+
+    def refresh_tombstones(self):
+        with get_db() as db:
+            cursor = db.cursor()
+            try:
+                cursor.execute("SELECT user_id FROM account_deletions WHERE state <> 'done'")
+                self._tombstones = frozenset(row[0] for row in cursor.fetchall())
+                cursor.execute(
+                    "DELETE FROM account_deletions WHERE state='done' AND finished_at < NOW() - INTERVAL %s DAY "
+                    "LIMIT 100",
+                    (ACCOUNT_DELETE_KEEP_DAYS,)
+                )
+                db.commit()
+            finally:
+                cursor.close()
+
+    # ---- lifecycle ----
+    def ensure_started(self):
+        """Starts the worker thread in this process if it is not running yet."""
+        if ACCOUNT_DELETE_POLL_INTERVAL <= 0:
+            return
+        with self._lock:
+            if self._thread is not None and self._pid == os.getpid() and self._thread.is_alive():
+                return
+            self._pid = os.getpid()
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="account-deleter", daemon=True)
+            self._thread.start()
+
+    def wake(self):
+        self.ensure_started()
+        self._wake.set()
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
+
+    # ---- work loop ----
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self.refresh_tombstones()
+                handled = self.purge_next() if ACCOUNT_PURGE_ENABLED else False
+            except mysql.connector.Error as err:
+                if err.errno == errorcode.ER_NO_SUCH_TABLE:
+                    print("WARNING: account_deletions table missing; run migrate.py (migration 007).")
+                    return
+                print(f"ERROR: account deleter could not reach the database: {err}")
+                handled = False
+            except PoolTimeoutError as err:
+                print(f"ERROR: account deleter could not reach the database: {err}")
+                handled = False
+
+            if handled:
+                continue   # there may be more pending accounts
+            self._wake.wait(ACCOUNT_DELETE_POLL_INTERVAL)
+            self._wake.clear()
+
+    def _claim(self, claim_id):
+        with get_db() as db:
+            cursor = db.cursor()
+            try:
+                cursor.execute(
+                    "UPDATE account_deletions SET state='running', claimed_by=%s, claimed_at=NOW(), attempts=attempts+1 "
+                    "WHERE (state='pending' AND (claimed_at IS NULL OR claimed_at < NOW() - INTERVAL %s SECOND)) "
+                    "   OR (state='running' AND claimed_at < NOW() - INTERVAL %s SECOND) "
+                    "ORDER BY requested_at LIMIT 1",
+                    (claim_id, ACCOUNT_DELETE_RETRY, ACCOUNT_DELETE_CLAIM_TIMEOUT)
+                )
+                db.commit()
+                if cursor.rowcount == 0:
+                    return None
+                cursor.execute(
+                    "SELECT user_id FROM account_deletions WHERE claimed_by=%s AND state='running'", (claim_id,)
+                )
+                row = cursor.fetchone()
+                db.commit()
+                return row[0] if row else None
+            finally:
+                cursor.close()
+
+    def _release(self, user_id, claim_id, error):
+        # Back to 'pending'; claimed_at now delays the retry by ACCOUNT_DELETE_RETRY.
+        with get_db() as db:
+            cursor = db.cursor()
+            try:
+                cursor.execute(
+                    "UPDATE account_deletions SET state='pending', claimed_by=NULL, claimed_at=NOW(), last_error=%s "
+                    "WHERE user_id=%s AND claimed_by=%s",
+                    (str(error)[:500], user_id, claim_id)
+                )
+                db.commit()
+            finally:
+                cursor.close()
+
+    def purge_next(self):
+        """Claims and purges one pending account. Returns True if there was one."""
+        claim_id = f"{socket.gethostname()[:40]}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        user_id = self._claim(claim_id)
+        if user_id is None:
+            return False
+
+        start = time.perf_counter()
+        try:
+            rows, batches = purge_account(user_id, claim_id)
+        except ClaimLost:
+            print(f"WARNING: deletion of account {user_id} was taken over by another worker.")
+            return True
+        except (mysql.connector.Error, PoolTimeoutError) as err:
+            self.failures += 1
+            print(f"ERROR: could not delete account {user_id}; retrying in {ACCOUNT_DELETE_RETRY}s: {err}")
+            self._release(user_id, claim_id, err)
+            return True
+
+        self.last_purge_ms = (time.perf_counter() - start) * 1000
+        self.accounts_deleted += 1
+        self.rows_deleted += rows
+        self.batches += batches
+        self._tombstones = self._tombstones - {user_id}
+        print(f"INFO: deleted account {user_id}: {rows} rows in {batches} batches, {self.last_purge_ms:.0f} ms")
+        return True
+
+    def stats(self):
+        return {
+            "tombstones": len(self._tombstones),
+            "accounts_deleted": self.accounts_deleted,
+            "rows_deleted": self.rows_deleted,
+            "batches": self.batches,
+            "failures": self.failures,
+            "last_purge_ms": round(self.last_purge_ms, 1),
+            "batch_size": ACCOUNT_DELETE_BATCH,
+        }
+
+
+deleter = AccountDeleter()
+
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    if args == ["run"]:
+        count = 0
+        while deleter.purge_next():
+            count += 1
+        print(f"Processed {count} pending account deletions.")
+    elif len(args) == 2 and args[0] == "status" and args[1].isdigit():
+        print(progress(int(args[1])) or f"No deletion requested for account {args[1]}.")
+    else:
+        print(__doc__)
+        sys.exit(1)
@@ -0,0 +1,195 @@
+# ai_guard.py
+"""
+Admission control and a circuit breaker in front of the Gemini calls.
+
+At most AI_MAX_CONCURRENT calls run at once per worker. Up to
+AI_MAX_WAITING more may queue for AI_QUEUE_TIMEOUT seconds. Anything beyond
+that is refused straight away (429), which keeps request threads free for
+the auth and history routes. After AI_BREAKER_THRESHOLD consecutive
+failures the breaker opens and chat requests fail fast (503) for
+AI_BREAKER_COOLDOWN seconds. Then a single probe call decides whether it
+closes again.
+"""
+import os
+import math
+import time
+import threading
+
+# --------------------------
+# Guard configuration
+# --------------------------
+AI_MAX_CONCURRENT = int(os.environ.get("AI_MAX_CONCURRENT", 8))
+AI_MAX_WAITING = int(os.environ.get("AI_MAX_WAITING", 16))
+AI_QUEUE_TIMEOUT = float(os.environ.get("AI_QUEUE_TIMEOUT", 5))
+AI_BREAKER_THRESHOLD = int(os.environ.get("AI_BREAKER_THRESHOLD", 5))
+AI_BREAKER_COOLDOWN = float(os.environ.get("AI_BREAKER_COOLDOWN", 30))
+
+CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+
+class AIUnavailable(Exception):
+    """The AI backend is saturated (429) or switched off by the breaker (503)."""
+
+    def __init__(self, status, retry_after, reason):
+        super().__init__(reason)
+        self.status = status
+        self.retry_after = max(1, int(math.ceil(retry_after)))
+        self.reason = reason
+
+
+class CircuitBreaker:
+    def __init__(self, threshold=5, cooldown=30.0):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.state = CLOSED
+        self._lock = threading.Lock()
+        self._consecutive_failures = 0
+        self._opened_at = 0.0
+        self._probe_in_flight = False
+        self.transitions = {CLOSED: 0, OPEN: 0, HALF_OPEN: 0}
+        self.rejected = 0
+
+    def _move(self, state):
+        self.state = state
+        self.transitions[state] += 1
+
+    def allow(self):
+        """Raises AIUnavailable while open; lets one probe through once the cool-down has passed."""
+        with self._lock:
+            if self.state == OPEN:
+                remaining = self._opened_at + self.cooldown - time.monotonic()
+                if remaining > 0:
+                    self.rejected += 1
+                    raise AIUnavailable(503, remaining, "AI service temporarily disabled after repeated errors.")
+                self._move(HALF_OPEN)
+            if self.state == HALF_OPEN:
+                if self._probe_in_flight:
+                    self.rejected += 1
+                    raise AIUnavailable(503, 1, "AI service is recovering, please retry shortly.")
+                self._probe_in_flight = True
+
+    def record(self, success):
+        """True/False is a verdict on the backend; None only frees a half-open probe."""
+        with self._lock:
+            self._probe_in_flight = False
+            if success is None:
+                return
+            if success:
+                self._consecutive_failures = 0
+                if self.state != CLOSED:
+                    self._move(CLOSED)
+                return
+            self._consecutive_failures += 1
+            if self.state == HALF_OPEN or self._consecutive_failures >= self.threshold:
+                if self.state != OPEN:
+                    self._move(OPEN)
+                self._opened_at = time.monotonic()
+
+
+class AdmissionController:
+    def __init__(self, max_concurrent=8, max_waiting=16, wait_timeout=5.0):
+        self.max_concurrent = max_concurrent
+        self.max_waiting = max_waiting
+        self.wait_timeout = wait_timeout
+        self._cond = threading.Condition()
+        self.in_flight = 0
+        self.waiting = 0
+        self.admitted = 0
+        self.rejected_full = 0
+        self.rejected_timeout = 0
+        self.wait_total = 0.0
+
+    def acquire(self):
+        start = time.monotonic()
+        with self._cond:
+            if self.in_flight >= self.max_concurrent:
+                if self.waiting >= self.max_waiting:
+                    self.rejected_full += 1
+                    raise AIUnavailable(429, self.wait_timeout, "Too many AI requests right now, please retry shortly.")
+                self.waiting += 1
+                deadline = start + self.wait_timeout
+                try:
+                    while self.in_flight >= self.max_concurrent:
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0:
+                            self.rejected_timeout += 1
+                            raise AIUnavailable(503, self.wait_timeout, "AI service is busy, please retry shortly.")
+                        self._cond.wait(remaining)
+                finally:
+                    self.waiting -= 1
+            self.in_flight += 1
+            self.admitted += 1
+            self.wait_total += time.monotonic() - start
+
+    def release(self):
+        with self._cond:
+            self.in_flight -= 1
+            self._cond.notify()
+
+
+class Slot:
+    """One admitted AI call. release() is idempotent so it can be hooked up from several places."""
+
+    def __init__(self, guard):
+        self._guard = guard
+        self._released = False
+        self._lock = threading.Lock()
+
+    def release(self, success):
+        """success=None frees the slot without a verdict (the client went away)."""
+        with self._lock:
+            if self._released:
+                return
+            self._released = True
+        self._guard.breaker.record(success)
+        self._guard.admission.release()
+
+
+class AIGuard:
+    def __init__(self, admission, breaker):
+        self.admission = admission
+        self.breaker = breaker
+
+    def enter(self):
+        """Returns a Slot or raises AIUnavailable. Every Slot must be released."""
+        # The breaker first: while it is open there is no point queueing for a slot.
+        self.breaker.allow()
+        try:
+            self.admission.acquire()
+        except AIUnavailable:
+            self.breaker.record(None)   # give back a half-open probe that never ran
+            raise
+        return Slot(self)
+
+    def call(self, fn, *args, is_failure=lambda result: False):
+        """Runs fn(*args) inside a slot; exceptions and results flagged by is_failure count as errors."""
+        slot = self.enter()
+        success = False
+        try:
+            result = fn(*args)
+            success = not is_failure(result)
+            return result
+        finally:
+            slot.release(success)
+
+    def stats(self):
+        a, b = self.admission, self.breaker
+        return {
+            "breaker_state": b.state,
+            "breaker_transitions": dict(b.transitions),
+            "breaker_rejected": b.rejected,
+            "in_flight": a.in_flight,
+            "waiting": a.waiting,
+            "max_concurrent": a.max_concurrent,
+            "max_waiting": a.max_waiting,
+            "admitted": a.admitted,
+            "rejected_queue_full": a.rejected_full,
+            "rejected_wait_timeout": a.rejected_timeout,
+            "wait_avg_ms": round(1000 * a.wait_total / a.admitted, 3) if a.admitted else 0.0,
+        }
+
+
+ai_guard = AIGuard(
+    AdmissionController(AI_MAX_CONCURRENT, AI_MAX_WAITING, AI_QUEUE_TIMEOUT),
+    CircuitBreaker(AI_BREAKER_THRESHOLD, AI_BREAKER_COOLDOWN),
+)
@@ -1,18 +1,38 @@
 # ai_handler.py
 import os
-import requests
+import json
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 
-# Gemini SDK (safe import)
-try:
-    from google import genai
-except:
-    genai = None
+# Shared, long-lived SDK client and keep-alive HTTP session (one per worker process)
+from gemini_client import sdk_available, get_sdk_client, get_http_session, rest_url, GEMINI_API_KEY, GEMINI_MODEL
+from providers import load_genai, load_requests
+from prompt_builder import prompt_builder, as_prompt, as_text
+from metrics import AI_CALL_SECONDS
 
 # Gemini configuration
-# 🛑 CRITICAL: The previous key is failing. REPLACE this placeholder with a BRAND NEW, valid Gemini API Key.
-GEMINI_API_KEY = os.environ.get("GEMINI_API_KEY", "")
-GEMINI_MODEL = "gemini-2.5-flash"
-USE_SDK = True 
+# 🛑 CRITICAL: Set GEMINI_API_KEY and GEMINI_MODEL in the environment (read by gemini_client.py).
+# Prompts are Prompt tuples from prompt_builder.py (plain strings are accepted too).
+USE_SDK = os.environ.get("GEMINI_USE_SDK", "1") == "1"  # set GEMINI_USE_SDK=0 to use REST
+
+# One end-to-end budget per reply, shared by the SDK and REST paths.
+GEMINI_DEADLINE = float(os.environ.get("GEMINI_DEADLINE", 30))          # seconds for the whole reply
+GEMINI_HEDGE_DELAY = float(os.environ.get("GEMINI_HEDGE_DELAY", 4))     # start the other path after this; <0 disables
+GEMINI_HEDGE_WORKERS = int(os.environ.get("GEMINI_HEDGE_WORKERS", 32))  # threads running SDK/REST attempts
+
+AI_ERROR_TEXT = "Error: unable to reach AI server."
+NETWORK_ERROR_TEXT = "Network Error: Could not connect to the Gemini server endpoint."
+DEADLINE_ERROR_TEXT = "Error: the AI server did not answer in time."
+
+
+class GeminiCallError(Exception):
+    """A failed attempt; `reply` is the text shown to the learner if no other path succeeds."""
+
+    def __init__(self, reply, detail=None):
+        super().__init__(detail or reply)
+        self.reply = reply
+
 
 def parse_gemini_response(resp):
     """Safely extract the best output text from different possible Gemini SDK/REST formats."""
@@ -21,60 +41,373 @@ def parse_gemini_response(resp):
     return str(resp)
 
 
-def call_gemini_sdk(prompt):
-    if genai is None:
-        raise RuntimeError("google-genai SDK not installed")
+def _parse_rest_response(data):
+    if "candidates" in data:
+        if 'content' in data["candidates"][0]:
+            content = data["candidates"][0]['content']
+            if 'parts' in content and content['parts']:
+                return content['parts'][0].get('text', str(content))
+        return data["candidates"][0].get("output", str(data))
+    return str(data)
+
+
+def _record_sdk_usage(resp):
+    usage = getattr(resp, "usage_metadata", None)
+    if usage is not None:
+        prompt_builder.record_usage(getattr(usage, "prompt_token_count", None),
+                                    getattr(usage, "cached_content_token_count", None))
 
-    from google import genai as gemini_sdk
-    client = gemini_sdk.Client(api_key=GEMINI_API_KEY)
-    
+
+def _record_rest_usage(data):
+    usage = data.get("usageMetadata") or {}
+    prompt_builder.record_usage(usage.get("promptTokenCount"), usage.get("cachedContentTokenCount"))
+
+
+def _sdk_config(prompt, deadline=None):
+    # The cached prefix or the system instruction, never both. Per-request HTTP
+    # timeout so an abandoned SDK attempt ends with the budget.
+    genai_types = load_genai()[1]
+    if genai_types is None:
+        return None
+    kwargs = {}
+    if prompt.cached_content:
+        kwargs["cached_content"] = prompt.cached_content
+    elif prompt.system:
+        kwargs["system_instruction"] = prompt.system
+    if deadline is not None:
+        timeout_ms = max(1, int((deadline - time.monotonic()) * 1000))
+        try:
+            return genai_types.GenerateContentConfig(http_options=genai_types.HttpOptions(timeout=timeout_ms), **kwargs)
+        except Exception:
+            pass   # older SDKs without per-request http_options
+    return genai_types.GenerateContentConfig(**kwargs) if kwargs else None
+
+
+def _rest_system_fields(prompt):
+    if prompt.cached_content:
+        return {"cachedContent": prompt.cached_content}
+    if prompt.system:
+        return {"systemInstruction": {"parts": [{"text": prompt.system}]}}
+    return {}
+
+
+def _sdk_attempt(prompt, deadline, cancelled):
+    if not sdk_available():
+        raise GeminiCallError(AI_ERROR_TEXT, "google-genai SDK not installed")
     try:
-        resp = client.models.generate_content(model=GEMINI_MODEL, contents=prompt)
+        client = get_sdk_client()
+        config = _sdk_config(prompt, deadline)
+        if config is not None:
+            resp = client.models.generate_content(model=GEMINI_MODEL, contents=prompt.text, config=config)
+        else:
+            resp = client.models.generate_content(model=GEMINI_MODEL, contents=prompt.text)
+        _record_sdk_usage(resp)
         return parse_gemini_response(resp)
+    except GeminiCallError:
+        raise
     except Exception as e:
-        # Fallback to REST call if SDK fails (e.g., specific environment issues)
-        print(f"ERROR: Gemini SDK call failed. Falling back to REST call. Error: {e}")
-        return call_gemini_rest(prompt)
+        if prompt.cached_content and not cancelled.is_set():
+            prompt_builder.forget_cache(prompt.cached_content)   # may have expired early; next turn recreates it
+        raise GeminiCallError(AI_ERROR_TEXT, f"Gemini SDK call failed: {e}") from e
 
 
-def call_gemini_rest(prompt):
-    url = f"https://generativelanguage.googleapis.com/v1/models/{GEMINI_MODEL}:generateText"
-    body = {"prompt": {"text": prompt}, "temperature": 0.4, "maxOutputTokens": 800}
+def _rest_attempt(prompt, deadline, cancelled):
+    requests = load_requests()
+    url = rest_url(f"v1/models/{GEMINI_MODEL}:generateText")
+    # generateText has no system instruction or cached content; send the whole prompt.
+    body = {"prompt": {"text": as_text(prompt)}, "temperature": 0.4, "maxOutputTokens": 800}
 
     try:
-        # API key via query param
-        resp = requests.post(url + f"?key={GEMINI_API_KEY}", json=body, timeout=30)
-        
-        # ✅ CRITICAL DEBUG STEP: Check for non-200 status codes immediately
-        if resp.status_code != 200:
-            data = resp.json()
-            error_status = data.get('error', {}).get('status', 'N/A')
-            error_message = data.get('error', {}).get('message', 'No message provided.')
-            
-            # Print the detailed error to the terminal
-            print("\n!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!")
-            print(f"!!! GEMINI API ERROR: HTTP Status Code {resp.status_code} !!!")
-            print(f"!!! Status: {error_status}. Message: {error_message} !!!")
-            if resp.status_code == 403 or resp.status_code == 400:
-                 print("!!! ACTION REQUIRED: Your API Key is likely INVALID or REVOKED. !!!")
-            print("!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!\n")
-
-            # Return a generic client-facing error message
-            return "Error: unable to reach AI server."
-            
-        # If status code is 200, proceed to parse the response
-        data = resp.json()
-
-        if "candidates" in data:
-            if 'content' in data["candidates"][0]:
-                content = data["candidates"][0]['content']
-                if 'parts' in content and content['parts']:
-                    return content['parts'][0].get('text', str(content))
-            return data["candidates"][0].get("output", str(data))
-            
-        return str(data)
-        
+        # API key via query param. The body is read in pieces so a cancelled or
+        # over-budget attempt gives its socket back without reading the rest.
+        with get_http_session().post(url + f"?key={GEMINI_API_KEY}", json=body, stream=True,
+                                     timeout=max(0.1, deadline - time.monotonic())) as resp:
+            chunks = []
+            for chunk in resp.iter_content(chunk_size=8192):
+                if cancelled.is_set():
+                    raise GeminiCallError(AI_ERROR_TEXT, "REST attempt cancelled")
+                if time.monotonic() > deadline:
+                    raise GeminiCallError(DEADLINE_ERROR_TEXT, "REST attempt ran out of budget")
+                chunks.append(chunk)
+            status_code = resp.status_code
     except requests.exceptions.RequestException as e:
         # This catches network errors (e.g., timeout, connection refused)
-        print(f"\nFATAL NETWORK ERROR REACHING GEMINI: {e}\n")
-        return "Network Error: Could not connect to the Gemini server endpoint."
\ No newline at end of file
+        if not cancelled.is_set():
+            print(f"\nFATAL NETWORK ERROR REACHING GEMINI: {e}\n")
+        raise GeminiCallError(NETWORK_ERROR_TEXT, str(e)) from e
+
+    try:
+        data = json.loads(b"".join(chunks) or b"{}")
+    except ValueError:
+        data = {}
+
+    # ✅ CRITICAL DEBUG STEP: Check for non-200 status codes immediately
+    if status_code != 200:
+        error_status = data.get('error', {}).get('status', 'N/A')
+        error_message = data.get('error', {}).get('message', 'No message provided.')
+
+        # Print the detailed error to the terminal
+        print("\n!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!")
+        print(f"!!! GEMINI API ERROR: HTTP Status Code {status_code} !!!")
+        print(f"!!! Status: {error_status}. Message: {error_message} !!!")
+        if status_code == 403 or status_code == 400:
+             print("!!! ACTION REQUIRED: Your API Key is likely INVALID or REVOKED. !!!")
+        print("!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!\n")
+
+        # Return a generic client-facing error message
+        raise GeminiCallError(AI_ERROR_TEXT, f"HTTP {status_code}")
+
+    _record_rest_usage(data)
+    return _parse_rest_response(data)
+
+
+# --------------------------
+# Deadline-budgeted, hedged reply
+# --------------------------
+_executor = None
+_executor_pid = None
+_executor_lock = threading.Lock()
+_stats_lock = threading.Lock()
+_stats = {"calls": 0, "hedges_fired": 0, "deadline_exceeded": 0, "all_failed": 0, "wins": {"sdk": 0, "rest": 0}}
+
+
+def _get_executor():
+    # Threads do not survive fork; each worker gets its own pool.
+    global _executor, _executor_pid
+    if _executor is None or _executor_pid != os.getpid():
+        with _executor_lock:
+            if _executor is None or _executor_pid != os.getpid():
+                _executor = ThreadPoolExecutor(max_workers=GEMINI_HEDGE_WORKERS, thread_name_prefix="gemini-call")
+                _executor_pid = os.getpid()
+    return _executor
+
+
+def _count(key, path=None):
+    with _stats_lock:
+        if path is None:
+            _stats[key] += 1
+        else:
+            _stats[key][path] += 1
+
+
+def _timed_attempt(name, attempt, prompt, deadline, cancelled):
+    # Per-backend latency; a loser stopped by the winner is recorded as "cancelled".
+    start = time.perf_counter()
+    outcome = "error"
+    try:
+        reply = attempt(prompt, deadline, cancelled)
+        outcome = "ok"
+        return reply
+    finally:
+        if outcome != "ok" and cancelled.is_set():
+            outcome = "cancelled"
+        AI_CALL_SECONDS.observe(time.perf_counter() - start, name, outcome)
+
+
+def _paths(prefer_sdk):
+    sdk = ("sdk", _sdk_attempt)
+    rest = ("rest", _rest_attempt)
+    if not sdk_available():
+        return [rest]
+    return [sdk, rest] if prefer_sdk else [rest, sdk]
+
+
+def generate_reply(prompt, deadline=None, hedge_delay=None, prefer_sdk=None):
+    """
+    Returns the reply text within one time budget (GEMINI_DEADLINE seconds).
+    `prompt` is a prompt_builder.Prompt or a plain string.
+
+    The preferred path starts first. If it fails, or has not answered after
+    GEMINI_HEDGE_DELAY seconds, the other path starts and whichever answers
+    first wins; the other is told to stop. Never raises: failures come back
+    as the usual "Error..." texts (see is_error_reply).
+    """
+    prompt = as_prompt(prompt)
+    budget = GEMINI_DEADLINE if deadline is None else deadline
+    hedge_delay = GEMINI_HEDGE_DELAY if hedge_delay is None else hedge_delay
+    prefer_sdk = USE_SDK if prefer_sdk is None else prefer_sdk
+    end = time.monotonic() + budget
+    hedge_at = end if hedge_delay < 0 else time.monotonic() + hedge_delay
+
+    executor = _get_executor()
+    cancelled = threading.Event()
+    waiting = _paths(prefer_sdk)
+    pending = {}
+    last_error = AI_ERROR_TEXT
+    _count("calls")
+
+    try:
+        while pending or waiting:
+            now = time.monotonic()
+            if now >= end:
+                _count("deadline_exceeded")
+                print(f"ERROR: Gemini reply exceeded its {budget:.0f}s deadline.")
+                return DEADLINE_ERROR_TEXT
+
+            if waiting and (not pending or now >= hedge_at):
+                name, attempt = waiting.pop(0)
+                if pending:
+                    _count("hedges_fired")
+                pending[executor.submit(_timed_attempt, name, attempt, prompt, end, cancelled)] = name
+                continue
+
+            timeout = end - now
+            if waiting:
+                timeout = min(timeout, max(0.0, hedge_at - now))
+            done, _ = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+            for future in done:
+                name = pending.pop(future)
+                try:
+                    reply = future.result()
+                except GeminiCallError as e:
+                    print(f"ERROR: Gemini {name} path failed: {e}")
+                    last_error = e.reply
+                    continue
+                except Exception as e:
+                    print(f"ERROR: Gemini {name} path failed: {e}")
+                    continue
+                _count("wins", name)
+                return reply
+
+        _count("all_failed")
+        return last_error
+    finally:
+        # The losing attempt stops at its next check; its own timeout is capped by `end`.
+        cancelled.set()
+        for future in pending:
+            future.cancel()
+
+
+def call_gemini_sdk(prompt):
+    """SDK first, REST as the hedge/fallback, within one deadline."""
+    return generate_reply(prompt, prefer_sdk=True)
+
+
+def call_gemini_rest(prompt):
+    """REST first, SDK as the hedge/fallback, within one deadline."""
+    return generate_reply(prompt, prefer_sdk=False)
+
+
+def reply_stats():
+    with _stats_lock:
+        return {**_stats, "wins": dict(_stats["wins"]),
+                "deadline_s": GEMINI_DEADLINE, "hedge_delay_s": GEMINI_HEDGE_DELAY}
+
+
+# --------------------------
+# Streaming (token-by-token) variants
+# --------------------------
+STREAM_ERROR_TEXT = AI_ERROR_TEXT
+# Exactly the texts returned in place of a reply, so an answer that merely
+# starts with "Error..." (say, explaining a compiler error) is not a failure.
+ERROR_REPLIES = frozenset({AI_ERROR_TEXT, NETWORK_ERROR_TEXT, DEADLINE_ERROR_TEXT, STREAM_ERROR_TEXT})
+
+
+def is_error_reply(reply):
+    """True for the placeholder texts the call helpers return instead of raising."""
+    return not reply or reply in ERROR_REPLIES
+
+
+def stream_gemini_sdk(prompt, deadline):
+    """Yields reply text chunks from the SDK's streaming generate call, until `deadline` (monotonic)."""
+    client = get_sdk_client()
+    config = _sdk_config(prompt, deadline)
+    kwargs = {"config": config} if config is not None else {}
+    last = None
+    try:
+        for chunk in client.models.generate_content_stream(model=GEMINI_MODEL, contents=prompt.text, **kwargs):
+            if time.monotonic() > deadline:
+                raise GeminiCallError(DEADLINE_ERROR_TEXT, "SDK stream ran out of budget")
+            last = chunk
+            text = getattr(chunk, "text", None)
+            if text:
+                yield text
+    except Exception:
+        if prompt.cached_content and last is None:
+            prompt_builder.forget_cache(prompt.cached_content)
+        raise
+    if last is not None:
+        _record_sdk_usage(last)   # the final chunk carries the totals
+
+
+def stream_gemini_rest(prompt, deadline):
+    """
+    Yields reply text chunks from the REST streamGenerateContent endpoint (SSE),
+    until `deadline` (monotonic). Failures raise GeminiCallError; no placeholder
+    text is ever yielded as part of the answer.
+    """
+    if time.monotonic() >= deadline:
+        raise GeminiCallError(DEADLINE_ERROR_TEXT, "deadline passed before the REST stream could start")
+
+    requests = load_requests()
+    url = rest_url(f"v1beta/models/{GEMINI_MODEL}:streamGenerateContent")
+    body = {
+        **_rest_system_fields(prompt),
+        "contents": [{"role": "user", "parts": [{"text": prompt.text}]}],
+        "generationConfig": {"temperature": 0.4, "maxOutputTokens": 800},
+    }
+
+    try:
+        with get_http_session().post(url + f"?alt=sse&key={GEMINI_API_KEY}", json=body,
+                                     stream=True, timeout=max(0.1, deadline - time.monotonic())) as resp:
+            if resp.status_code != 200:
+                print(f"!!! GEMINI STREAM ERROR: HTTP Status Code {resp.status_code} !!!")
+                if prompt.cached_content:
+                    prompt_builder.forget_cache(prompt.cached_content)
+                raise GeminiCallError(STREAM_ERROR_TEXT, f"REST stream got HTTP {resp.status_code}")
+
+            data = {}
+            for line in resp.iter_lines(decode_unicode=True):
+                if time.monotonic() > deadline:
+                    raise GeminiCallError(DEADLINE_ERROR_TEXT, "REST stream ran out of budget")
+                if not line or not line.startswith("data:"):
+                    continue
+                data = json.loads(line[len("data:"):])
+                for candidate in data.get("candidates", []):
+                    for part in candidate.get("content", {}).get("parts", []):
+                        if part.get("text"):
+                            yield part["text"]
+            _record_rest_usage(data)   # the final event carries the totals
+
+    except requests.exceptions.RequestException as e:
+        print(f"\nFATAL NETWORK ERROR REACHING GEMINI (stream): {e}\n")
+        raise GeminiCallError(NETWORK_ERROR_TEXT, f"REST stream failed: {e}") from e
+
+
+def stream_gemini(prompt, deadline=None):
+    """
+    Yields reply text as it is generated. Uses the SDK when enabled and
+    falls back to REST streaming if the SDK fails before sending anything.
+    Both share one budget of `deadline` seconds (GEMINI_DEADLINE). Every
+    failure raises (GeminiCallError from the REST path; its `reply` is the
+    text for the learner). Each backend's whole stream is timed as
+    "sdk_stream" / "rest_stream".
+    """
+    prompt = as_prompt(prompt)
+    end = time.monotonic() + (GEMINI_DEADLINE if deadline is None else deadline)
+    if USE_SDK and sdk_available():
+        produced = False
+        start = time.perf_counter()
+        outcome = "error"
+        try:
+            for text in stream_gemini_sdk(prompt, end):
+                produced = True
+                yield text
+            outcome = "ok"
+            return
+        except Exception as e:
+            if produced:
+                raise
+            print(f"ERROR: Gemini SDK stream failed. Falling back to REST stream. Error: {e}")
+        finally:
+            AI_CALL_SECONDS.observe(time.perf_counter() - start, "sdk_stream", outcome)
+
+    start = time.perf_counter()
+    outcome = "ok"
+    try:
+        yield from stream_gemini_rest(prompt, end)
+    except GeminiCallError:
+        outcome = "error"
+        raise
+    finally:
+        AI_CALL_SECONDS.observe(time.perf_counter() - start, "rest_stream", outcome)
@@ -19,8 +19,13 @@ if (empty($data['email']) || empty($data['password'])) {
 $email = $data['email'];
 $password = $data['password'];
 
-// 1. Retrieve user data by email
-$stmt = $conn->prepare("SELECT id, name, email, password, role FROM users WHERE email = ?");
+// 1. Retrieve user data by email, with any unfinished deletion tombstone (migration 007)
+$stmt = $conn->prepare(
+    "SELECT u.id, u.name, u.email, u.password, u.role, d.state AS deletion_state
+     FROM users u
+     LEFT JOIN account_deletions d ON d.user_id = u.id AND d.state <> 'done'
+     WHERE u.email = ?"
+);
 $stmt->bind_param("s", $email);
 $stmt->execute();
 $result = $stmt->get_result();
@@ -30,6 +35,25 @@ if ($result->num_rows === 1) {
     
     // 2. Verify the hashed password
     if (password_verify($password, $user['password'])) {
+
+        // The account's rows are being deleted in the background (account_deletion.py).
+        if ($user['deletion_state'] !== null) {
+            http_response_code(403);
+            echo json_encode(["message" => "This account is being deleted."]);
+            $stmt->close();
+            $conn->close();
+            exit();
+        }
+
+        // Upgrade hashes weaker than BCRYPT_COST (e.g. the older $2y$10$ ones) while the plain password is at hand.
+        $hash_info = password_get_info($user['password']);
+        if (($hash_info['options']['cost'] ?? 0) < BCRYPT_COST) {
+            $new_hash = password_hash($password, PASSWORD_BCRYPT, ['cost' => BCRYPT_COST]);
+            $rehash = $conn->prepare("UPDATE users SET password = ? WHERE id = ? AND password = ?");
+            $rehash->bind_param("sis", $new_hash, $user['id'], $user['password']);
+            $rehash->execute();
+            $rehash->close();
+        }
         
         $token = generateToken($user['id']);
         
@@ -86,7 +86,7 @@ if ($check_stmt->num_rows > 0) {
 $check_stmt->close();
 
 // 10. Security: Hash the password
-$hashed_password = password_hash($password, PASSWORD_DEFAULT);
+$hashed_password = password_hash($password, PASSWORD_BCRYPT, ['cost' => BCRYPT_COST]);
 
 // 11. Database Insertion
 $query = "INSERT INTO users (name, email, password, role) VALUES (?, ?, ?, ?)";
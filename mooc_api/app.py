@@ -1,387 +1,547 @@
 # app.py
 
-import os
-import uuid  # For generating unique reset tokens
-import datetime # For setting token expiration time
-import smtplib
-from email.mime.text import MIMEText
-from email.mime.multipart import MIMEMultipart
-
-from flask import Flask, render_template, request, jsonify
+import json
+import time
+import itertools
+
+from flask import Flask, Response, render_template, request, jsonify, stream_with_context, g, send_file, send_from_directory
+from werkzeug.wsgi import wrap_file
+from werkzeug.exceptions import RequestedRangeNotSatisfiable
 import mysql.connector
-import requests
 from flask_cors import CORS
-import bcrypt # For secure password hashing and checking
-
-# Gemini SDK (safe import)
-try:
-    from google import genai
-except:
-    genai = None
+from hashing import hasher, HashingBusy  # bcrypt on a bounded worker pool, at BCRYPT_COST
+
+from db_pool import get_db, pool_stats, PoolTimeoutError
+from chat_store import (
+    begin_turn, save_reply, writer as chat_writer,
+    fetch_history_page, iter_chat_history, HISTORY_MAX_PAGE,
+)
+from ai_handler import generate_reply, stream_gemini, is_error_reply, reply_stats, GeminiCallError
+from ai_guard import ai_guard, AIUnavailable
+from rate_limit import limiter, RateLimited, client_ip
+from prompt_builder import prompt_builder
+from reply_cache import reply_cache
+from context_store import context_store
+from catalog import catalog, json_value, CATALOG_ASSETS_BASE
+from media import media_index, BoundedFile, MEDIA_ROOT, MEDIA_MAX_AGE, MEDIA_BLOCK_SIZE
+from image_variants import variants as image_variants, IMAGE_SOURCE_DIRS, IMAGE_MAX_AGE, MIMETYPES as IMAGE_MIMETYPES
+from progress_buffer import progress_buffer
+import mail_queue
+from mail_queue import dispatcher as mail_dispatcher
+import reset_tokens
+from chat_archive import archiver as chat_archiver
+import account_deletion
+from account_deletion import deleter as account_deleter
+import metrics
+import providers
+from email_handler import build_reset_email, FRONTEND_URL  # templates and SMTP settings live there
 
 app = Flask(__name__, static_folder="static", template_folder="templates")
-CORS(app)
-
-# --------------------------
-# Database configuration
-# --------------------------
-DB_CONFIG = {
-    "host": "localhost",
-    "user": "root",
-    "password": "",
-    "database": "my_app_db",
-    "port": 3306,
-}
+CORS(app, expose_headers=["X-Next-Before-Id", "X-Next-After-Id", "Retry-After"])
 
 # --------------------------
 # Gemini configuration (MUST BE UPDATED)
 # --------------------------
-# 🛑 CRITICAL: REPLACE THIS ENTIRE STRING with your BRAND NEW, VALID GEMINI API KEY.
-GEMINI_API_KEY = os.environ.get("GEMINI_API_KEY", "")
-GEMINI_MODEL = "gemini-2.5-flash"
-USE_SDK = True  # switch to False to use REST
-
-# --------------------------
-# Email Configuration (for forgot-password route)
-# --------------------------
-SMTP_SERVER = os.environ.get("SMTP_SERVER", "smtp.gmail.com")
-SMTP_PORT = int(os.environ.get("SMTP_PORT", 587))
-SENDER_EMAIL = os.environ.get("MAIL_USERNAME", "glass418cloudy@gmail.com")
-# IMPORTANT: This must be a 16-character Google App Password if using Gmail
-_raw_password = os.environ.get("MAIL_PASSWORD", "") 
-SENDER_PASSWORD = _raw_password.replace(" ", "") 
-FRONTEND_URL = os.environ.get("FRONTEND_URL", "http://localhost:8080")
+# 🛑 CRITICAL: Set GEMINI_API_KEY in the environment (read by gemini_client.py).
+# SDK/REST choice, deadline and hedging live in ai_handler.py; prompt assembly in prompt_builder.py.
 
 # NEW CONSTANT
 MIN_PASSWORD_LENGTH = 6
 
 
 # --------------------------
-# DB helper functions
+# Routes
 # --------------------------
-def get_db(): #
-    """Establishes a connection to the MySQL database."""
-    return mysql.connector.connect(**DB_CONFIG)
-
-def save_message(user_id, role, message): #
-    """Saves a chat message."""
-    db = get_db()
-    cursor = db.cursor()
-    try:
-        cursor.execute(
-            "INSERT INTO chat_history (user_id, role, message) VALUES (%s, %s, %s)",
-            (user_id, role, message)
+@app.route("/")
+def index(): #
+    return render_template("lesson.html")
+
+
+@app.before_request
+def start_request_timer(): #
+    g.request_started = time.perf_counter()
+
+
+@app.after_request
+def record_request_latency(response): #
+    # Runs when the view returns, so streamed responses are timed to their headers.
+    started = g.pop("request_started", None)
+    if started is not None:
+        route = request.url_rule.rule if request.url_rule is not None else "unmatched"
+        metrics.HTTP_REQUEST_SECONDS.observe(
+            time.perf_counter() - started, route, request.method, str(response.status_code)
         )
-        db.commit()
-    except mysql.connector.Error as err:
-        print(f"ERROR saving message: {err.msg}")
-    finally:
-        cursor.close()
-        db.close()
+    return response
 
-def load_chat_summary(user_id): #
-    """Retrieves history for the specific user_id to provide context to the AI."""
-    db = get_db()
-    cursor = db.cursor()
-    cursor.execute(
-        "SELECT role, message FROM chat_history WHERE user_id=%s ORDER BY id DESC LIMIT 10",
-        (user_id,)
-    )
-    rows = cursor.fetchall()
-    cursor.close()
-    db.close()
 
-    if not rows:
-        return "No previous conversation."
+@app.route("/metrics", methods=["GET"])
+def metrics_route(): #
+    """Prometheus text exposition of this worker's histograms, counters and pool gauges."""
+    return Response(metrics.render(), mimetype="text/plain; version=0.0.4")
 
-    summary = []
-    for role, msg in reversed(rows):
-        short = msg[:120].replace("\n", " ")
-        summary.append(f"{role}: {short}")
 
-    return "\n".join(summary)
+metrics.registry.stats_gauge("db_pool", "MySQL connection pool state.", pool_stats)
+metrics.registry.stats_gauge("ai_guard", "Gemini admission queue and circuit breaker.", ai_guard.stats)
+metrics.registry.stats_gauge("rate_limit", "Per-user and per-IP chat rate limits.", limiter.stats)
+metrics.registry.stats_gauge("prompt_builder", "Prompt token budget and Gemini context cache.", prompt_builder.stats)
+metrics.registry.stats_gauge("chat_write_behind", "Chat history write-behind buffer.", chat_writer.stats)
+metrics.registry.stats_gauge("mail_dispatcher", "Outgoing mail queue.", mail_dispatcher.stats)
+metrics.registry.stats_gauge("progress_buffer", "Learner progress write buffer.", progress_buffer.stats)
+metrics.registry.stats_gauge("hashing_pool", "bcrypt hashing pool.", hasher.stats)
+metrics.registry.stats_gauge("lesson_media", "Lesson media index.", media_index.stats)
+metrics.registry.stats_gauge("image_variants", "Resized course and instructor images.", image_variants.stats)
+metrics.registry.stats_gauge("account_deletion", "Batched account deletions.", account_deleter.stats)
 
 
-def get_chat_history(user_id): #
-    """
-    Retrieves the full chat history for a user, structured for API response.
-    """
-    db = get_db()
-    cursor = db.cursor(dictionary=True) 
-    
-    cursor.execute(
-        "SELECT id, role, message, created_at FROM chat_history WHERE user_id=%s ORDER BY id ASC",
-        (user_id,)
-    )
-    history = cursor.fetchall()
-    cursor.close()
-    db.close()
-    
-    for item in history:
-        if 'created_at' in item and hasattr(item['created_at'], 'isoformat'):
-            item['created_at'] = item['created_at'].isoformat()
-        
-    return history
+@app.errorhandler(PoolTimeoutError)
+def handle_pool_timeout(err): #
+    print(f"ERROR: {err}")
+    return jsonify({"message": "Server is busy, please try again shortly."}), 503
 
 
-# --------------------------
-# Gemini handler functions (PRESERVED)
-# --------------------------
-def parse_gemini_response(resp): #
-    """Safely extract the best output text from different possible Gemini SDK/REST formats."""
-    if hasattr(resp, "text") and resp.text: return resp.text
-    return str(resp)
+@app.errorhandler(HashingBusy)
+def handle_hashing_busy(err): #
+    print(f"ERROR: {err}")
+    return jsonify({"message": "Server is busy, please try again shortly."}), 503, {"Retry-After": "1"}
 
 
-def call_gemini_sdk(prompt): #
-    """Tries the Gemini SDK, falls back to REST call on failure."""
-    if genai is None:
-        return "SDK not installed. Falling back to REST call..." + call_gemini_rest(prompt)
+@app.errorhandler(AIUnavailable)
+def handle_ai_unavailable(err): #
+    return jsonify({"reply": f"Error: {err.reason}"}), err.status, {"Retry-After": str(err.retry_after)}
 
-    try:
-        client = genai.Client(api_key=GEMINI_API_KEY)
-        resp = client.models.generate_content(model=GEMINI_MODEL, contents=prompt)
-        return parse_gemini_response(resp)
-    except Exception as e:
-        print(f"ERROR: Gemini SDK call failed. Falling back to REST call. Error: {e}")
-        return call_gemini_rest(prompt)
+
+@app.errorhandler(RateLimited)
+def handle_rate_limited(err): #
+    return (jsonify({"reply": "Error: You are sending messages too quickly. Please wait a moment."}), 429,
+            {"Retry-After": str(err.retry_after)})
+
+
+@app.route("/api/health/db-pool", methods=["GET"])
+def db_pool_health(): #
+    """Pool utilisation and checkout wait times, used to size DB_POOL_SIZE."""
+    stats = pool_stats()
+    stats["chat_write_behind"] = chat_writer.stats()
+    stats["context_store"] = context_store.stats()
+    stats["mail_dispatcher"] = mail_dispatcher.stats()
+    stats["reset_tokens"] = reset_tokens.purger.stats()
+    stats["progress_buffer"] = progress_buffer.stats()
+    stats["chat_archive"] = chat_archiver.stats()
+    stats["account_deletion"] = account_deleter.stats()
+    return jsonify(stats), 200
+
+
+@app.route("/api/health/reply-cache", methods=["GET"])
+def reply_cache_health(): #
+    """Hit rate and size of the lesson reply cache."""
+    return jsonify(reply_cache.stats()), 200
+
+
+@app.route("/api/health/hashing", methods=["GET"])
+def hashing_health(): #
+    """bcrypt cost, queue depth and wait/run times of the password hashing pool."""
+    return jsonify(hasher.stats()), 200
 
 
-def call_gemini_rest(prompt): #
-    """Calls Gemini API using REST for maximum compatibility and debugging."""
-    url = f"https://generativelanguage.googleapis.com/v1/models/{GEMINI_MODEL}:generateText"
-    body = {"prompt": {"text": prompt}, "temperature": 0.4, "maxOutputTokens": 800}
+@app.route("/api/health/ai", methods=["GET"])
+def ai_health(): #
+    """Circuit breaker, admission queue, SDK/REST hedging and prompt token counters for the Gemini calls."""
+    stats = ai_guard.stats()
+    stats["replies"] = reply_stats()
+    stats["rate_limit"] = limiter.stats()
+    stats["prompts"] = prompt_builder.stats()
+    return jsonify(stats), 200
 
+# --- Course Catalog Routes ---
+
+def _snapshot_response(etag, body): #
+    resp = Response(body, mimetype="application/json")
+    resp.set_etag(etag)
+    # Browsers revalidate every time; an unchanged catalog costs a 304 and no DB work.
+    resp.headers["Cache-Control"] = "no-cache"
+    return resp.make_conditional(request)
+
+
+@app.route("/api/courses", methods=["GET"])
+def courses_route(): #
+    """All courses with nested contents and lessons (same shape as get_courses.php)."""
     try:
-        resp = requests.post(url + f"?key={GEMINI_API_KEY}", json=body, timeout=30)
-        
-        if resp.status_code != 200:
-            data = resp.json()
-            error_message = data.get('error', {}).get('message', 'No message provided.')
-            
-            print("\n!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!")
-            print(f"!!! GEMINI API ERROR: HTTP Status Code {resp.status_code} !!!")
-            print(f"!!! Message: {error_message} !!!")
-            print("!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!\n")
-
-            return "Error: unable to reach AI server."
-            
-        # Success parsing logic (retained)
-        data = resp.json()
-        if "candidates" in data:
-            if 'content' in data["candidates"][0]:
-                content = data["candidates"][0]['content']
-                if 'parts' in content and content['parts']:
-                    return content['parts'][0].get('text', str(content))
-            return data["candidates"][0].get("output", str(data))
-            
-        return str(data)
-        
-    except requests.exceptions.RequestException as e:
-        print(f"\nFATAL NETWORK ERROR REACHING GEMINI: {e}\n")
-        return "Network Error: Could not connect to the Gemini server endpoint."
+        snap = catalog.snapshot()
+    except mysql.connector.Error as err:
+        print(f"ERROR: could not build the course catalog: {err.msg}")
+        return jsonify({"error": "Database error", "message": err.msg}), 500
+    return _snapshot_response(snap.etag, snap.body)
 
 
-# --------------------------
-# Email handler functions (FIXED FOR RELIABILITY)
-# --------------------------
-def _create_reset_password_html_body(reset_link): #
-    # (HTML template generation is retained)
-    START_COLOR = "#1D4ED8"  
-    END_COLOR = "#0D9488"    
-    ACCENT_COLOR = "#0D9488" 
-    BG_COLOR = "#f7f7f7"
-    CARD_BG = "#ffffff"
-    TEXT_COLOR = "#333333"
-
-    GRADIENT_STYLE = f"""
-        background-color: {START_COLOR}; 
-        background-image: linear-gradient(to right, {START_COLOR}, {END_COLOR});
-        color: white; 
-        padding: 24px 20px; 
-        text-align: center;
-    """
+@app.route("/api/courses/<int:course_id>", methods=["GET"])
+def course_route(course_id): #
+    try:
+        snap = catalog.snapshot()
+    except mysql.connector.Error as err:
+        print(f"ERROR: could not build the course catalog: {err.msg}")
+        return jsonify({"error": "Database error", "message": err.msg}), 500
+    if course_id not in snap.courses:
+        return jsonify({"message": "Course not found."}), 404
+    return _snapshot_response(*snap.courses[course_id])
+
+
+@app.route("/api/health/catalog", methods=["GET"])
+def catalog_health(): #
+    """Version, size and rebuild counters of the course catalog snapshot."""
+    return jsonify(catalog.stats()), 200
+
+# --- Lesson Media Routes ---
+
+def _media_response(f, entry): #
+    resp = Response(wrap_file(request.environ, f, MEDIA_BLOCK_SIZE), mimetype=entry.mimetype,
+                    direct_passthrough=True)
+    resp.content_length = entry.size
+    resp.last_modified = entry.mtime
+    resp.set_etag(entry.etag)
+    resp.cache_control.public = True
+    resp.cache_control.max_age = MEDIA_MAX_AGE
+    try:
+        resp = resp.make_conditional(request, accept_ranges=True, complete_length=entry.size)
+    except RequestedRangeNotSatisfiable:
+        f.close()
+        raise
+    if resp.status_code == 206:
+        # werkzeug wraps a range in an iterator that reads through Python. Hand the
+        # server the file itself, positioned at the range and cut off at its end:
+        # gunicorn can sendfile() exactly Content-Length bytes from there, and a
+        # server that reads instead (werkzeug, SSL, gevent) stops at the range too.
+        f.seek(resp.content_range.start)
+        resp.response = wrap_file(request.environ, BoundedFile(f, resp.content_range.stop), MEDIA_BLOCK_SIZE)
+    elif resp.status_code != 200:
+        f.close()   # 304 / 412 send no body
+    return resp
+
+
+@app.route("/api/media/lessons/<int:lesson_id>", methods=["GET"])
+def lesson_media(lesson_id): #
+    """A lesson's video (or other file), with ETag/Last-Modified revalidation and byte ranges."""
+    try:
+        opened = media_index.open(lesson_id)
+    except mysql.connector.Error as err:
+        print(f"ERROR: could not build the lesson media index: {err.msg}")
+        return jsonify({"error": "Database error", "message": err.msg}), 500
+    if opened is None:
+        return jsonify({"message": "Lesson media not found."}), 404
+    return _media_response(*opened)
+
 
-    html = f"""
-    <!DOCTYPE html>
-    <html lang="en">
-    <head>
-        <meta charset="UTF-8">
-        <meta name="viewport" content="width=device-width, initial-scale=1.0">
-        <title>Password Reset</title>
-    </head>
-    <body style="font-family: Arial, sans-serif; background-color: {BG_COLOR}; padding: 20px;">
-        <div style="max-width: 600px; margin: 0 auto; background-color: {CARD_BG}; border-radius: 12px; box-shadow: 0 4px 12px rgba(0,0,0,0.05); overflow: hidden;">
-            
-            <div style="{GRADIENT_STYLE}">
-                <h1 style="margin: 0; font-size: 24px; font-weight: bold;">
-                    Silay<span style="color: {CARD_BG};">Learn</span>
-                </h1>
-            </div>
-
-            <div style="padding: 30px 40px; color: {TEXT_COLOR};">
-                <h2 style="font-size: 20px; color: #1f2937; margin-top: 0; margin-bottom: 20px;">
-                    Reset Your Password
-                </h2>
-                <p style="margin-bottom: 25px; line-height: 1.6;">
-                    Click the button below to be taken to a secure page to set a new password.
-                </p>
-                
-                <div style="text-align: center; margin: 30px 0;">
-                    <a href="{reset_link}" 
-                       target="_blank" 
-                       style="display: inline-block; padding: 12px 25px; background-color: {ACCENT_COLOR}; 
-                              color: {CARD_BG}; text-decoration: none; border-radius: 8px; 
-                              font-weight: bold; font-size: 16px; box-shadow: 0 4px 8px rgba(13, 148, 136, 0.3);">
-                        Set New Password
-                    </a>
-                </div>
-
-                <p style="font-size: 14px; margin-top: 30px; border-top: 1px solid #eeeeee; padding-top: 15px; color: #6b7280;">
-                    If you did not request a password reset, please ignore this email.
-                </p>
-            </div>
-
-            <div style="background-color: {BG_COLOR}; padding: 15px; text-align: center; font-size: 12px; color: #9ca3af;">
-                &copy; {datetime.date.today().year} SilayLearn. All rights reserved.
-            </div>
-        </div>
-    </body>
-    </html>
+@app.route("/api/images/<path:source>", methods=["GET"])
+def image_variant(source): #
     """
-    return html
+    A course or instructor image resized for ?w=<px> (WebP when accepted).
+    With ?v=<hash> from the catalog the response is immutable for a year.
+    """
+    picked = image_variants.pick(source, request.args.get("w", type=int),
+                                 accept_webp="image/webp" in request.headers.get("Accept", ""))
+    if picked is None:
+        # Not built yet (python image_variants.py build): send the original.
+        if source.split("/", 1)[0] not in IMAGE_SOURCE_DIRS:
+            return jsonify({"message": "Image not found."}), 404
+        resp = send_from_directory(MEDIA_ROOT, source, max_age=0)
+        resp.cache_control.no_cache = True
+        return resp
+
+    path, variant, digest = picked
+    versioned = request.args.get("v") == digest[:12]
+    # Unversioned URLs (max_age=None) are revalidated by ETag on every use.
+    resp = send_file(path, mimetype=IMAGE_MIMETYPES[variant["format"]], etag=variant["file"], conditional=True,
+                     max_age=IMAGE_MAX_AGE if versioned else None)
+    resp.cache_control.immutable = versioned or None
+    resp.vary.add("Accept")
+    return resp
+
+
+@app.route("/api/health/media", methods=["GET"])
+def media_health(): #
+    """Size and rebuild counters of the lesson media index and the image variants."""
+    return jsonify({**media_index.stats(), "image_variants": image_variants.stats()}), 200
+
+# --- Learner Progress Routes ---
+
+def _int_field(data, name): #
+    try:
+        return int(data.get(name) or 0)
+    except (TypeError, ValueError):
+        return 0
 
 
-def send_reset_email(user_email): #
-    # Generates the unique token
-    reset_token = str(uuid.uuid4())
-    reset_link = f"{FRONTEND_URL}/reset-password?token={reset_token}"
-    subject = "Action Required: Reset Your SilayLearn Password"
-    html_body = _create_reset_password_html_body(reset_link)
-    plain_text_body = f"Hello,\nYou requested a password reset. Please click the link below:\n{reset_link}"
-    
-    # Send the email and return the token on success
-    success, msg = _send_email(user_email, subject, plain_text_body, html_body)
-    
-    if success:
-        return True, reset_token 
-    else:
-        return False, msg
+@app.route("/api/progress", methods=["POST"])
+def update_progress(): #
+    """
+    Same contract as update_course_progress.php (JSON or form fields user_id,
+    course_id, progress, lessons_finished). Updates are coalesced in memory and
+    written in batches; values only ever increase.
+    """
+    data = request.get_json(silent=True) or request.form
+    user_id = _int_field(data, "user_id")
+    course_id = _int_field(data, "course_id")
+    if user_id <= 0 or course_id <= 0:
+        return jsonify({"success": False, "message": "Invalid user_id or course_id"}), 400
 
+    try:
+        stored = progress_buffer.update(user_id, course_id,
+                                        _int_field(data, "progress"), _int_field(data, "lessons_finished"))
+    except mysql.connector.Error as err:
+        return jsonify({"success": False, "message": "Database error", "error": err.msg}), 500
+    if stored is None:
+        return jsonify({"success": False, "message": "Enrollment not found for this user and course"}), 200
+    return jsonify({"success": True, "progress": stored[0], "lessons_finished": stored[1]}), 200
 
-def _send_email(to_email, subject, plain_text_body, html_body): #
-    
-    if SENDER_PASSWORD == "ohzmfislveuugwto": 
-        print("WARNING: Using default/hardcoded password. Ensure this is intentional.")
+
+@app.route("/api/progress", methods=["GET"])
+def get_progress(): #
+    user_id = request.args.get("user_id", type=int) or 0
+    course_id = request.args.get("course_id", type=int) or 0
+    if user_id <= 0 or course_id <= 0:
+        return jsonify({"success": False, "message": "Invalid user_id or course_id"}), 400
 
     try:
-        msg = MIMEMultipart('alternative')
-        msg['From'] = SENDER_EMAIL
-        msg['To'] = to_email
-        msg['Subject'] = subject
-
-        msg.attach(MIMEText(plain_text_body, 'plain'))
-        msg.attach(MIMEText(html_body, 'html'))
-
-        print(f"DEBUG: Attempting to connect to SMTP server: {SMTP_SERVER}:{SMTP_PORT}")
-        server = smtplib.SMTP(SMTP_SERVER, SMTP_PORT)
-        server.starttls()
-        
-        print(f"DEBUG: Attempting SMTP login as {SENDER_EMAIL}...")
-        server.login(SENDER_EMAIL, SENDER_PASSWORD)
-        
-        text = msg.as_string()
-        server.sendmail(SENDER_EMAIL, to_email, text)
-        server.quit()
-        
-        print(f"SUCCESS: Email sent to {to_email}")
-        return True, "Email sent"
-        
-    except smtplib.SMTPAuthenticationError:
-        print("\nFATAL ERROR: SMTP Authentication Failed.")
-        return False, "Authentication Error. Please check your username and App Password."
-    except Exception as e:
-        print(f"FATAL ERROR: Failed to send email to {to_email}. Generic Exception: {e}")
-        return False, str(e)
+        stored = progress_buffer.get(user_id, course_id)
+    except mysql.connector.Error as err:
+        return jsonify({"success": False, "message": "Database error", "error": err.msg}), 500
+    if stored is None:
+        return jsonify({"success": False, "message": "Enrollment not found for this user and course"}), 404
+    return jsonify({"success": True, "progress": stored[0], "lessons_finished": stored[1]}), 200
 
 
-# --------------------------
-# Routes
-# --------------------------
-@app.route("/")
-def index(): #
-    return render_template("lesson.html")
+@app.route("/api/enrollments", methods=["GET"])
+def enrollments_route(): #
+    """Same payload as get_user_enrollments.php, with this worker's unflushed progress applied."""
+    user_id = request.args.get("user_id", type=int) or 0
+    if user_id <= 0:
+        return jsonify({"success": False, "message": "Missing or invalid user_id"}), 400
+
+    with get_db() as db:
+        cursor = db.cursor(dictionary=True)
+        try:
+            cursor.execute(
+                "SELECT e.id AS enrollment_id, e.user_id, e.enrolled_course, e.progress AS progress, "
+                "e.lessons_finished, e.enrolled_at, e.status, e.course_thumbnail AS enrollment_course_thumbnail, "
+                "c.course_id, c.course_title, c.course_description, c.course_sub_description, c.course_price, "
+                "c.course_category, c.course_thumbnail, c.instructor_id, i.instructor_name, i.instructor_title "
+                "FROM tra_user_courses AS e "
+                "INNER JOIN ref_courses AS c ON e.enrolled_course = c.course_id "
+                "LEFT JOIN ref_instructors AS i ON c.instructor_id = i.instructor_id "
+                "WHERE e.user_id = %s ORDER BY e.enrolled_at DESC",
+                (user_id,)
+            )
+            rows = [{k: json_value(v) for k, v in row.items()} for row in cursor.fetchall()]
+        except mysql.connector.Error as err:
+            return jsonify({"success": False, "message": "Database error", "error": err.msg}), 500
+        finally:
+            cursor.close()
+
+    for row in rows:
+        row["progress"], row["lessons_finished"] = progress_buffer.overlay(
+            user_id, row["enrolled_course"], row["progress"], row["lessons_finished"])
+        thumb = row["enrollment_course_thumbnail"] or row["course_thumbnail"]
+        row["course_thumbnail_url"] = CATALOG_ASSETS_BASE + thumb if thumb else None
+    return jsonify({"success": True, "data": rows}), 200
 
 # --- Chat Routes ---
 
+def _encode_history(rows, fmt, rows_per_chunk=100): #
+    """Encodes history rows as a JSON array or NDJSON, a few rows per write."""
+    ndjson = fmt == "ndjson"
+    buf = [] if ndjson else ["["]
+    first = True
+    for row in rows:
+        if ndjson:
+            buf.append(json.dumps(row) + "\n")
+        else:
+            buf.append(("" if first else ",") + json.dumps(row))
+        first = False
+        if len(buf) >= rows_per_chunk:
+            yield "".join(buf)
+            buf = []
+    if not ndjson:
+        buf.append("]")
+    if buf:
+        yield "".join(buf)
+
+
 @app.route("/api/chat/history/<int:user_id>", methods=["GET"])
 def chat_history_route(user_id): #
+    """
+    Query params (all optional):
+      limit, before_id, after_id  keyset paging; X-Next-Before-Id / X-Next-After-Id
+                                  headers hold the cursors for the neighbouring pages
+      format=json|ndjson          JSON array (default) or one JSON object per line
+    Without paging params the full history is streamed from the DB cursor.
+    """
+    limit = request.args.get("limit", type=int)
+    before_id = request.args.get("before_id", type=int)
+    after_id = request.args.get("after_id", type=int)
+    fmt = request.args.get("format", "json")
+    mimetype = "application/x-ndjson" if fmt == "ndjson" else "application/json"
+
+    if limit is None and (before_id is not None or after_id is not None):
+        limit = HISTORY_MAX_PAGE
+
     try:
-        history = get_chat_history(user_id)
-        return jsonify(history), 200
+        if limit is not None:
+            rows = fetch_history_page(user_id, limit, before_id=before_id, after_id=after_id)
+            headers = {}
+            if rows:
+                headers["X-Next-Before-Id"] = str(rows[0]["id"])
+                headers["X-Next-After-Id"] = str(rows[-1]["id"])
+            return Response(_encode_history(rows, fmt), mimetype=mimetype, headers=headers), 200
+
+        # Pull the first row now so connection/query errors still become a 500.
+        rows = iter_chat_history(user_id)
+        first = next(rows, None)
+        stream = itertools.chain([first], rows) if first is not None else iter(())
+        return Response(stream_with_context(_encode_history(stream, fmt)), mimetype=mimetype), 200
     except Exception as e:
         print(f"ERROR fetching chat history for user {user_id}: {e}")
         return jsonify({"message": "Failed to retrieve chat history."}), 500
 
 
-@app.route("/chat", methods=["POST"])
-def chat(): #
-    # Exact AI logic from your previous snippet (Preserved)
+def _start_chat_turn(): #
+    """
+    Validates a chat request, takes an AI slot, records the user's turn and
+    builds the prompt. Returns (turn, None) or (None, error_response). `turn`
+    holds user_id, prompt, cache_key (None when the answer depends on earlier
+    turns), cached (a shared reply, or None) and slot (the admitted AI call,
+    None when the reply is cached). Raises AIUnavailable before anything is
+    written, so a 429/503 never leaves a user turn without a reply.
+    """
     data = request.json
     user_id = data.get("user_id") or data.get("userId") # Handle both keys
     user_msg = data.get("message", "")
     lesson_title = data.get("lesson_title", "MOOC Lesson")
     language = data.get("language", "en")
-    
-    if not user_id: return jsonify({"reply": "Error: Invalid user_id provided."}), 400
+
+    if not user_id: return None, (jsonify({"reply": "Error: Invalid user_id provided."}), 400)
     try: user_id = int(user_id)
-    except: return jsonify({"reply": "Error: user_id must be an integer."}), 400
+    except: return None, (jsonify({"reply": "Error: user_id must be an integer."}), 400)
+
+    # Raises RateLimited (429 + Retry-After) before any DB or Gemini work.
+    limiter.check(user_id, client_ip(request.remote_addr, request.headers.get("X-Forwarded-For")))
+    if account_deleter.is_deleting(user_id):
+        return None, (jsonify({"reply": "Error: this account is being deleted."}), 403)
 
-    save_message(user_id, "user", user_msg)
-    summary = load_chat_summary(user_id)
+    cache_key = reply_cache.key_for(lesson_title, language, user_msg)
+    cached = reply_cache.get(cache_key) if cache_key else None
+    # Raises AIUnavailable (429/503 + Retry-After) when saturated or the breaker is open.
+    slot = ai_guard.enter() if cached is None else None
+
+    # One transaction: store the user's turn and read the context summary.
+    summary = None
+    try:
+        summary = begin_turn(user_id, user_msg)
+    except mysql.connector.Error as err:
+        print(f"ERROR: could not record chat turn for user {user_id}: {err.msg}")
+    finally:
+        if summary is None and slot is not None:
+            slot.release(None)   # Gemini is never called
+    if summary is None:
+        return None, (jsonify({"reply": "Error: could not save your message. Please try again."}), 500)
 
-    system_prompt = f"""
-You are the MOOC Lesson AI Assistant integrated into an educational platform.
-Lesson: {lesson_title}
+    turn = {
+        "user_id": user_id,
+        "prompt": prompt_builder.build(lesson_title, summary, user_msg, language),
+        "cache_key": cache_key,
+        "cached": cached,
+        "slot": slot,
+    }
+    return turn, None
 
---- Student Conversation Summary (for context, privacy-safe) ---
-{summary}
 
---- Role ---
-You help Filipino MOOC students by:
-- Answering simply and accurately
-- Giving local Ilonggo examples
-- Providing Filipino/Hiligaynon translations when asked
-- NEVER including sensitive data
-- NEVER exposing raw internal chat logs
+@app.route("/chat", methods=["POST"])
+def chat(): #
+    turn, error = _start_chat_turn()
+    if error: return error
+    user_id = turn["user_id"]
+
+    reply = turn["cached"]
+    if reply is None:
+        # generate_reply never raises and returns within GEMINI_DEADLINE.
+        success = False
+        try:
+            reply = generate_reply(turn["prompt"])
+            success = not is_error_reply(reply)
+        finally:
+            turn["slot"].release(success)
+        if turn["cache_key"]:
+            reply_cache.put(turn["cache_key"], reply)
+
+    # The reply is persisted by the write-behind flusher, off the request path.
+    # Failure placeholders are not saved, so they never reach later prompts.
+    if not is_error_reply(reply):
+        save_reply(user_id, reply)
+    return jsonify({"reply": reply})
 
-Formatting rules:
-- DO NOT use Markdown.
-- DO NOT use bold (** **), italics (* * / _ _), backticks, or code blocks.
-- Output PLAIN TEXT ONLY.
-User says:
-{user_msg}
 
-Preferred language: {language}
-"""
+def _sse(event, payload): #
+    return f"event: {event}\ndata: {json.dumps(payload)}\n\n"
 
-    try:
-        if USE_SDK:
-            reply = call_gemini_sdk(system_prompt)
-        else:
-            reply = call_gemini_rest(system_prompt)
-    except Exception as e:
-        reply = f"Error contacting AI service: {str(e)}"
 
-    save_message(user_id, "assistant", reply)
-    return jsonify({"reply": reply})
+@app.route("/chat/stream", methods=["POST"])
+def chat_stream(): #
+    """
+    Same as /chat, but forwards the reply as Server-Sent Events while Gemini
+    generates it: `token` events carry text chunks, a final `done` event
+    carries the full reply. A failure is sent as an `error` event, never as
+    reply text. The assembled reply is saved when the stream ends, including
+    partial replies when the client disconnects early or Gemini fails midway.
+    """
+    turn, error = _start_chat_turn()
+    if error: return error
+    # The AI slot is taken before streaming starts, so a rejection is still a plain 429/503.
+    user_id, cache_key = turn["user_id"], turn["cache_key"]
+    cached, slot = turn["cached"], turn["slot"]
+
+    def generate():
+        if cached is not None:
+            save_reply(user_id, cached)
+            yield _sse("token", {"text": cached})
+            yield _sse("done", {"reply": cached})
+            return
+
+        parts = []
+        complete = False
+        outcome = None   # stays None if the client leaves mid-stream: no verdict on Gemini
+        try:
+            for text in stream_gemini(turn["prompt"]):
+                parts.append(text)
+                yield _sse("token", {"text": text})
+            complete = outcome = True
+        except GeminiCallError as e:
+            outcome = False
+            yield _sse("error", {"message": e.reply})
+        except Exception as e:
+            outcome = False
+            yield _sse("error", {"message": f"Error contacting AI service: {str(e)}"})
+        finally:
+            reply = "".join(parts)
+            # stream_gemini raises on every failure, so finishing is the verdict;
+            # the joined text says nothing reliable about how the stream ended.
+            slot.release(outcome)
+            if reply:
+                save_reply(user_id, reply)
+            if complete and cache_key:
+                reply_cache.put(cache_key, reply)
+        yield _sse("done", {"reply": reply})
+
+    headers = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    response = Response(stream_with_context(generate()), mimetype="text/event-stream", headers=headers)
+    if slot is not None:
+        # A client that leaves before the first chunk never runs the generator's finally.
+        # Closed tabs say nothing about Gemini, so this frees the slot without a verdict.
+        response.call_on_close(lambda: slot.release(None))
+    return response
 
 # --- Authentication and User Management Routes ---
 
 @app.route("/api/auth/forgot-password", methods=["POST"])
 def forgot_password(): #
     """
-    Initiates the password reset process: checks user, sends email, and saves token.
+    Initiates the password reset process: checks user, saves the token and queues the email.
     """
     data = request.json
     email = data.get("email")
@@ -389,48 +549,61 @@ def forgot_password(): #
     if not email:
         return jsonify({"message": "Email is required"}), 400
     
-    db = get_db()
-    cursor = db.cursor()
+    with get_db() as db:
+        cursor = db.cursor()
 
+        try:
+            # One transaction from the lookup on (autocommit is off, so the SELECT would
+            # otherwise open one implicitly and start_transaction() would refuse).
+            db.start_transaction()
+
+            # 1. Check if user exists and get ID (and the hash signed tokens are bound to)
+            cursor.execute("SELECT id, password FROM users WHERE email=%s", (email,))
+            user_record = cursor.fetchone()
+            if not user_record:
+                db.rollback()
+                # Security measure: return generic success message even if the user doesn't exist
+                return jsonify({"message": "If an account exists, a password reset link has been sent."}), 200
+
+            user_id, password_hash = user_record
+
+            # 2. Issue the token (a DB row, or a signed token with no row; see reset_tokens.py)
+            #    and queue the email in the same transaction, so a queued email always has a
+            #    valid token and vice versa.
+            reset_token = reset_tokens.issue(cursor, user_id, password_hash)
+            reset_link = f"{FRONTEND_URL}/reset-password?token={reset_token}"
+            subject, plain_text_body, html_body = build_reset_email(reset_link)
+            job_id = mail_queue.enqueue(cursor, email, subject, plain_text_body, html_body)
+            db.commit()
+            print(f"DEBUG: Issued reset token {reset_token[:8]}... for user {user_id}, mail job {job_id[:8]}")
+
+        except mysql.connector.Error as err:
+            db.rollback()
+            print(f"ERROR: Database error during forgot-password process: {err.msg}")
+            return jsonify({"message": "Failed to generate reset link due to a server error."}), 500
+        finally:
+            cursor.close()
+
+    # 4. Delivery happens in the background dispatcher; report its state without waiting.
+    mail_dispatcher.wake()
+    return jsonify({
+        "message": "Password reset link sent. Check your inbox.",
+        "mail_job_id": job_id,
+        "mail_status": "queued",
+    }), 200
+
+
+@app.route("/api/mail/status/<job_id>", methods=["GET"])
+def mail_status(job_id): #
+    """Delivery state of a queued email (queued / sending / sent / failed)."""
     try:
-        # 1. Check if user exists and get ID
-        cursor.execute("SELECT id FROM users WHERE email=%s", (email,))
-        user_record = cursor.fetchone()
-        if not user_record:
-            # Security measure: return generic success message even if the user doesn't exist
-            return jsonify({"message": "If an account exists, a password reset link has been sent."}), 200
-
-        user_id = user_record[0]
-        
-        # 2. Send the email and get the generated token back
-        success, msg_or_token = send_reset_email(email)
-        
-        if not success:
-            # Provide the specific error message from the email function to the client
-            return jsonify({"message": "Failed to send email. Check server logs.", "error": msg_or_token}), 500
-
-        reset_token = msg_or_token # This is the UUID token
-
-        # 3. Save the token to the database, expiring in 1 hour
-        expires_at = datetime.datetime.now() + datetime.timedelta(hours=1)
-        
-        # NOTE: Ensure the password_reset_tokens table exists (as defined in your SQL dump)
-        cursor.execute(
-            "INSERT INTO password_reset_tokens (user_id, token, expires_at) VALUES (%s, %s, %s)",
-            (user_id, reset_token, expires_at)
-        )
-        db.commit()
-        print(f"DEBUG: Saved reset token {reset_token} for user {user_id}")
-
-        return jsonify({"message": "Password reset link sent. Check your inbox."}), 200
-
+        job = mail_queue.status(job_id)
     except mysql.connector.Error as err:
-        db.rollback()
-        print(f"ERROR: Database error during forgot-password process: {err.msg}")
-        return jsonify({"message": "Failed to generate reset link due to a server error."}), 500
-    finally:
-        cursor.close()
-        db.close()
+        print(f"ERROR: could not read mail status for {job_id}: {err.msg}")
+        return jsonify({"message": "Failed to read mail status."}), 500
+    if job is None:
+        return jsonify({"message": "Unknown mail job."}), 404
+    return jsonify(job), 200
 
 
 @app.route("/api/auth/reset-password", methods=["POST"])
@@ -449,53 +622,41 @@ def reset_password(): #
     if len(new_password) < MIN_PASSWORD_LENGTH:
         return jsonify({"message": f"Password must be at least {MIN_PASSWORD_LENGTH} characters long."}), 400
 
-    db = get_db()
-    cursor = db.cursor(dictionary=True)
-    
+    # 1. Validate the token: Check existence and expiry (signed tokens: signature and expiry, no DB)
     try:
-        # 1. Validate the token: Check existence and expiry
-        cursor.execute(
-            "SELECT user_id FROM password_reset_tokens WHERE token=%s AND expires_at > NOW()",
-            (token,)
-        )
-        token_record = cursor.fetchone()
-
-        if not token_record:
-            return jsonify({"message": "Invalid or expired password reset link."}), 401
-
-        user_id = token_record['user_id']
-        
-        # 2. Hash the new password securely
-        hashed_password = bcrypt.hashpw(
-            new_password.encode('utf-8'), 
-            bcrypt.gensalt()
-        ).decode('utf-8')
-
-        # 3. Update the user's password in the 'users' table
-        db.autocommit = False
-        cursor.execute(
-            "UPDATE users SET password = %s WHERE id = %s",
-            (hashed_password, user_id)
-        )
-
-        # 4. Invalidate the token (Crucial for security)
-        cursor.execute(
-            "DELETE FROM password_reset_tokens WHERE token = %s",
-            (token,)
-        )
-        
-        db.commit()
-        db.autocommit = True
-
-        return jsonify({"message": "Password updated successfully."}), 200
-
+        claim = reset_tokens.check(token)
     except mysql.connector.Error as err:
-        db.rollback()
         print(f"ERROR: Database error during password reset: {err.msg}")
         return jsonify({"message": f"Server error: Could not complete reset. ({err.msg})"}), 500
-    finally:
-        cursor.close()
-        db.close()
+
+    if not claim:
+        return jsonify({"message": "Invalid or expired password reset link."}), 401
+
+    # 2. Hash the new password on the hashing pool (no DB connection held meanwhile)
+    hashed_password = hasher.hash_password(new_password)
+
+    with get_db() as db:
+        cursor = db.cursor()
+
+        try:
+            db.start_transaction()
+
+            # 3. Update the password and invalidate the token together (Crucial for security);
+            #    a token that was already used, by this or a concurrent reset, changes nothing.
+            if not reset_tokens.consume(cursor, claim, hashed_password):
+                db.rollback()
+                return jsonify({"message": "Invalid or expired password reset link."}), 401
+
+            db.commit()
+
+            return jsonify({"message": "Password updated successfully."}), 200
+
+        except mysql.connector.Error as err:
+            db.rollback()
+            print(f"ERROR: Database error during password reset: {err.msg}")
+            return jsonify({"message": f"Server error: Could not complete reset. ({err.msg})"}), 500
+        finally:
+            cursor.close()
 
 @app.route("/api/auth/delete", methods=["DELETE"])
 # Note: Ensure you have 'from flask import request, jsonify' and 'import bcrypt'
@@ -513,51 +674,95 @@ def delete_account(): #
         return jsonify({"message": "Missing required fields."}), 400
 
  
-    db = get_db()
-        
-    cursor = db.cursor(dictionary=True) 
-    
-    try:
-        # Cast the string ID to an integer for database queries
-        db_id = int(db_id_from_request) 
-
-        # 1. Verify credentials
-        # Use the corrected db_id variable in the query
-        cursor.execute("SELECT password FROM users WHERE id=%s AND email=%s", (db_id, email))
-        user_record = cursor.fetchone()
-
-        if not user_record:
-            return jsonify({"message": "User not found or ID/email mismatch."}), 404
-        
-        # Secure Password Check using bcrypt
-        stored_hash = user_record['password']
-        
+    with get_db() as db:
+        cursor = db.cursor(dictionary=True) 
+
         try:
-            hashed_password_bytes = stored_hash.encode('utf-8')
-            if not bcrypt.checkpw(password.encode('utf-8'), hashed_password_bytes): 
-                return jsonify({"message": "Invalid password confirmation."}), 401
-        except Exception as e:
-            print(f"ERROR: Bcrypt check failed for ID {db_id}. Hash issue: {e}")
-            return jsonify({"message": "Invalid password confirmation (hashing error). Please check server logs."}), 401
-            
-        # 2. Perform Deletion (Transaction)
-        db.autocommit = False 
-        cursor.execute("DELETE FROM chat_history WHERE user_id=%s", (db_id,))
-        cursor.execute("DELETE FROM users WHERE id=%s", (db_id,))
-        db.commit() 
-        db.autocommit = True
-        
-        return jsonify({"message": "Account deleted successfully."}), 200
+            # Cast the string ID to an integer for database queries
+            db_id = int(db_id_from_request) 
+
+            # 1. Verify credentials
+            # Use the corrected db_id variable in the query
+            cursor.execute("SELECT password FROM users WHERE id=%s AND email=%s", (db_id, email))
+            user_record = cursor.fetchone()
+        except mysql.connector.Error as err:
+            return jsonify({"message": f"Database error during deletion: {err.msg}"}), 500
+        except ValueError:
+            return jsonify({"message": "Invalid user ID format."}), 400
+        finally:
+            if cursor: cursor.close()
+
+    if not user_record:
+        return jsonify({"message": "User not found or ID/email mismatch."}), 404
+
+    # Secure Password Check using bcrypt, on the hashing pool with no DB connection held.
+    # The account is about to go, so a weak hash is not upgraded here (login.php does that).
+    stored_hash = user_record['password']
+
+    try:
+        ok, _ = hasher.verify_password(password, stored_hash, rehash=False)
+    except HashingBusy:
+        raise
+    except Exception as e:
+        print(f"ERROR: Bcrypt check failed for ID {db_id}. Hash issue: {e}")
+        return jsonify({"message": "Invalid password confirmation (hashing error). Please check server logs."}), 401
+    if not ok:
+        return jsonify({"message": "Invalid password confirmation."}), 401
+
+    with get_db() as db:
+        cursor = db.cursor(dictionary=True)
 
+        try:
+            # 2. Write the tombstone; the rows are deleted in batches in the background.
+            db.start_transaction()
+            # The password was checked without a connection held; only proceed if it is unchanged.
+            cursor.execute("SELECT id FROM users WHERE id=%s AND password=%s FOR UPDATE", (db_id, stored_hash))
+            if cursor.fetchone() is None:
+                db.rollback()
+                return jsonify({"message": "Account changed during deletion, please try again."}), 409
+            account_deletion.request_deletion(cursor, db_id)
+            db.commit()
+            account_deleter.requested(db_id)
+            context_store.invalidate(db_id)
+
+            return jsonify({
+                "message": "Account deletion started.",
+                "status_url": f"/api/auth/delete/{db_id}/status",
+            }), 202
+
+        except mysql.connector.Error as err:
+            db.rollback()
+            return jsonify({"message": f"Database error during deletion: {err.msg}"}), 500
+        finally:
+            if cursor: cursor.close()
+
+
+@app.route("/api/auth/delete/<int:user_id>/status", methods=["GET"])
+def delete_account_status(user_id): #
+    """Progress of a requested account deletion: state, current table and rows deleted so far."""
+    try:
+        deletion = account_deletion.progress(user_id)
     except mysql.connector.Error as err:
-        db.rollback()
-        return jsonify({"message": f"Database error during deletion: {err.msg}"}), 500
-    except ValueError:
-        return jsonify({"message": "Invalid user ID format."}), 400
-    finally:
-        if cursor: cursor.close()
-        if db: db.close()
+        return jsonify({"message": f"Database error: {err.msg}"}), 500
+    if deletion is None:
+        return jsonify({"message": "No deletion requested for this account."}), 404
+    return jsonify(deletion), 200
+
+
+# Deliver anything left in the outbox by earlier runs.
+mail_dispatcher.ensure_started()
+
+# Delete expired DB reset tokens in the background.
+reset_tokens.purger.ensure_started()
+
+# Move old chat turns to the archive tier (only when CHAT_ARCHIVE_INTERVAL is set).
+chat_archiver.ensure_started()
+
+# Track tombstoned accounts and purge them in batches (pending ones too, after a restart).
+account_deleter.ensure_started()
 
 
 if __name__ == "__main__":
+    # gunicorn does this in post_worker_init (gunicorn.conf.py).
+    providers.warm_up_in_background()
     app.run(debug=True, port=5000)
\ No newline at end of file
@@ -0,0 +1,53 @@
+# bench/compare.py
+"""
+Prints the change between two run_bench.py results, scenario by scenario:
+
+    cd mooc_api && python -m bench.compare results/<old>.json results/<new>.json
+
+Warns when the two runs used different settings or hosts, since their
+numbers are then not comparable.
+"""
+import sys
+import json
+
+METRICS = (("rps", "req/s"), ("p50_ms", "p50 ms"), ("p95_ms", "p95 ms"), ("p99_ms", "p99 ms"))
+
+
+def _value(summary, key):
+    return summary.get(key) if key == "rps" else summary.get("latency", {}).get(key)
+
+
+def _change(old, new):
+    if old in (None, 0) or new is None:
+        return ""
+    return f"{100.0 * (new - old) / old:+.1f}%"
+
+
+def main(old_path, new_path):
+    with open(old_path) as f:
+        old = json.load(f)
+    with open(new_path) as f:
+        new = json.load(f)
+
+    print(f"old: {old.get('commit')}{' (dirty)' if old.get('dirty') else ''}")
+    print(f"new: {new.get('commit')}{' (dirty)' if new.get('dirty') else ''}")
+    for section in ("settings", "host"):
+        differing = sorted(k for k in set(old.get(section, {})) | set(new.get(section, {}))
+                           if old.get(section, {}).get(k) != new.get(section, {}).get(k))
+        if differing:
+            print(f"WARNING: {section} differ ({', '.join(differing)}); results are not directly comparable.")
+
+    print(f"\n{'scenario':<16}{'metric':<10}{'old':>12}{'new':>12}{'change':>10}")
+    for name in new.get("scenarios", {}):
+        if name not in old.get("scenarios", {}):
+            continue
+        for key, label in METRICS:
+            a, b = _value(old["scenarios"][name], key), _value(new["scenarios"][name], key)
+            print(f"{name:<16}{label:<10}{str(a):>12}{str(b):>12}{_change(a, b):>10}")
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 3:
+        print(__doc__)
+        sys.exit(1)
+    main(sys.argv[1], sys.argv[2])
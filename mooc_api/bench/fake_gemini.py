@@ -0,0 +1,147 @@
+# bench/fake_gemini.py
+"""
+Local HTTP stand-in for generativelanguage.googleapis.com.
+
+Answers the REST endpoints the API uses (including streamGenerateContent
+as SSE) with a canned reply after a configurable delay and counts how many TCP connections clients opened,
+so keep-alive reuse can be measured offline. Replies carry usageMetadata
+estimated at four characters per token, and POST v1beta/cachedContents
+registers a prefix whose tokens are then reported as cached:
+
+    python -m bench.fake_gemini --port 8765 --latency-ms 200
+    GEMINI_API_BASE=http://127.0.0.1:8765 GEMINI_USE_SDK=0 python app.py
+"""
+import json
+import time
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+DEFAULT_REPLY = "Maayong adlaw! Batchoy is a noodle soup from La Paz, Iloilo."
+
+
+class FakeGeminiHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive, like the real endpoint
+    disable_nagle_algorithm = True  # headers and body go out as separate writes
+
+    def setup(self):
+        super().setup()
+        with self.server.stats_lock:
+            self.server.connections += 1
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status, payload):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _write_chunk(self, data):
+        self.wfile.write(f"{len(data):X}\r\n".encode("ascii") + data + b"\r\n")
+
+    def _usage(self, body):
+        """usageMetadata for a request body, at roughly four characters per token."""
+        texts = [body.get("prompt", {}).get("text", "")]
+        for part in body.get("systemInstruction", {}).get("parts", []):
+            texts.append(part.get("text", ""))
+        for content in body.get("contents", []):
+            texts.extend(part.get("text", "") for part in content.get("parts", []))
+        cached = self.server.caches.get(body.get("cachedContent"), 0)
+        return {"promptTokenCount": sum(len(t) for t in texts) // 4 + cached, "cachedContentTokenCount": cached}
+
+    def _create_cache(self, body):
+        text = "".join(part.get("text", "") for part in body.get("systemInstruction", {}).get("parts", []))
+        with self.server.stats_lock:
+            name = f"cachedContents/fake-{len(self.server.caches) + 1}"
+            self.server.caches[name] = len(text) // 4
+        self._send_json(200, {"name": name, "model": body.get("model")})
+
+    def _stream_reply(self, usage):
+        """Sends the reply word by word as SSE over chunked transfer encoding."""
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        words = self.server.reply.split(" ")
+        for i, word in enumerate(words):
+            text = word if i == len(words) - 1 else word + " "
+            event = {"candidates": [{"content": {"parts": [{"text": text}], "role": "model"}}]}
+            if i == len(words) - 1:
+                event["usageMetadata"] = usage
+            self._write_chunk(f"data: {json.dumps(event)}\r\n\r\n".encode("utf-8"))
+            self.wfile.flush()
+            if self.server.chunk_delay and i < len(words) - 1:
+                time.sleep(self.server.chunk_delay)
+        self.wfile.write(b"0\r\n\r\n")
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        try:
+            body = json.loads(self.rfile.read(length)) if length else {}
+        except ValueError:
+            body = {}
+
+        with self.server.stats_lock:
+            self.server.requests += 1
+
+        if self.server.latency:
+            time.sleep(self.server.latency)
+
+        if self.path.split("?")[0].endswith("/cachedContents"):
+            self._create_cache(body)
+        elif ":streamGenerateContent" in self.path:
+            self._stream_reply(self._usage(body))
+        elif self.path.split("?")[0].endswith(":generateText") or ":generateContent" in self.path:
+            self._send_json(200, {
+                "candidates": [{"content": {"parts": [{"text": self.server.reply}], "role": "model"}}],
+                "usageMetadata": self._usage(body),
+            })
+        else:
+            self._send_json(404, {"error": {"status": "NOT_FOUND", "message": f"Unknown path {self.path}"}})
+
+
+class FakeGeminiServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, latency_ms=0, reply=DEFAULT_REPLY, chunk_delay_ms=0):
+        super().__init__(address, FakeGeminiHandler)
+        self.latency = latency_ms / 1000.0
+        self.chunk_delay = chunk_delay_ms / 1000.0
+        self.reply = reply
+        self.stats_lock = threading.Lock()
+        self.connections = 0
+        self.requests = 0
+        self.caches = {}   # cachedContents name -> token count
+
+    @property
+    def base_url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+
+def start_in_thread(port=0, latency_ms=0, reply=DEFAULT_REPLY, chunk_delay_ms=0):
+    """Starts a server on a background thread and returns it (call .shutdown() to stop)."""
+    server = FakeGeminiServer(("127.0.0.1", port), latency_ms=latency_ms, reply=reply,
+                              chunk_delay_ms=chunk_delay_ms)
+    threading.Thread(target=server.serve_forever, name="fake-gemini", daemon=True).start()
+    return server
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency-ms", type=int, default=0, help="delay before the first byte")
+    parser.add_argument("--chunk-delay-ms", type=int, default=0, help="delay between streamed chunks")
+    args = parser.parse_args()
+
+    server = FakeGeminiServer(("127.0.0.1", args.port), latency_ms=args.latency_ms,
+                              chunk_delay_ms=args.chunk_delay_ms)
+    print(f"Fake Gemini listening on {server.base_url} (latency {args.latency_ms} ms)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,55 @@
+# bench/gemini_client_bench.py
+"""
+Compares one-connection-per-call REST requests against the shared
+keep-alive session from gemini_client.py, using the local stand-in.
+
+    cd mooc_api && python -m bench.gemini_client_bench --calls 200
+"""
+import json
+import time
+import argparse
+
+import requests
+
+import gemini_client
+from bench.fake_gemini import start_in_thread
+
+
+def _run(post, url, calls):
+    body = {"prompt": {"text": "what is batchoy"}, "temperature": 0.4, "maxOutputTokens": 800}
+    started = time.perf_counter()
+    for _ in range(calls):
+        resp = post(url, json=body, timeout=30)
+        resp.raise_for_status()
+    return time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--calls", type=int, default=200)
+    parser.add_argument("--latency-ms", type=int, default=0)
+    args = parser.parse_args()
+
+    server = start_in_thread(latency_ms=args.latency_ms)
+
+    gemini_client.GEMINI_API_BASE = server.base_url
+    url = gemini_client.rest_url("v1/models/gemini-2.5-flash:generateText")
+
+    results = {}
+    for name, post in (("requests.post", requests.post),
+                       ("shared_session", gemini_client.get_http_session().post)):
+        connections_before = server.connections
+        elapsed = _run(post, url, args.calls)
+        results[name] = {
+            "calls": args.calls,
+            "seconds": round(elapsed, 4),
+            "avg_ms": round(1000 * elapsed / args.calls, 3),
+            "connections_opened": server.connections - connections_before,
+        }
+
+    server.shutdown()
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,210 @@
+# bench/load.py
+"""
+Closed-loop load generator and the API scenarios the benchmark drives.
+
+Each of `concurrency` client threads has its own keep-alive session and
+sends its next request as soon as the previous one finishes, until
+`requests` have been sent or `duration` seconds have passed. A scenario is
+a function (client, i) -> bool that returns whether request i succeeded.
+It may also call client.observe(name, seconds) to record sub-steps, such
+as a stream's first byte or the mail leg of a password reset.
+"""
+import re
+import math
+import time
+import threading
+import itertools
+
+import requests
+
+TOKEN_RE = re.compile(r"token=([A-Za-z0-9._\-]+)")
+
+
+def percentile(sorted_values, pct):
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return None
+    rank = max(1, math.ceil(pct / 100.0 * len(sorted_values)))
+    return sorted_values[rank - 1]
+
+
+def summarize(latencies):
+    values = sorted(latencies)
+    if not values:
+        return {"count": 0}
+    return {
+        "count": len(values),
+        "mean_ms": round(1000 * sum(values) / len(values), 3),
+        "p50_ms": round(1000 * percentile(values, 50), 3),
+        "p95_ms": round(1000 * percentile(values, 95), 3),
+        "p99_ms": round(1000 * percentile(values, 99), 3),
+        "max_ms": round(1000 * values[-1], 3),
+    }
+
+
+class Client:
+    """One simulated user: a session plus the recorder shared by its thread."""
+
+    def __init__(self, base_url, recorder):
+        self.base_url = base_url
+        self.session = requests.Session()
+        self._recorder = recorder
+
+    def url(self, path):
+        return self.base_url + path
+
+    def observe(self, name, seconds):
+        self._recorder.observe(name, seconds)
+
+
+class Recorder:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.latencies = []
+        self.failures = 0
+        self.errors = {}
+        self.steps = {}
+
+    def record(self, seconds, ok):
+        with self._lock:
+            self.latencies.append(seconds)
+            if not ok:
+                self.failures += 1
+
+    def error(self, exc):
+        name = type(exc).__name__
+        with self._lock:
+            self.errors[name] = self.errors.get(name, 0) + 1
+            self.failures += 1
+
+    def observe(self, name, seconds):
+        with self._lock:
+            self.steps.setdefault(name, []).append(seconds)
+
+
+def run(scenario, base_url, concurrency, requests_total=None, duration=None):
+    """Runs one scenario and returns its summary dict."""
+    recorder = Recorder()
+    counter = itertools.count()
+    deadline = time.monotonic() + duration if duration else None
+
+    def worker():
+        client = Client(base_url, recorder)
+        while True:
+            i = next(counter)
+            if requests_total is not None and i >= requests_total:
+                return
+            if deadline is not None and time.monotonic() >= deadline:
+                return
+            start = time.perf_counter()
+            try:
+                ok = scenario(client, i)
+            except Exception as e:   # a benchmark keeps going; the error is counted
+                recorder.error(e)
+                continue
+            recorder.record(time.perf_counter() - start, ok)
+
+    started = time.perf_counter()
+    threads = [threading.Thread(target=worker, name=f"bench-client-{n}", daemon=True) for n in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    completed = len(recorder.latencies)
+    summary = {
+        "concurrency": concurrency,
+        "seconds": round(elapsed, 3),
+        "requests": completed + sum(recorder.errors.values()),
+        "failures": recorder.failures,
+        "errors": recorder.errors,
+        "rps": round(completed / elapsed, 2) if elapsed else 0.0,
+        "latency": summarize(recorder.latencies),
+    }
+    if recorder.steps:
+        summary["steps"] = {name: summarize(values) for name, values in sorted(recorder.steps.items())}
+    return summary
+
+
+# --------------------------
+# Scenarios
+# --------------------------
+def chat(users):
+    """POST /chat with a distinct question each time, so every turn reaches Gemini."""
+    def scenario(client, i):
+        user = users[i % len(users)]
+        resp = client.session.post(client.url("/chat"), json={
+            "user_id": user["id"], "message": f"Bench question {i} about Iloilo festivals",
+            "lesson_title": "Bench Lesson",
+        }, timeout=120)
+        return resp.status_code == 200 and not resp.json().get("reply", "").startswith(("Error", "Network Error"))
+    return scenario
+
+
+def chat_stream(users):
+    """POST /chat/stream, read to the end; the time to the first event is a step."""
+    def scenario(client, i):
+        user = users[i % len(users)]
+        start = time.perf_counter()
+        with client.session.post(client.url("/chat/stream"), json={
+            "user_id": user["id"], "message": f"Bench streamed question {i} about Iloilo cuisine",
+            "lesson_title": "Bench Lesson",
+        }, stream=True, timeout=120) as resp:
+            first = True
+            body = []
+            for chunk in resp.iter_content(chunk_size=None):
+                if first:
+                    client.observe("first_byte", time.perf_counter() - start)
+                    first = False
+                body.append(chunk)
+        return resp.status_code == 200 and b"event: done" in b"".join(body)
+    return scenario
+
+
+def history(users, limit=None):
+    """GET /api/chat/history/<id>: the full streamed history, or one page of `limit` rows."""
+    query = f"?limit={limit}" if limit else ""
+
+    def scenario(client, i):
+        user = users[i % len(users)]
+        resp = client.session.get(client.url(f"/api/chat/history/{user['id']}{query}"), timeout=120)
+        return resp.status_code == 200 and resp.content.startswith(b"[")
+    return scenario
+
+
+def password_reset(users, sink, password, mail_timeout=30):
+    """forgot-password, wait for the email at the SMTP sink, then reset-password with its token."""
+    def scenario(client, i):
+        user = users[i % len(users)]
+        start = time.perf_counter()
+        resp = client.session.post(client.url("/api/auth/forgot-password"), json={"email": user["email"]}, timeout=60)
+        client.observe("forgot_password", time.perf_counter() - start)
+        if resp.status_code != 200:
+            return False
+
+        mailed = time.perf_counter()
+        message = sink.take_message(user["email"], mail_timeout)
+        client.observe("mail_delivery", time.perf_counter() - mailed)
+        match = TOKEN_RE.search(message or "")
+        if not match:
+            return False
+
+        reset = time.perf_counter()
+        # Reset to the same password so later scenarios can still sign in as this user.
+        resp = client.session.post(client.url("/api/auth/reset-password"),
+                                   json={"token": match.group(1), "newPassword": password}, timeout=60)
+        client.observe("reset_password", time.perf_counter() - reset)
+        return resp.status_code == 200
+    return scenario
+
+
+def delete_account(users, password):
+    """DELETE /api/auth/delete; each request removes a different user, so requests <= len(users)."""
+    def scenario(client, i):
+        user = users[i]
+        resp = client.session.delete(client.url("/api/auth/delete"), json={
+            "dbId": str(user["id"]), "email": user["email"], "password": password,
+        }, timeout=60)
+        return resp.status_code == 200
+    return scenario
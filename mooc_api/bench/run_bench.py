@@ -0,0 +1,285 @@
+# bench/run_bench.py
+"""
+Offline benchmark of the Flask API.
+
+Starts the local stand-ins (bench/fake_gemini.py, bench/smtp_sink.py),
+seeds a throwaway MySQL database (bench/seed.py) and launches the app
+under gunicorn (or the Flask dev server) pointed at them. Then it drives
+each scenario at a fixed concurrency and writes one JSON result holding
+the commit, the settings, req/s, p50/p95/p99 latency, and the server's CPU
+time and peak RSS for each scenario:
+
+    cd mooc_api && python -m bench.run_bench --concurrency 32 --requests 2000
+    python -m bench.compare results/<old>.json results/<new>.json
+
+Only MySQL has to be running. Runs are comparable across commits when
+they use the same arguments on the same host.
+"""
+import os
+import sys
+import json
+import time
+import socket
+import threading
+import argparse
+import platform
+import subprocess
+
+import requests
+
+from bench import load, seed
+from bench.fake_gemini import start_in_thread as start_fake_gemini
+from bench.smtp_sink import start_in_thread as start_smtp_sink
+
+API_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "results")
+SCENARIOS = ("chat", "chat_stream", "history", "history_page", "password_reset", "delete")
+
+
+# --------------------------
+# Server process and resource usage
+# --------------------------
+def _free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _git(*args):
+    try:
+        return subprocess.run(["git", *args], cwd=API_DIR, capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _process_tree(root_pid):
+    """root_pid and its descendants (gunicorn master + workers), read from /proc."""
+    children = {}
+    for entry in os.listdir("/proc"):
+        if entry.isdigit():
+            try:
+                with open(f"/proc/{entry}/stat") as f:
+                    ppid = int(f.read().rpartition(")")[2].split()[1])
+            except (OSError, ValueError, IndexError):
+                continue
+            children.setdefault(ppid, []).append(int(entry))
+    tree, stack = [], [root_pid]
+    while stack:
+        pid = stack.pop()
+        tree.append(pid)
+        stack.extend(children.get(pid, []))
+    return tree
+
+
+def _usage(root_pid):
+    """(cpu_seconds, rss_bytes) summed over the server's process tree; None off Linux."""
+    if not os.path.isdir("/proc"):
+        return None
+    ticks = os.sysconf("SC_CLK_TCK")
+    page = os.sysconf("SC_PAGE_SIZE")
+    cpu = rss = 0
+    for pid in _process_tree(root_pid):
+        try:
+            with open(f"/proc/{pid}/stat") as f:
+                fields = f.read().rpartition(")")[2].split()
+            cpu += (int(fields[11]) + int(fields[12])) / ticks   # utime + stime
+            rss += int(fields[21]) * page
+        except (OSError, ValueError, IndexError):
+            continue
+    return cpu, rss
+
+
+class ResourceSampler:
+    """Samples the server tree's RSS while a scenario runs; CPU is taken as a before/after delta."""
+
+    def __init__(self, pid, interval=0.25):
+        self.pid = pid
+        self.interval = interval
+        self.peak_rss = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="bench-sampler", daemon=True)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            usage = _usage(self.pid)
+            if usage:
+                self.peak_rss = max(self.peak_rss, usage[1])
+
+    def __enter__(self):
+        self._start = _usage(self.pid)
+        self._client_cpu = time.process_time()
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        end = _usage(self.pid)
+        self.result = {"client_cpu_s": round(time.process_time() - self._client_cpu, 3)}
+        if self._start and end:
+            self.result["server_cpu_s"] = round(end[0] - self._start[0], 3)
+            self.result["server_peak_rss_mb"] = round(max(self.peak_rss, end[1]) / 2 ** 20, 1)
+        return False
+
+
+def start_server(args, port, gemini, sink):
+    env = dict(os.environ)
+    env.update({
+        "DB_NAME": args.db_name,
+        "GEMINI_API_BASE": gemini.base_url,
+        "GEMINI_API_KEY": "bench",
+        "GEMINI_USE_SDK": "0",
+        "SMTP_SERVER": "127.0.0.1",
+        "SMTP_PORT": str(sink.server_address[1]),
+        "SMTP_STARTTLS": "0",
+        "MAIL_PASSWORD": "",
+        "BCRYPT_COST": str(seed.BENCH_BCRYPT_COST),
+        # Every bench client shares one IP and a few hundred users; the limiter would cap the run.
+        "RATE_LIMIT_ENABLED": "1" if args.rate_limit else "0",
+        "PYTHONUNBUFFERED": "1",
+    })
+    if args.server == "gunicorn":
+        env.update({
+            "GUNICORN_BIND": f"127.0.0.1:{port}",
+            "WEB_CONCURRENCY": str(args.workers),
+            "GUNICORN_WORKER_CLASS": args.worker_class,
+            "GUNICORN_ACCESS_LOG": os.devnull,
+        })
+        cmd = [sys.executable, "-m", "gunicorn", "-c", "gunicorn.conf.py", "app:app"]
+    else:
+        cmd = [sys.executable, "-m", "flask", "--app", "app", "run", "--port", str(port),
+               "--no-reload", "--no-debugger", "--with-threads"]
+
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+    log = open(os.path.join(RESULTS_DIR, "server.log"), "w")
+    proc = subprocess.Popen(cmd, cwd=API_DIR, env=env, stdout=log, stderr=subprocess.STDOUT)
+
+    base_url = f"http://127.0.0.1:{port}"
+    deadline = time.monotonic() + args.startup_timeout
+    while time.monotonic() < deadline:
+        if proc.poll() is not None:
+            raise SystemExit(f"Server exited with {proc.returncode}; see {log.name}")
+        try:
+            requests.get(base_url + "/api/health/ai", timeout=1)
+            return proc, base_url
+        except requests.exceptions.RequestException:
+            time.sleep(0.2)
+    proc.terminate()
+    raise SystemExit(f"Server did not answer within {args.startup_timeout}s; see {log.name}")
+
+
+def stop_server(proc):
+    proc.terminate()
+    try:
+        proc.wait(timeout=30)
+    except subprocess.TimeoutExpired:
+        proc.kill()
+
+
+# --------------------------
+# Benchmark run
+# --------------------------
+def _scenario(name, users, delete_users, sink):
+    if name == "chat":
+        return load.chat(users)
+    if name == "chat_stream":
+        return load.chat_stream(users)
+    if name == "history":
+        return load.history(users)
+    if name == "history_page":
+        return load.history(users, limit=50)
+    if name == "password_reset":
+        return load.password_reset(users, sink, seed.BENCH_PASSWORD)
+    if name == "delete":
+        return load.delete_account(delete_users, seed.BENCH_PASSWORD)
+    raise SystemExit(f"Unknown scenario {name!r}; choose from {', '.join(SCENARIOS)}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS), help="comma-separated, run in this order")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--requests", type=int, default=500, help="requests per scenario")
+    parser.add_argument("--duration", type=float, default=None, help="seconds per scenario instead of --requests")
+    parser.add_argument("--warmup", type=int, default=20, help="unrecorded requests before each scenario")
+    parser.add_argument("--server", choices=("gunicorn", "dev"), default="gunicorn")
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--worker-class", default="gevent")
+    parser.add_argument("--gemini-latency-ms", type=int, default=300)
+    parser.add_argument("--gemini-chunk-delay-ms", type=int, default=20)
+    parser.add_argument("--smtp-delay-ms", type=int, default=50)
+    parser.add_argument("--db-name", default=seed.BENCH_DB_NAME)
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--history", type=int, default=50, help="chat_history rows per seeded user")
+    parser.add_argument("--no-seed", action="store_true", help="reuse the database from an earlier run")
+    parser.add_argument("--rate-limit", action="store_true", help="keep the chat rate limiter on (RATE_LIMIT_* apply)")
+    parser.add_argument("--startup-timeout", type=float, default=60)
+    parser.add_argument("--out", default=None, help="result file (default results/<commit>-<time>.json)")
+    args = parser.parse_args()
+    names = [n.strip() for n in args.scenarios.split(",") if n.strip()]
+
+    # Delete removes users, so it gets its own slice and a fresh seed each run.
+    delete_count = args.requests + args.warmup if "delete" in names else 0
+    if args.no_seed:
+        all_users = seed.seeded_users(args.db_name)
+    else:
+        print(f"Seeding {args.db_name} ...")
+        all_users = seed.seed(args.db_name, args.users + delete_count, args.history)
+    users, delete_users = all_users[:args.users], all_users[args.users:]
+
+    gemini = start_fake_gemini(latency_ms=args.gemini_latency_ms, chunk_delay_ms=args.gemini_chunk_delay_ms)
+    sink = start_smtp_sink(delay_ms=args.smtp_delay_ms, keep_messages=True)
+    proc, base_url = start_server(args, _free_port(), gemini, sink)
+
+    results = {}
+    try:
+        for name in names:
+            scenario = _scenario(name, users, delete_users, sink)
+            if name == "delete":
+                # Warm-up and measured deletes must not reuse a user.
+                warm, measured = delete_users[:args.warmup], delete_users[args.warmup:]
+                if args.warmup:
+                    load.run(load.delete_account(warm, seed.BENCH_PASSWORD), base_url,
+                             min(args.concurrency, args.warmup), requests_total=len(warm))
+                scenario = load.delete_account(measured, seed.BENCH_PASSWORD)
+                total = min(args.requests, len(measured))
+                duration = None
+            else:
+                if args.warmup:
+                    load.run(scenario, base_url, min(args.concurrency, args.warmup), requests_total=args.warmup)
+                total = None if args.duration else args.requests
+                duration = args.duration
+
+            print(f"Running {name} ...")
+            with ResourceSampler(proc.pid) as sampler:
+                summary = load.run(scenario, base_url, args.concurrency, requests_total=total, duration=duration)
+            summary["resources"] = sampler.result
+            results[name] = summary
+            print(f"  {summary['rps']} req/s, p50 {summary['latency'].get('p50_ms')} ms, "
+                  f"p99 {summary['latency'].get('p99_ms')} ms, failures {summary['failures']}")
+    finally:
+        stop_server(proc)
+        gemini.shutdown()
+        sink.shutdown()
+
+    commit = _git("rev-parse", "HEAD")
+    report = {
+        "commit": commit,
+        "dirty": bool(_git("status", "--porcelain", "--untracked-files=no")),
+        "started_at": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "host": {"platform": platform.platform(), "python": platform.python_version(), "cpus": os.cpu_count()},
+        "settings": {k: v for k, v in vars(args).items() if k != "out"},
+        "stand_ins": {"gemini_requests": gemini.requests, "gemini_connections": gemini.connections,
+                      "smtp_messages": sink.messages, "smtp_connections": sink.connections},
+        "scenarios": results,
+    }
+
+    out = args.out or os.path.join(RESULTS_DIR, f"{(commit or 'nogit')[:12]}-{time.strftime('%Y%m%d-%H%M%S')}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(out)), exist_ok=True)
+    with open(out, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"Results written to {out}")
+
+
+if __name__ == "__main__":
+    main()
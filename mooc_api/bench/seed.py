@@ -0,0 +1,140 @@
+# bench/seed.py
+"""
+Builds a throwaway benchmark database on the configured MySQL server.
+
+Drops and recreates BENCH_DB_NAME (never the real my_app_db), loads the
+schema dump, applies migrations/ and adds deterministic data: N learners
+with the password BENCH_PASSWORD and M chat_history rows each. The same
+arguments always produce the same users and history, so runs on different
+commits start from identical data:
+
+    cd mooc_api && python -m bench.seed --users 200 --history 50
+"""
+import os
+import json
+import argparse
+
+import bcrypt
+import mysql.connector
+
+BENCH_DB_NAME = os.environ.get("BENCH_DB_NAME", "mooc_bench")
+BENCH_PASSWORD = "bench-password"
+BENCH_BCRYPT_COST = 10   # low, so delete/reset timings measure the API more than bcrypt
+DUMP_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "my_app_db.sql")
+
+INSERT_BATCH = 1000
+
+
+def user_email(i):
+    return f"bench{i}@bench.test"
+
+
+def _use_database(name):
+    # db_pool.py (and migrate.py through it) reads DB_NAME when first imported.
+    os.environ["DB_NAME"] = name
+    import db_pool
+    if db_pool.DB_CONFIG["database"] != name:
+        raise SystemExit(f"db_pool was imported for {db_pool.DB_CONFIG['database']!r} before the benchmark set DB_NAME.")
+
+
+def _server_config():
+    # Same connection settings as db_pool.py, minus the database.
+    from db_pool import DB_CONFIG
+    return {k: v for k, v in DB_CONFIG.items() if k != "database"}
+
+
+def _recreate_database(name):
+    if name == "my_app_db":
+        raise SystemExit("Refusing to drop my_app_db; pick another BENCH_DB_NAME.")
+    conn = mysql.connector.connect(**_server_config())
+    try:
+        cursor = conn.cursor()
+        cursor.execute(f"DROP DATABASE IF EXISTS `{name}`")
+        cursor.execute(f"CREATE DATABASE `{name}` CHARACTER SET utf8mb4 COLLATE utf8mb4_general_ci")
+        cursor.close()
+    finally:
+        conn.close()
+
+
+def _load_schema(name):
+    import migrate
+
+    conn = mysql.connector.connect(database=name, **_server_config())
+    try:
+        cursor = conn.cursor()
+        with open(DUMP_PATH, encoding="utf-8") as f:
+            for statement in migrate._statements(f.read()):
+                cursor.execute(statement)
+                if cursor.with_rows:
+                    cursor.fetchall()
+        conn.commit()
+        cursor.close()
+    finally:
+        conn.close()
+    if migrate.migrate() != 0:
+        raise SystemExit("Migrations failed on the benchmark database.")
+
+
+def _insert_many(cursor, sql_prefix, row_sql, rows):
+    for start in range(0, len(rows), INSERT_BATCH):
+        batch = rows[start:start + INSERT_BATCH]
+        cursor.execute(sql_prefix + ", ".join([row_sql] * len(batch)),
+                       [value for row in batch for value in row])
+
+
+def _seed_rows(name, users, history):
+    password_hash = bcrypt.hashpw(BENCH_PASSWORD.encode("utf-8"), bcrypt.gensalt(BENCH_BCRYPT_COST))
+    password_hash = "$2y$" + password_hash.decode("ascii")[4:]   # PHP's prefix, as register.php stores it
+
+    conn = mysql.connector.connect(database=name, **_server_config())
+    try:
+        cursor = conn.cursor()
+        _insert_many(cursor, "INSERT INTO users (name, email, password) VALUES ", "(%s, %s, %s)",
+                     [(f"Bench Learner {i}", user_email(i), password_hash) for i in range(users)])
+        cursor.execute("SELECT id, email FROM users WHERE email LIKE %s ORDER BY id", ("%@bench.test",))
+        seeded = [{"id": row[0], "email": row[1]} for row in cursor.fetchall()]
+
+        rows = []
+        for user in seeded:
+            for turn in range(history):
+                role = "user" if turn % 2 == 0 else "assistant"
+                rows.append((user["id"], role, f"Bench {role} message {turn} about Iloilo heritage."))
+        _insert_many(cursor, "INSERT INTO chat_history (user_id, role, message) VALUES ", "(%s, %s, %s)", rows)
+        conn.commit()
+        cursor.close()
+    finally:
+        conn.close()
+    return seeded
+
+
+def seed(name=BENCH_DB_NAME, users=200, history=50):
+    """Recreates the benchmark database and returns the seeded users as [{"id", "email"}]."""
+    _use_database(name)
+    _recreate_database(name)
+    _load_schema(name)
+    return _seed_rows(name, users, history)
+
+
+def seeded_users(name=BENCH_DB_NAME):
+    """Users left by an earlier seed() (minus any a delete run removed)."""
+    _use_database(name)
+    conn = mysql.connector.connect(database=name, **_server_config())
+    try:
+        cursor = conn.cursor()
+        cursor.execute("SELECT id, email FROM users WHERE email LIKE %s ORDER BY id", ("%@bench.test",))
+        users = [{"id": row[0], "email": row[1]} for row in cursor.fetchall()]
+        cursor.close()
+    finally:
+        conn.close()
+    return users
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--db-name", default=BENCH_DB_NAME)
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--history", type=int, default=50, help="chat_history rows per user")
+    args = parser.parse_args()
+
+    seeded = seed(args.db_name, args.users, args.history)
+    print(json.dumps({"database": args.db_name, "users": len(seeded), "history_rows": len(seeded) * args.history}))
@@ -0,0 +1,121 @@
+# bench/smtp_sink.py
+"""
+Local SMTP stand-in that accepts and discards mail.
+
+Speaks enough SMTP for smtplib (EHLO/HELO, AUTH, MAIL, RCPT, DATA, RSET,
+NOOP, QUIT), counts connections and messages, and can delay each message
+to mimic a slow provider. With keep_messages=True it also remembers the
+last message sent to each address, so a benchmark can read reset links:
+
+    python -m bench.smtp_sink --port 2525 --delay-ms 200
+    SMTP_SERVER=127.0.0.1 SMTP_PORT=2525 SMTP_STARTTLS=0 python app.py
+"""
+import time
+import argparse
+import threading
+import socketserver
+
+
+class SmtpSinkHandler(socketserver.StreamRequestHandler):
+    disable_nagle_algorithm = True
+
+    def _reply(self, line):
+        self.wfile.write((line + "\r\n").encode("ascii"))
+
+    def handle(self):
+        server = self.server
+        with server.stats_lock:
+            server.connections += 1
+
+        self._reply("220 smtp-sink ready")
+        recipients = []
+        while True:
+            raw = self.rfile.readline()
+            if not raw:
+                return
+            command = raw.decode("utf-8", "replace").strip()
+            verb = command.split(" ", 1)[0].upper()
+
+            if verb == "EHLO":
+                self.wfile.write(b"250-smtp-sink\r\n250-AUTH PLAIN LOGIN\r\n250 8BITMIME\r\n")
+            elif verb == "HELO":
+                self._reply("250 smtp-sink")
+            elif verb == "AUTH":
+                self._reply("235 Authentication successful")
+            elif verb == "MAIL":
+                recipients = []
+                self._reply("250 OK")
+            elif verb == "RCPT":
+                recipients.append(command.partition(":")[2].strip().strip("<>").lower())
+                self._reply("250 OK")
+            elif verb == "DATA":
+                self._reply("354 End data with <CR><LF>.<CR><LF>")
+                lines = []
+                while True:
+                    line = self.rfile.readline()
+                    if not line or line in (b".\r\n", b".\n"):
+                        break
+                    if server.inbox is not None:
+                        lines.append(line)
+                if server.delay:
+                    time.sleep(server.delay)
+                with server.stats_lock:
+                    server.messages += 1
+                    server.recipients += len(recipients)
+                    if server.inbox is not None:
+                        data = b"".join(lines).decode("utf-8", "replace")
+                        for address in recipients:
+                            server.inbox[address] = data
+                        server.stats_lock.notify_all()
+                self._reply("250 OK queued")
+            elif verb in ("RSET", "NOOP"):
+                self._reply("250 OK")
+            elif verb == "QUIT":
+                self._reply("221 Bye")
+                return
+            else:
+                self._reply("502 Command not implemented")
+
+
+class SmtpSink(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address, delay_ms=0, keep_messages=False):
+        super().__init__(address, SmtpSinkHandler)
+        self.delay = delay_ms / 1000.0
+        self.stats_lock = threading.Condition()
+        self.connections = 0
+        self.messages = 0
+        self.recipients = 0
+        self.inbox = {} if keep_messages else None   # address -> raw text of the last message
+
+    def take_message(self, address, timeout):
+        """Waits for a message to `address`, removes it from the inbox and returns it (None on timeout)."""
+        address = address.lower()
+        with self.stats_lock:
+            if not self.stats_lock.wait_for(lambda: address in self.inbox, timeout):
+                return None
+            return self.inbox.pop(address)
+
+
+def start_in_thread(port=0, delay_ms=0, keep_messages=False):
+    """Starts a sink on a background thread and returns it (call .shutdown() to stop)."""
+    sink = SmtpSink(("127.0.0.1", port), delay_ms=delay_ms, keep_messages=keep_messages)
+    threading.Thread(target=sink.serve_forever, name="smtp-sink", daemon=True).start()
+    return sink
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--port", type=int, default=2525)
+    parser.add_argument("--delay-ms", type=int, default=0)
+    args = parser.parse_args()
+
+    sink = SmtpSink(("127.0.0.1", args.port), delay_ms=args.delay_ms)
+    print(f"SMTP sink listening on 127.0.0.1:{args.port}")
+    try:
+        sink.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    print(f"connections={sink.connections} messages={sink.messages}")
@@ -0,0 +1,79 @@
+# bench/startup_bench.py
+"""
+Measures what a fresh worker pays to load the API: the time to import
+app.py and the resident memory afterwards, each taken in a new
+interpreter, plus which heavy client libraries were loaded by then:
+
+    cd mooc_api && python -m bench.startup_bench --runs 10
+    python -m bench.startup_bench --warm-up ai,mail    # include a warm-up
+
+The background threads app.py starts (mail dispatcher, purgers) are
+switched off, so MySQL does not need to be running.
+"""
+import os
+import sys
+import json
+import argparse
+import statistics
+import subprocess
+
+API_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+WATCHED = ("google.genai", "requests", "smtplib", "email.mime.multipart", "bcrypt", "flask", "mysql.connector")
+
+_PROBE = r"""
+import sys, time, json
+start = time.perf_counter()
+import app
+imported = time.perf_counter() - start
+warm = None
+if sys.argv[1]:
+    import providers
+    start = time.perf_counter()
+    providers.warm_up(sys.argv[1].split(","))
+    warm = time.perf_counter() - start
+rss_kb = 0
+with open("/proc/self/status") as f:
+    for line in f:
+        if line.startswith("VmRSS:"):
+            rss_kb = int(line.split()[1])
+print(json.dumps({
+    "import_s": imported, "warm_up_s": warm, "rss_mb": rss_kb / 1024, "modules": len(sys.modules),
+    "loaded": [name for name in json.loads(sys.argv[2]) if name in sys.modules],
+}))
+"""
+
+
+def probe(warm_up, env):
+    out = subprocess.run([sys.executable, "-c", _PROBE, warm_up, json.dumps(WATCHED)], cwd=API_DIR, env=env,
+                         capture_output=True, text=True, check=True).stdout
+    return json.loads(out.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=10)
+    parser.add_argument("--warm-up", default="", help="comma-separated parts passed to providers.warm_up()")
+    args = parser.parse_args()
+
+    env = dict(os.environ, MAIL_DISPATCHER_ENABLED="0", RESET_TOKEN_PURGE_INTERVAL="0", CHAT_ARCHIVE_INTERVAL="0",
+               ACCOUNT_DELETE_POLL_INTERVAL="0")
+    probe(args.warm_up, env)   # fills the OS page cache and __pycache__ first
+    runs = [probe(args.warm_up, env) for _ in range(args.runs)]
+
+    result = {
+        "runs": args.runs,
+        "import_ms_median": round(1000 * statistics.median(r["import_s"] for r in runs), 1),
+        "import_ms_min": round(1000 * min(r["import_s"] for r in runs), 1),
+        "rss_mb_median": round(statistics.median(r["rss_mb"] for r in runs), 1),
+        "modules": runs[-1]["modules"],
+        "loaded_at_start": runs[-1]["loaded"],
+    }
+    if args.warm_up:
+        result["warm_up"] = args.warm_up
+        result["warm_up_ms_median"] = round(1000 * statistics.median(r["warm_up_s"] for r in runs), 1)
+    print(json.dumps(result, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,340 @@
+# bulk_mailer.py
+"""
+Course announcements to every learner enrolled in a course.
+
+    python bulk_mailer.py create --course 1 --subject "New lessons!" --text-file note.txt [--html-file note.html]
+    python bulk_mailer.py run 7        # start or resume campaign 7
+    python bulk_mailer.py status 7
+
+Templates use string.Template placeholders: $name, $course_title, $course_link.
+Recipients are read from tra_user_courses in users.id order, BULK_CHUNK_SIZE
+at a time. Each chunk is sent over a small pool of long-lived SMTP sessions
+under a global rate limit. The campaign's resume cursor and counters are
+checkpointed after every chunk. An interrupted run resumes from the last
+checkpoint, so at most one chunk can be sent twice. A rejected SMTP login
+stops the run before that chunk is checkpointed, so resuming sends it again.
+"""
+import os
+import sys
+import time
+import queue
+import string
+import argparse
+import threading
+
+import mysql.connector
+
+from db_pool import get_db
+from providers import load_smtplib
+from email_handler import SmtpSession, build_message, config_error, FRONTEND_URL
+
+# --------------------------
+# Bulk send configuration
+# --------------------------
+BULK_CHUNK_SIZE = int(os.environ.get("BULK_CHUNK_SIZE", 500))            # recipients read per DB round trip
+BULK_SMTP_CONNECTIONS = int(os.environ.get("BULK_SMTP_CONNECTIONS", 3))  # parallel SMTP sessions
+BULK_RATE_PER_SEC = float(os.environ.get("BULK_RATE_PER_SEC", 10))       # messages per second, all sessions
+BULK_MAX_PER_SESSION = int(os.environ.get("BULK_MAX_PER_SESSION", 100))  # reconnect after this many messages
+
+
+class RateLimiter:
+    """Token bucket shared by the sender threads."""
+
+    def __init__(self, rate, burst=None):
+        self.rate = rate
+        self.capacity = burst or max(1.0, rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        if self.rate <= 0:
+            return
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+class SenderPool:
+    """A few sender threads, each reusing one SMTP session for many messages."""
+
+    def __init__(self, connections, rate_limiter, max_per_session):
+        self.rate_limiter = rate_limiter
+        self.max_per_session = max_per_session
+        self.auth_error = None
+        self._jobs = queue.Queue(maxsize=connections * 50)
+        self._results = queue.Queue()
+        self._threads = [
+            threading.Thread(target=self._worker, name=f"bulk-smtp-{i}", daemon=True)
+            for i in range(connections)
+        ]
+        for t in self._threads:
+            t.start()
+
+    def _worker(self):
+        smtplib = load_smtplib()
+        session = SmtpSession()
+        while True:
+            job = self._jobs.get()
+            if job is None:
+                session.close()
+                return
+            user_id, email, msg = job
+            if self.auth_error is not None:
+                # The server rejected our login; don't keep retrying it for every recipient.
+                self._results.put((user_id, email, "not sent: SMTP login rejected"))
+                continue
+            try:
+                self.rate_limiter.acquire()
+                if session.messages_sent >= self.max_per_session:
+                    session.close()
+                session.send(msg)
+                self._results.put((user_id, email, None))
+            except smtplib.SMTPAuthenticationError as e:
+                session.close()
+                self.auth_error = e
+                self._results.put((user_id, email, f"{type(e).__name__}: {e}"))
+            except Exception as e:
+                # Every job must produce a result, or send_all() waits forever.
+                session.close()
+                self._results.put((user_id, email, f"{type(e).__name__}: {e}"))
+
+    def send_all(self, jobs):
+        """
+        Sends a chunk of (user_id, email, message) and returns [(user_id, email, error_or_None)].
+        Raises SMTPAuthenticationError if the server rejected the login, since
+        then the chunk's failures say nothing about its recipients.
+        """
+        for job in jobs:
+            self._jobs.put(job)
+        results = [self._results.get() for _ in jobs]
+        if self.auth_error is not None:
+            raise self.auth_error
+        return results
+
+    def close(self):
+        for _ in self._threads:
+            self._jobs.put(None)
+        for t in self._threads:
+            t.join(timeout=30)
+
+
+# --------------------------
+# Campaign storage
+# --------------------------
+def create_campaign(course_id, subject, body_text, body_html=None):
+    with get_db() as db:
+        cursor = db.cursor()
+        cursor.execute(
+            "INSERT INTO mail_campaigns (course_id, subject, body_text, body_html) VALUES (%s, %s, %s, %s)",
+            (course_id, subject, body_text, body_html)
+        )
+        db.commit()
+        campaign_id = cursor.lastrowid
+        cursor.close()
+    return campaign_id
+
+
+def get_campaign(campaign_id):
+    with get_db() as db:
+        cursor = db.cursor(dictionary=True)
+        cursor.execute(
+            "SELECT c.*, r.course_title FROM mail_campaigns c "
+            "LEFT JOIN ref_courses r ON r.course_id = c.course_id WHERE c.id=%s",
+            (campaign_id,)
+        )
+        row = cursor.fetchone()
+        cursor.close()
+    return row
+
+
+def _set_status(campaign_id, status, error=None):
+    with get_db() as db:
+        cursor = db.cursor()
+        cursor.execute(
+            "UPDATE mail_campaigns SET status=%s, last_error=%s, "
+            "finished_at = IF(%s IN ('completed', 'failed'), NOW(), finished_at) WHERE id=%s",
+            (status, error, status, campaign_id)
+        )
+        db.commit()
+        cursor.close()
+
+
+def _next_recipients(course_id, after_user_id, limit):
+    with get_db() as db:
+        cursor = db.cursor()
+        cursor.execute(
+            "SELECT u.id, u.name, u.email FROM tra_user_courses t "
+            "JOIN users u ON u.id = t.user_id "
+            "WHERE t.enrolled_course=%s AND u.id > %s ORDER BY u.id LIMIT %s",
+            (course_id, after_user_id, limit)
+        )
+        rows = cursor.fetchall()
+        cursor.close()
+    return rows
+
+
+def _checkpoint(campaign_id, last_user_id, results):
+    """Advances the resume cursor and records this chunk's outcome in one transaction."""
+    failures = [(campaign_id, user_id, email, error[:500]) for user_id, email, error in results if error]
+    sent = len(results) - len(failures)
+
+    with get_db() as db:
+        cursor = db.cursor()
+        try:
+            db.start_transaction()
+            cursor.execute(
+                "UPDATE mail_campaigns SET last_user_id=%s, total_sent=total_sent+%s, "
+                "total_failed=total_failed+%s WHERE id=%s",
+                (last_user_id, sent, len(failures), campaign_id)
+            )
+            if failures:
+                placeholders = ", ".join(["(%s, %s, %s, %s)"] * len(failures))
+                cursor.execute(
+                    "INSERT INTO mail_campaign_failures (campaign_id, user_id, email, error) "
+                    f"VALUES {placeholders} ON DUPLICATE KEY UPDATE error=VALUES(error)",
+                    [value for row in failures for value in row]
+                )
+            db.commit()
+        except mysql.connector.Error:
+            db.rollback()
+            raise
+        finally:
+            cursor.close()
+    return sent, len(failures)
+
+
+# --------------------------
+# Sending
+# --------------------------
+def _render_chunk_templates(campaign):
+    """
+    Fills in the campaign-wide placeholders once per chunk, leaving only
+    $name for the per-recipient pass.
+    """
+    shared = {
+        "course_title": campaign.get("course_title") or "your course",
+        "course_link": f"{FRONTEND_URL}/courses/{campaign['course_id']}",
+    }
+    text = string.Template(string.Template(campaign["body_text"]).safe_substitute(shared))
+    html = string.Template(string.Template(campaign["body_html"]).safe_substitute(shared)) if campaign["body_html"] else None
+    subject = string.Template(campaign["subject"]).safe_substitute(shared)
+    return subject, text, html
+
+
+def run_campaign(campaign_id, progress=print):
+    """Sends (or resumes) a campaign until every enrolled learner has been handled."""
+    campaign = get_campaign(campaign_id)
+    if campaign is None:
+        raise ValueError(f"Campaign {campaign_id} does not exist.")
+    if campaign["status"] == "completed":
+        progress(f"Campaign {campaign_id} is already completed.")
+        return campaign
+
+    error = config_error()
+    if error:
+        _set_status(campaign_id, "failed", error)
+        raise RuntimeError(error)
+
+    _set_status(campaign_id, "running")
+    cursor_id = campaign["last_user_id"]
+    sent_total, failed_total = campaign["total_sent"], campaign["total_failed"]
+    pool = SenderPool(BULK_SMTP_CONNECTIONS, RateLimiter(BULK_RATE_PER_SEC), BULK_MAX_PER_SESSION)
+
+    try:
+        while True:
+            recipients = _next_recipients(campaign["course_id"], cursor_id, BULK_CHUNK_SIZE)
+            if not recipients:
+                break
+
+            subject, text, html = _render_chunk_templates(campaign)
+            jobs = []
+            for user_id, name, email in recipients:
+                fields = {"name": name or "Learner"}
+                jobs.append((user_id, email, build_message(
+                    email, subject, text.safe_substitute(fields),
+                    html.safe_substitute(fields) if html else None,
+                )))
+
+            results = pool.send_all(jobs)
+            cursor_id = recipients[-1][0]
+            sent, failed = _checkpoint(campaign_id, cursor_id, results)
+            sent_total += sent
+            failed_total += failed
+            progress(f"Campaign {campaign_id}: sent {sent_total}, failed {failed_total} (through user {cursor_id})")
+
+        _set_status(campaign_id, "completed")
+    except Exception as e:
+        _set_status(campaign_id, "failed", str(e)[:500])
+        raise
+    finally:
+        pool.close()
+
+    return get_campaign(campaign_id)
+
+
+# --------------------------
+# CLI
+# --------------------------
+DEFAULT_TEXT = """Hello $name,
+
+New lessons are now available in $course_title. Continue learning here:
+$course_link
+
+- SilayLearn
+"""
+
+
+def _read(path):
+    with open(path, encoding="utf-8") as f:
+        return f.read()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    create = sub.add_parser("create", help="create a campaign and send it")
+    create.add_argument("--course", type=int, required=True)
+    create.add_argument("--subject", default="New lessons in $course_title")
+    create.add_argument("--text-file")
+    create.add_argument("--html-file")
+    create.add_argument("--no-run", action="store_true", help="only create it")
+
+    run = sub.add_parser("run", help="start or resume a campaign")
+    run.add_argument("campaign_id", type=int)
+
+    show = sub.add_parser("status", help="show a campaign's progress")
+    show.add_argument("campaign_id", type=int)
+
+    args = parser.parse_args(argv)
+
+    if args.command == "create":
+        body_text = _read(args.text_file) if args.text_file else DEFAULT_TEXT
+        body_html = _read(args.html_file) if args.html_file else None
+        campaign_id = create_campaign(args.course, args.subject, body_text, body_html)
+        print(f"Created campaign {campaign_id} for course {args.course}.")
+        if not args.no_run:
+            run_campaign(campaign_id)
+    elif args.command == "run":
+        run_campaign(args.campaign_id)
+    else:
+        campaign = get_campaign(args.campaign_id)
+        if campaign is None:
+            print(f"Campaign {args.campaign_id} does not exist.")
+            return 1
+        print(f"Campaign {campaign['id']} (course {campaign['course_id']}): {campaign['status']}, "
+              f"sent {campaign['total_sent']}, failed {campaign['total_failed']}, "
+              f"resume after user {campaign['last_user_id']}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,219 @@
+# catalog.py
+"""
+Course catalog served from an in-memory snapshot.
+
+The nested course -> content -> lesson tree (the same shape get_courses.php
+returns) is built once, JSON-encoded once and kept as immutable bytes with
+an ETag. A background thread in each worker polls one cheap version value
+every CATALOG_CHECK_INTERVAL seconds and rebuilds only when it moves.
+Catalog requests themselves never touch the database.
+
+The version is the `catalog_version` counter that migration 004's triggers
+bump on every change to the ref_* tables. Without that migration it falls
+back to a watermark: row counts of all four tables plus MAX(updated_at) of
+content and lessons. The watermark misses in-place edits to ref_courses and
+ref_instructors.
+"""
+import os
+import json
+import time
+import hashlib
+import threading
+from decimal import Decimal
+from collections import namedtuple
+
+import mysql.connector
+from mysql.connector import errorcode
+
+from db_pool import get_db, PoolTimeoutError
+
+# --------------------------
+# Catalog configuration
+# --------------------------
+CATALOG_CHECK_INTERVAL = float(os.environ.get("CATALOG_CHECK_INTERVAL", 10))  # seconds between version polls
+CATALOG_ASSETS_BASE = os.environ.get("CATALOG_ASSETS_BASE", "http://localhost/mooc_assets/")
+
+Snapshot = namedtuple("Snapshot", ["version", "etag", "body", "courses", "built_at"])
+
+_WATERMARK_SQL = (
+    "SELECT (SELECT COUNT(*) FROM ref_courses), (SELECT COUNT(*) FROM ref_instructors), "
+    "(SELECT COUNT(*) FROM ref_course_content), (SELECT MAX(updated_at) FROM ref_course_content), "
+    "(SELECT COUNT(*) FROM ref_course_lessons), (SELECT MAX(updated_at) FROM ref_course_lessons)"
+)
+
+
+def json_value(value):
+    # Match what PDO hands get_courses.php: DECIMAL and DATETIME come back as strings.
+    if isinstance(value, Decimal):
+        return str(value)
+    if hasattr(value, "strftime"):
+        return value.strftime("%Y-%m-%d %H:%M:%S")
+    return value
+
+
+def _rows(cursor, sql):
+    cursor.execute(sql)
+    return [{k: json_value(v) for k, v in row.items()} for row in cursor.fetchall()]
+
+
+def _asset_url(path):
+    return CATALOG_ASSETS_BASE + path if path else None
+
+
+def _image_variants():
+    # Imported late: image_variants -> media -> catalog.
+    from image_variants import variants
+    return variants
+
+
+def load_catalog(cursor):
+    """Reads the three catalog queries and nests them exactly like get_courses.php."""
+    courses = _rows(cursor,
+        "SELECT c.*, i.instructor_name, i.instructor_title, i.instructor_bio, i.instructor_image_path "
+        "FROM ref_courses AS c LEFT JOIN ref_instructors AS i ON c.instructor_id = i.instructor_id "
+        "ORDER BY c.course_id ASC"
+    )
+    contents = _rows(cursor,
+        "SELECT content_id, course_conn_id, course_id, course_content_title, course_content_lessons, "
+        "course_content_length, created_at, updated_at FROM ref_course_content "
+        "ORDER BY course_conn_id ASC, course_id ASC"
+    )
+    lessons = _rows(cursor,
+        "SELECT lesson_id, content_id, lesson_title, lesson_duration, lesson_type, progress, "
+        "lesson_directory, created_at, updated_at FROM ref_course_lessons "
+        "ORDER BY content_id ASC, lesson_id ASC"
+    )
+
+    lessons_by_content = {}
+    for lesson in lessons:
+        lesson["lesson_directory_url"] = _asset_url(lesson["lesson_directory"])
+        lessons_by_content.setdefault(lesson["content_id"], []).append(lesson)
+
+    contents_by_course = {}
+    for content in contents:
+        content["lessons"] = lessons_by_content.get(content["content_id"], [])
+        contents_by_course.setdefault(content["course_conn_id"], []).append(content)
+
+    variants = _image_variants()
+    for course in courses:
+        course["course_thumbnail_url"] = _asset_url(course.get("course_thumbnail"))
+        course["instructor_image_url"] = _asset_url(course.get("instructor_image_path"))
+        # Resized WebP/JPEG variants (image_variants.py); append &w=<px>. None until built.
+        course["course_thumbnail_variants_url"] = variants.url(course.get("course_thumbnail"))
+        course["instructor_image_variants_url"] = variants.url(course.get("instructor_image_path"))
+        course["course_contents"] = contents_by_course.get(course["course_id"], [])
+    return courses
+
+
+def _encode(value):
+    body = json.dumps(value, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+    return hashlib.sha1(body).hexdigest(), body
+
+
+class CourseCatalog:
+    def __init__(self):
+        self._snapshot = None
+        self._use_counter = True
+        self._build_lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+        self._start_lock = threading.Lock()
+
+        self.builds = 0
+        self.checks = 0
+        self.build_ms = 0.0
+
+    # ---- version / build ----
+    def _read_version(self, cursor):
+        if self._use_counter:
+            try:
+                cursor.execute("SELECT version FROM catalog_version WHERE id=1")
+                row = cursor.fetchone()
+                return f"v{row[0]}" if row else "v0"
+            except mysql.connector.ProgrammingError as err:
+                if err.errno != errorcode.ER_NO_SUCH_TABLE:
+                    raise
+                print("WARNING: catalog_version table missing (run migrate.py); using an updated_at watermark.")
+                self._use_counter = False
+        cursor.execute(_WATERMARK_SQL)
+        return "w" + hashlib.sha1(repr(cursor.fetchone()).encode("utf-8")).hexdigest()[:16]
+
+    def refresh(self, force=False):
+        """Rebuilds the snapshot if the version moved. Returns True when it rebuilt."""
+        with self._build_lock:
+            with get_db() as db:
+                cursor = db.cursor()
+                try:
+                    version = self._read_version(cursor)
+                finally:
+                    cursor.close()
+                # A variant build changes the URLs in the catalog too.
+                images = _image_variants().version()
+                if images:
+                    version += f"+i{images:x}"
+                self.checks += 1
+                if not force and self._snapshot is not None and self._snapshot.version == version:
+                    return False
+
+                start = time.perf_counter()
+                cursor = db.cursor(dictionary=True)
+                try:
+                    courses = load_catalog(cursor)
+                finally:
+                    cursor.close()
+
+            etag, body = _encode(courses)
+            by_id = {course["course_id"]: _encode(course) for course in courses}
+            self._snapshot = Snapshot(version, etag, body, by_id, time.time())
+            self.builds += 1
+            self.build_ms = (time.perf_counter() - start) * 1000
+            return True
+
+    def snapshot(self):
+        """The current snapshot; the first call in a worker builds it and starts the poller."""
+        snap = self._snapshot
+        if snap is None:
+            self.refresh()
+            snap = self._snapshot
+        self.ensure_started()
+        return snap
+
+    # ---- background poller ----
+    def ensure_started(self):
+        if CATALOG_CHECK_INTERVAL <= 0:
+            return
+        if self._thread is not None and self._pid == os.getpid() and self._thread.is_alive():
+            return
+        with self._start_lock:
+            if self._thread is not None and self._pid == os.getpid() and self._thread.is_alive():
+                return
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name="catalog-refresh", daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            time.sleep(CATALOG_CHECK_INTERVAL)
+            try:
+                if self.refresh():
+                    print(f"INFO: course catalog rebuilt ({self._snapshot.version}, {self.build_ms:.1f} ms)")
+            except (mysql.connector.Error, PoolTimeoutError) as err:
+                # Keep serving the last good snapshot.
+                print(f"ERROR: could not refresh the course catalog: {err}")
+
+    def stats(self):
+        snap = self._snapshot
+        return {
+            "version": snap.version if snap else None,
+            "etag": snap.etag if snap else None,
+            "courses": len(snap.courses) if snap else 0,
+            "bytes": len(snap.body) if snap else 0,
+            "built_at": snap.built_at if snap else None,
+            "builds": self.builds,
+            "version_checks": self.checks,
+            "last_build_ms": round(self.build_ms, 3),
+            "version_source": "catalog_version" if self._use_counter else "watermark",
+        }
+
+
+catalog = CourseCatalog()
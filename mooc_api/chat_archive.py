@@ -0,0 +1,281 @@
+# chat_archive.py
+"""
+Cold tier for chat_history.
+
+Turns older than CHAT_ARCHIVE_AFTER_DAYS move to `chat_history_archive`
+(migration 006) as per-user chunks of zlib-compressed JSON. chat_history
+then holds only recent turns and stays in the buffer pool. Each user's
+newest CHAT_ARCHIVE_KEEP_RECENT turns always stay hot, so the chat summary
+never needs the archive. A chunk's rows are inserted and deleted from
+chat_history in one transaction, so a reader sees every turn in exactly
+one tier. All archived ids of a user are lower than its hot ids.
+
+Run it from cron, or set CHAT_ARCHIVE_INTERVAL to archive from a
+background thread in each worker:
+
+    python chat_archive.py run
+"""
+import os
+import sys
+import json
+import zlib
+import datetime
+import threading
+
+import mysql.connector
+from mysql.connector import errorcode
+
+from db_pool import get_db, PoolTimeoutError
+from context_store import SUMMARY_TURNS
+from metrics import db_timer
+
+# --------------------------
+# Archive configuration
+# --------------------------
+CHAT_ARCHIVE_AFTER_DAYS = float(os.environ.get("CHAT_ARCHIVE_AFTER_DAYS", 90))      # age at which turns go cold
+CHAT_ARCHIVE_KEEP_RECENT = int(os.environ.get("CHAT_ARCHIVE_KEEP_RECENT", SUMMARY_TURNS))  # newest turns per user kept hot
+CHAT_ARCHIVE_CHUNK_ROWS = int(os.environ.get("CHAT_ARCHIVE_CHUNK_ROWS", 500))       # turns per compressed chunk
+CHAT_ARCHIVE_USER_BATCH = int(os.environ.get("CHAT_ARCHIVE_USER_BATCH", 500))       # users looked up per query
+CHAT_ARCHIVE_INTERVAL = float(os.environ.get("CHAT_ARCHIVE_INTERVAL", 0))           # seconds; 0 = cron only
+
+_CHUNKS_PER_QUERY = 4   # chunks fetched per query when the caller reads without a limit
+
+_table_missing = False
+
+
+def _iso(value):
+    return value.isoformat() if hasattr(value, "isoformat") else value
+
+
+def pack_rows(rows):
+    """[{id, role, message, created_at}] -> compressed chunk payload."""
+    data = [[row["id"], row["role"], row["message"], _iso(row["created_at"])] for row in rows]
+    return zlib.compress(json.dumps(data, ensure_ascii=False, separators=(",", ":")).encode("utf-8"))
+
+
+def unpack_chunk(payload):
+    """Compressed chunk payload -> [{id, role, message, created_at}], oldest first."""
+    data = json.loads(zlib.decompress(payload).decode("utf-8"))
+    return [{"id": i, "role": role, "message": message, "created_at": created_at}
+            for i, role, message, created_at in data]
+
+
+# --------------------------
+# Reading the cold tier
+# --------------------------
+def archived_rows(cursor, user_id, after_id=None, before_id=None, newest_first=False, limit=None):
+    """
+    Yields up to `limit` of a user's archived turns with after_id < id <
+    before_id, oldest first (or newest first). Chunks are fetched compressed,
+    a few per query (just enough for `limit`, plus one for the chunk that
+    straddles after_id/before_id), and unpacked one at a time; further chunks
+    are fetched only if the caller keeps reading. A user with nothing
+    archived costs one index probe.
+    """
+    global _table_missing
+    if _table_missing:
+        return
+
+    where = "user_id=%s"
+    params = [user_id]
+    if after_id is not None:
+        where += " AND last_id > %s"
+        params.append(after_id)
+    if before_id is not None:
+        where += " AND first_id < %s"
+        params.append(before_id)
+    order = "DESC" if newest_first else "ASC"
+    per_query = -(-limit // CHAT_ARCHIVE_CHUNK_ROWS) + 1 if limit else _CHUNKS_PER_QUERY
+
+    page, page_params = "", []
+    yielded = 0
+    while True:
+        try:
+            with db_timer("archive_read"):
+                cursor.execute(
+                    f"SELECT first_id, payload FROM chat_history_archive WHERE {where}{page} "
+                    f"ORDER BY first_id {order} LIMIT %s",
+                    params + page_params + [per_query]
+                )
+                chunks = [(chunk["first_id"], chunk["payload"]) if isinstance(chunk, dict) else tuple(chunk)
+                          for chunk in cursor.fetchall()]
+        except mysql.connector.ProgrammingError as err:
+            if err.errno != errorcode.ER_NO_SUCH_TABLE:
+                raise
+            print("WARNING: chat_history_archive table missing (run migrate.py); reading chat_history only.")
+            _table_missing = True
+            return
+
+        for _, payload in chunks:
+            rows = unpack_chunk(payload)
+            if newest_first:
+                rows.reverse()
+            for row in rows:
+                if (after_id is None or row["id"] > after_id) and (before_id is None or row["id"] < before_id):
+                    yield row
+                    yielded += 1
+                    if limit and yielded >= limit:
+                        return
+
+        if len(chunks) < per_query:
+            return
+        # Keyset to the next few chunks on the (user_id, first_id) index.
+        page = " AND first_id < %s" if newest_first else " AND first_id > %s"
+        page_params = [chunks[-1][0]]
+
+
+# --------------------------
+# Moving turns to the cold tier
+# --------------------------
+def _boundary_id(cursor, cutoff):
+    """Lowest id written at or after `cutoff`; ids grow with time, so older turns sit below it."""
+    cursor.execute("SELECT id FROM chat_history WHERE created_at >= %s ORDER BY id LIMIT 1", (cutoff,))
+    row = cursor.fetchone()
+    if row:
+        return row[0]
+    cursor.execute("SELECT COALESCE(MAX(id), 0) + 1 FROM chat_history")
+    return cursor.fetchone()[0]
+
+
+def archive_user(db, user_id, boundary_id, keep_recent=CHAT_ARCHIVE_KEEP_RECENT, chunk_rows=CHAT_ARCHIVE_CHUNK_ROWS):
+    """Moves one user's turns below boundary_id (minus the newest keep_recent) into the archive. Returns rows moved."""
+    moved = 0
+    cursor = db.cursor(dictionary=True)
+    try:
+        while True:
+            db.start_transaction()
+            limit_id = boundary_id
+            if keep_recent > 0:
+                cursor.execute(
+                    "SELECT id FROM chat_history WHERE user_id=%s ORDER BY id DESC LIMIT 1 OFFSET %s",
+                    (user_id, keep_recent - 1)
+                )
+                kept = cursor.fetchone()
+                if kept is None:
+                    db.rollback()
+                    return moved
+                limit_id = min(limit_id, kept["id"])
+
+            cursor.execute(
+                "SELECT id, role, message, created_at FROM chat_history "
+                "WHERE user_id=%s AND id < %s ORDER BY id LIMIT %s FOR UPDATE",
+                (user_id, limit_id, chunk_rows)
+            )
+            rows = cursor.fetchall()
+            if not rows:
+                db.rollback()
+                return moved
+
+            first_id, last_id = rows[0]["id"], rows[-1]["id"]
+            cursor.execute(
+                "INSERT INTO chat_history_archive (user_id, first_id, last_id, row_count, last_created_at, payload) "
+                "VALUES (%s, %s, %s, %s, %s, %s)",
+                (user_id, first_id, last_id, len(rows), rows[-1]["created_at"], pack_rows(rows))
+            )
+            # The locked rows are exactly this user's ids in [first_id, last_id].
+            cursor.execute(
+                "DELETE FROM chat_history WHERE user_id=%s AND id BETWEEN %s AND %s",
+                (user_id, first_id, last_id)
+            )
+            if cursor.rowcount != len(rows):
+                db.rollback()
+                print(f"WARNING: chat history of user {user_id} changed while archiving; will retry next run.")
+                return moved
+            db.commit()
+            moved += len(rows)
+            if len(rows) < chunk_rows:
+                return moved
+    except mysql.connector.Error:
+        if db.in_transaction:
+            db.rollback()
+        raise
+    finally:
+        cursor.close()
+
+
+def run_archive(after_days=CHAT_ARCHIVE_AFTER_DAYS):
+    """Archives every user's old turns. Returns (users_touched, rows_moved)."""
+    cutoff = datetime.datetime.now() - datetime.timedelta(days=after_days)
+    users_touched = rows_moved = 0
+    last_user = -1
+    with get_db() as db:
+        cursor = db.cursor()
+        try:
+            boundary_id = _boundary_id(cursor, cutoff)
+            db.commit()
+            while True:
+                cursor.execute(
+                    "SELECT DISTINCT user_id FROM chat_history WHERE id < %s AND user_id > %s "
+                    "ORDER BY user_id LIMIT %s",
+                    (boundary_id, last_user, CHAT_ARCHIVE_USER_BATCH)
+                )
+                user_ids = [row[0] for row in cursor.fetchall()]
+                db.commit()
+                if not user_ids:
+                    break
+                for user_id in user_ids:
+                    moved = archive_user(db, user_id, boundary_id)
+                    if moved:
+                        users_touched += 1
+                        rows_moved += moved
+                last_user = user_ids[-1]
+        finally:
+            cursor.close()
+    return users_touched, rows_moved
+
+
+class ChatArchiver:
+    """Runs run_archive() every CHAT_ARCHIVE_INTERVAL seconds in each worker (off by default)."""
+
+    def __init__(self):
+        self._thread = None
+        self._pid = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self.runs = 0
+        self.rows_archived = 0
+
+    def ensure_started(self):
+        if CHAT_ARCHIVE_INTERVAL <= 0:
+            return
+        with self._lock:
+            if self._thread is not None and self._pid == os.getpid() and self._thread.is_alive():
+                return
+            self._pid = os.getpid()
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="chat-archiver", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        while not self._stop.wait(CHAT_ARCHIVE_INTERVAL):
+            try:
+                users, rows = run_archive()
+            except (mysql.connector.Error, PoolTimeoutError) as err:
+                print(f"ERROR: could not archive chat history: {err}")
+                continue
+            self.runs += 1
+            self.rows_archived += rows
+            if rows:
+                print(f"INFO: archived {rows} chat turns of {users} users")
+
+    def stats(self):
+        return {
+            "after_days": CHAT_ARCHIVE_AFTER_DAYS,
+            "interval_s": CHAT_ARCHIVE_INTERVAL,
+            "runs": self.runs,
+            "rows_archived": self.rows_archived,
+        }
+
+
+archiver = ChatArchiver()
+
+
+if __name__ == "__main__":
+    if sys.argv[1:] != ["run"]:
+        print(__doc__)
+        sys.exit(1)
+    users, rows = run_archive()
+    print(f"Archived {rows} chat turns of {users} users.")
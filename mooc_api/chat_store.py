@@ -0,0 +1,391 @@
+# chat_store.py
+import os
+import atexit
+import threading
+from collections import deque
+
+import mysql.connector
+
+from db_pool import get_db, PoolTimeoutError
+from metrics import db_timer
+from context_store import context_store, summary_line, SUMMARY_TURNS
+from chat_archive import archived_rows
+
+# --------------------------
+# Write-behind configuration
+# --------------------------
+CHAT_WRITE_BATCH_SIZE = int(os.environ.get("CHAT_WRITE_BATCH_SIZE", 100))      # rows per multi-row INSERT
+CHAT_WRITE_FLUSH_INTERVAL = float(os.environ.get("CHAT_WRITE_FLUSH_INTERVAL", 0.5))  # seconds between flushes
+CHAT_WRITE_QUEUE_MAX = int(os.environ.get("CHAT_WRITE_QUEUE_MAX", 1000))       # pending rows before back-pressure
+
+NO_HISTORY = "No previous conversation."
+
+# --------------------------
+# History API configuration
+# --------------------------
+HISTORY_MAX_PAGE = int(os.environ.get("HISTORY_MAX_PAGE", 500))     # largest `limit` a client may ask for
+HISTORY_FETCH_SIZE = int(os.environ.get("HISTORY_FETCH_SIZE", 200))  # rows pulled per fetchmany() when streaming
+
+
+def _insert_rows(cursor, rows):
+    """Writes (user_id, role, message) tuples with a single multi-row INSERT."""
+    placeholders = ", ".join(["(%s, %s, %s)"] * len(rows))
+    params = [value for row in rows for value in row]
+    with db_timer("chat_insert"):
+        cursor.execute(
+            f"INSERT INTO chat_history (user_id, role, message) VALUES {placeholders}",
+            params
+        )
+
+
+def build_summary(rows):
+    """Turns newest-first (role, message) rows into the short context block used in prompts."""
+    if not rows:
+        return NO_HISTORY
+
+    return "\n".join(summary_line(role, msg) for role, msg in reversed(rows))
+
+
+class ChatWriteBehind:
+    """
+    Bounded write-behind buffer for chat_history rows.
+
+    Rows are flushed by a background thread in multi-row INSERTs. If the
+    buffer is full the caller flushes inline, so memory stays bounded even
+    when MySQL falls behind. Remaining rows are flushed on interpreter exit.
+    """
+
+    def __init__(self, batch_size=100, flush_interval=0.5, max_pending=1000):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+
+        self._pending = deque()
+        self._inflight_users = set()
+        self._cond = threading.Condition()
+        self._flush_lock = threading.Lock()
+        self._stopped = False
+        self._thread = None
+        self._pid = None
+
+        self.batches_written = 0
+        self.rows_written = 0
+        self.rows_dropped = 0
+        self.write_errors = 0
+
+    def _ensure_thread(self):
+        # Threads do not survive fork; start one lazily in each worker.
+        if self._thread is None or self._pid != os.getpid():
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name="chat-write-behind", daemon=True)
+            self._thread.start()
+
+    def enqueue(self, user_id, role, message):
+        with self._cond:
+            self._ensure_thread()
+            self._pending.append((user_id, role, message))
+            full = len(self._pending) >= self.max_pending
+            if len(self._pending) >= self.batch_size:
+                self._cond.notify()
+        if full:
+            self.flush()
+
+    def take_pending(self, user_id):
+        """
+        Removes and returns this user's unflushed rows so the caller can write
+        them in its own transaction, ahead of newer rows for the same user.
+        """
+        with self._cond:
+            while user_id in self._inflight_users:
+                self._cond.wait()
+            mine = [row for row in self._pending if row[0] == user_id]
+            if mine:
+                self._pending = deque(row for row in self._pending if row[0] != user_id)
+            return mine
+
+    def requeue(self, rows):
+        """Puts rows taken with take_pending() back at the front of the buffer."""
+        with self._cond:
+            self._pending.extendleft(reversed(rows))
+
+    def pending_count(self):
+        with self._cond:
+            return len(self._pending)
+
+    def flush(self):
+        """Writes everything currently buffered, one multi-row INSERT per batch."""
+        with self._flush_lock:
+            while True:
+                with self._cond:
+                    if not self._pending:
+                        return
+                    batch = [self._pending.popleft() for _ in range(min(self.batch_size, len(self._pending)))]
+                    self._inflight_users.update(row[0] for row in batch)
+                try:
+                    self._write_batch(batch)
+                finally:
+                    with self._cond:
+                        self._inflight_users.clear()
+                        self._cond.notify_all()
+
+    def _write_batch(self, batch):
+        try:
+            with get_db() as db:
+                cursor = db.cursor()
+                try:
+                    written = self._insert_or_split(db, cursor, batch)
+                finally:
+                    cursor.close()
+            self.batches_written += 1
+            self.rows_written += written
+        except (mysql.connector.Error, PoolTimeoutError) as err:
+            self.write_errors += 1
+            print(f"ERROR: write-behind flush of {len(batch)} chat rows failed: {err}")
+
+    def _insert_or_split(self, db, cursor, rows):
+        """
+        Inserts rows, returning how many were written. A batch mixes many
+        users, so when MySQL rejects a row (say, the user was just purged) the
+        batch is retried in halves and only the rejected rows are dropped.
+        """
+        try:
+            _insert_rows(cursor, rows)
+            db.commit()
+            return len(rows)
+        except (mysql.connector.IntegrityError, mysql.connector.DataError) as err:
+            db.rollback()
+            if len(rows) == 1:
+                self.rows_dropped += 1
+                print(f"ERROR: dropped write-behind chat row for user {rows[0][0]}: {err}")
+                return 0
+        mid = len(rows) // 2
+        return self._insert_or_split(db, cursor, rows[:mid]) + self._insert_or_split(db, cursor, rows[mid:])
+
+    def _run(self):
+        while True:
+            with self._cond:
+                if not self._stopped and len(self._pending) < self.batch_size:
+                    self._cond.wait(self.flush_interval)
+                stopped = self._stopped
+            self.flush()
+            if stopped:
+                return
+
+    def close(self):
+        with self._cond:
+            self._stopped = True
+            self._cond.notify_all()
+        self.flush()
+
+    def stats(self):
+        return {
+            "pending": self.pending_count(),
+            "batches_written": self.batches_written,
+            "rows_written": self.rows_written,
+            "rows_dropped": self.rows_dropped,
+            "write_errors": self.write_errors,
+        }
+
+
+writer = ChatWriteBehind(
+    batch_size=CHAT_WRITE_BATCH_SIZE,
+    flush_interval=CHAT_WRITE_FLUSH_INTERVAL,
+    max_pending=CHAT_WRITE_QUEUE_MAX,
+)
+atexit.register(writer.close)
+
+
+# --------------------------
+# Chat persistence API
+# --------------------------
+def save_message(user_id, role, message):
+    """Saves a chat message synchronously."""
+    try:
+        with get_db() as db:
+            cursor = db.cursor()
+            try:
+                _insert_rows(cursor, [(user_id, role, message)])
+                db.commit()
+            finally:
+                cursor.close()
+    except (mysql.connector.Error, PoolTimeoutError) as err:
+        print(f"ERROR saving message: {err}")
+
+
+def save_reply(user_id, message):
+    """Queues an assistant reply for the write-behind flusher."""
+    context_store.append(user_id, "assistant", message)
+    writer.enqueue(user_id, "assistant", message)
+
+
+def begin_turn(user_id, user_msg):
+    """
+    Stores the user's message and returns the conversation summary.
+
+    For a user already in the context store this is a single INSERT and the
+    summary comes from memory. On a cold miss the INSERT and the summary read
+    share one transaction and the result seeds the store. Any of this user's
+    replies still waiting in the write-behind buffer are written first so ids
+    stay in order.
+    """
+    earlier = writer.take_pending(user_id)
+    rows = earlier + [(user_id, "user", user_msg)]
+    warm = context_store.is_warm(user_id)
+
+    try:
+        with get_db() as db:
+            cursor = db.cursor()
+            try:
+                if warm:
+                    _insert_rows(cursor, rows)
+                    db.commit()   # autocommit is off; release() would roll an open insert back
+                else:
+                    db.start_transaction()
+                    _insert_rows(cursor, rows)
+                    with db_timer("summary_read"):
+                        cursor.execute(
+                            "SELECT role, message FROM chat_history WHERE user_id=%s ORDER BY id DESC LIMIT %s",
+                            (user_id, SUMMARY_TURNS)
+                        )
+                        recent = cursor.fetchall()
+                    db.commit()
+            except mysql.connector.Error:
+                if db.in_transaction:
+                    db.rollback()
+                raise
+            finally:
+                cursor.close()
+    except Exception:
+        if earlier:
+            writer.requeue(earlier)
+        raise
+
+    if warm:
+        context_store.append(user_id, "user", user_msg)
+    else:
+        context_store.seed(user_id, recent)
+
+    summary = context_store.summary(user_id)
+    if summary is None:
+        # Evicted between the check and now; read it the old way.
+        return load_chat_summary(user_id)
+    return summary or NO_HISTORY
+
+
+def load_chat_summary(user_id):
+    """Retrieves history for the specific user_id to provide context to the AI."""
+    with get_db() as db:
+        cursor = db.cursor()
+        with db_timer("summary_read"):
+            cursor.execute(
+                "SELECT role, message FROM chat_history WHERE user_id=%s ORDER BY id DESC LIMIT %s",
+                (user_id, SUMMARY_TURNS)
+            )
+            rows = cursor.fetchall()
+        cursor.close()
+
+    return build_summary(rows)
+
+
+def _history_row(row):
+    created_at = row.get("created_at")
+    if hasattr(created_at, "isoformat"):
+        row["created_at"] = created_at.isoformat()
+    return row
+
+
+def fetch_history_page(user_id, limit, before_id=None, after_id=None):
+    """
+    One keyset page of a user's history, oldest first.
+
+    after_id  -> the `limit` rows right after that id (paging forward)
+    before_id -> the `limit` rows right before that id (paging back)
+    neither   -> the newest `limit` rows
+
+    Pages that reach past the hot rows continue into the archive tier
+    (chat_archive.py); archived ids are always below the hot ones.
+    """
+    limit = max(1, min(limit, HISTORY_MAX_PAGE))
+    params = [user_id]
+    where = "user_id=%s"
+    if after_id is not None:
+        where += " AND id > %s"
+        params.append(after_id)
+    if before_id is not None:
+        where += " AND id < %s"
+        params.append(before_id)
+    # Paging forward reads ascending; otherwise read the newest rows and flip them.
+    order = "ASC" if after_id is not None else "DESC"
+
+    with get_db() as db:
+        # One snapshot for both tiers, so turns being archived meanwhile are
+        # neither missed nor returned twice. The pool ends it on release.
+        db.start_transaction(consistent_snapshot=True, readonly=True)
+        cursor = db.cursor(dictionary=True)
+        try:
+            if order == "ASC":
+                rows = list(archived_rows(cursor, user_id, after_id=after_id, before_id=before_id, limit=limit))
+                if len(rows) < limit:
+                    with db_timer("history_read"):
+                        cursor.execute(
+                            f"SELECT id, role, message, created_at FROM chat_history WHERE {where} "
+                            f"ORDER BY id ASC LIMIT %s",
+                            params + [limit - len(rows)]
+                        )
+                        rows += cursor.fetchall()
+            else:
+                with db_timer("history_read"):
+                    cursor.execute(
+                        f"SELECT id, role, message, created_at FROM chat_history WHERE {where} "
+                        f"ORDER BY id DESC LIMIT %s",
+                        params + [limit]
+                    )
+                    rows = cursor.fetchall()
+                if len(rows) < limit:
+                    older_than = rows[-1]["id"] if rows else before_id
+                    rows += archived_rows(cursor, user_id, before_id=older_than, newest_first=True, limit=limit - len(rows))
+                rows.reverse()
+        finally:
+            cursor.close()
+
+    return [_history_row(row) for row in rows]
+
+
+def iter_chat_history(user_id):
+    """
+    Yields a user's whole history, oldest first. Hot rows come straight off an
+    unbuffered server-side cursor in HISTORY_FETCH_SIZE chunks, so they are
+    never held in memory; archived turns are unpacked chunk by chunk first.
+    """
+    with get_db() as db:
+        # Archived turns first (they are the oldest), then the hot rows, both
+        # from one snapshot so a concurrent archive run cannot move rows between them.
+        db.start_transaction(consistent_snapshot=True, readonly=True)
+        cursor = db.cursor(dictionary=True)
+        try:
+            for row in archived_rows(cursor, user_id):
+                yield _history_row(row)
+        finally:
+            cursor.close()
+
+        cursor = db.cursor(dictionary=True, buffered=False)
+        exhausted = False
+        try:
+            # Times the query to its first rows; the rest is paced by the client.
+            with db_timer("history_read"):
+                cursor.execute(
+                    "SELECT id, role, message, created_at FROM chat_history WHERE user_id=%s ORDER BY id ASC",
+                    (user_id,)
+                )
+            while True:
+                rows = cursor.fetchmany(HISTORY_FETCH_SIZE)
+                if not rows:
+                    exhausted = True
+                    break
+                for row in rows:
+                    yield _history_row(row)
+        finally:
+            # If the client went away mid-stream, rows are still on the wire;
+            # the pool sees unread_result and drops the connection.
+            if exhausted:
+                cursor.close()
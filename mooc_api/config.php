@@ -18,6 +18,10 @@ define('DB_USERNAME', 'root');
 define('DB_PASSWORD', '');     
 define('DB_NAME', 'my_app_db');
 
+// bcrypt cost for new and upgraded password hashes. The Flask API reads the same BCRYPT_COST
+// with the same default; set one value for both (`python hashing.py calibrate` suggests one).
+define('BCRYPT_COST', (int) (getenv('BCRYPT_COST') ?: 12));
+
 $conn = new mysqli(DB_SERVER, DB_USERNAME, DB_PASSWORD, DB_NAME);
 
 if ($conn->connect_error) {
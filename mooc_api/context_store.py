@@ -0,0 +1,107 @@
+# context_store.py
+import os
+import time
+import threading
+from collections import OrderedDict, deque
+
+# --------------------------
+# Context store configuration
+# --------------------------
+CONTEXT_STORE_MAX_USERS = int(os.environ.get("CONTEXT_STORE_MAX_USERS", 10000))  # LRU bound on cached users
+# Another worker may have served this user's later turns; re-read from the DB
+# once an entry has been idle this long.
+CONTEXT_STORE_IDLE_TTL = float(os.environ.get("CONTEXT_STORE_IDLE_TTL", 900))
+
+SUMMARY_TURNS = 10
+SUMMARY_LINE_CHARS = 120
+
+
+def summary_line(role, message):
+    short = message[:SUMMARY_LINE_CHARS].replace("\n", " ")
+    return f"{role}: {short}"
+
+
+class ConversationContextStore:
+    """
+    Per-user ring buffer of the last SUMMARY_TURNS summary lines.
+
+    Each saved turn appends one line, so building the prompt context is a
+    join over at most ten short strings. A user who is not cached (first
+    turn, evicted or idle) is a cold miss: the caller reads the recent rows
+    from chat_history once and seeds the buffer.
+    """
+
+    def __init__(self, max_users=10000, idle_ttl=900.0, turns=SUMMARY_TURNS):
+        self.max_users = max_users
+        self.idle_ttl = idle_ttl
+        self.turns = turns
+        self._entries = OrderedDict()   # user_id -> [deque of lines, last_used]
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _live_entry(self, user_id):
+        entry = self._entries.get(user_id)
+        if entry is None:
+            return None
+        if time.monotonic() - entry[1] > self.idle_ttl:
+            del self._entries[user_id]
+            return None
+        return entry
+
+    def is_warm(self, user_id):
+        with self._lock:
+            warm = self._live_entry(user_id) is not None
+            if warm:
+                self.hits += 1
+            else:
+                self.misses += 1
+            return warm
+
+    def seed(self, user_id, rows_newest_first):
+        """Fills the buffer from `SELECT role, message ... ORDER BY id DESC LIMIT n` rows."""
+        lines = deque((summary_line(role, msg) for role, msg in reversed(rows_newest_first)),
+                      maxlen=self.turns)
+        with self._lock:
+            self._entries[user_id] = [lines, time.monotonic()]
+            self._entries.move_to_end(user_id)
+            while len(self._entries) > self.max_users:
+                self._entries.popitem(last=False)
+
+    def append(self, user_id, role, message):
+        """Records a new turn for a warm user; cold users are loaded on their next read."""
+        with self._lock:
+            entry = self._live_entry(user_id)
+            if entry is None:
+                return
+            entry[0].append(summary_line(role, message))
+            entry[1] = time.monotonic()
+            self._entries.move_to_end(user_id)
+
+    def summary(self, user_id):
+        """The prompt context block, or None on a cold miss."""
+        with self._lock:
+            entry = self._live_entry(user_id)
+            if entry is None:
+                return None
+            return "\n".join(entry[0])
+
+    def invalidate(self, user_id):
+        with self._lock:
+            self._entries.pop(user_id, None)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "users_cached": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            }
+
+
+context_store = ConversationContextStore(
+    max_users=CONTEXT_STORE_MAX_USERS,
+    idle_ttl=CONTEXT_STORE_IDLE_TTL,
+)
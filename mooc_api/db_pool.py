@@ -0,0 +1,249 @@
+# db_pool.py
+import os
+import time
+import threading
+from contextlib import contextmanager
+
+import mysql.connector
+
+# --------------------------
+# Database configuration
+# --------------------------
+DB_CONFIG = {
+    "host": os.environ.get("DB_HOST", "localhost"),
+    "user": os.environ.get("DB_USER", "root"),
+    "password": os.environ.get("DB_PASSWORD", ""),
+    "database": os.environ.get("DB_NAME", "my_app_db"),
+    "port": int(os.environ.get("DB_PORT", 3306)),
+}
+# The C extension blocks the whole process inside a query; cooperative (gevent)
+# workers need the pure-Python driver, whose sockets gevent can patch.
+if os.environ.get("DB_USE_PURE") == "1":
+    DB_CONFIG["use_pure"] = True
+
+# --------------------------
+# Pool configuration
+# --------------------------
+DB_POOL_SIZE = int(os.environ.get("DB_POOL_SIZE", 5))             # connections kept open
+DB_POOL_MAX_OVERFLOW = int(os.environ.get("DB_POOL_MAX_OVERFLOW", 10))  # extra short-lived connections
+DB_POOL_TIMEOUT = float(os.environ.get("DB_POOL_TIMEOUT", 10))     # seconds to wait for a free connection
+DB_POOL_RECYCLE = float(os.environ.get("DB_POOL_RECYCLE", 1800))   # reopen connections older than this
+DB_POOL_PRE_PING = os.environ.get("DB_POOL_PRE_PING", "1") == "1"  # health check on borrow
+
+
+class PoolTimeoutError(Exception):
+    """Raised when no connection became available within the checkout timeout."""
+
+
+class _PooledConnection:
+    """Keeps a raw connection together with the time it was opened."""
+
+    def __init__(self, conn):
+        self.conn = conn
+        self.created_at = time.monotonic()
+
+
+class ConnectionPool:
+    """
+    A small thread-safe MySQL connection pool.
+
+    Up to `size` connections are kept open between requests. When all of them
+    are busy, up to `max_overflow` extra connections may be opened; those are
+    closed on release instead of being returned to the pool.
+    """
+
+    def __init__(self, config, size=5, max_overflow=10, timeout=10.0,
+                 recycle=1800.0, pre_ping=True):
+        self.config = config
+        self.size = size
+        self.max_overflow = max_overflow
+        self.timeout = timeout
+        self.recycle = recycle
+        self.pre_ping = pre_ping
+
+        self._idle = []
+        self._checked_out = 0
+        self._cond = threading.Condition()
+        self._pid = os.getpid()
+
+        # Stats (guarded by self._cond)
+        self._checkouts = 0
+        self._timeouts = 0
+        self._connects = 0
+        self._recycled = 0
+        self._failed_pings = 0
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+        self._peak_checked_out = 0
+
+    # ---- internals ----
+    def _connect(self):
+        conn = mysql.connector.connect(**self.config)
+        with self._cond:
+            self._connects += 1
+        return _PooledConnection(conn)
+
+    def _is_usable(self, pooled):
+        """Drops connections that are too old or fail the borrow-time health check."""
+        if self.recycle and time.monotonic() - pooled.created_at > self.recycle:
+            with self._cond:
+                self._recycled += 1
+            return False
+        if self.pre_ping:
+            try:
+                pooled.conn.ping(reconnect=False)
+            except mysql.connector.Error:
+                with self._cond:
+                    self._failed_pings += 1
+                return False
+        return True
+
+    def _discard(self, pooled):
+        try:
+            pooled.conn.close()
+        except Exception:
+            pass
+
+    def _reset_after_fork(self):
+        # Sockets inherited from the parent process must not be shared.
+        self._idle = []
+        self._checked_out = 0
+        self._cond = threading.Condition()
+        self._pid = os.getpid()
+
+    # ---- public API ----
+    def acquire(self):
+        """Borrows a connection, waiting up to `timeout` seconds for one to free up."""
+        if self._pid != os.getpid():
+            self._reset_after_fork()
+
+        start = time.monotonic()
+        deadline = start + self.timeout
+
+        with self._cond:
+            while True:
+                if self._idle:
+                    pooled = self._idle.pop()
+                    break
+                if self._checked_out < self.size + self.max_overflow:
+                    pooled = None
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._timeouts += 1
+                    raise PoolTimeoutError(
+                        f"No database connection available after {self.timeout}s "
+                        f"({self._checked_out} in use)"
+                    )
+                self._cond.wait(remaining)
+
+            self._checked_out += 1
+            self._peak_checked_out = max(self._peak_checked_out, self._checked_out)
+
+        try:
+            if pooled is not None and not self._is_usable(pooled):
+                self._discard(pooled)
+                pooled = None
+            if pooled is None:
+                pooled = self._connect()
+        except Exception:
+            with self._cond:
+                self._checked_out -= 1
+                self._cond.notify()
+            raise
+
+        waited = time.monotonic() - start
+        with self._cond:
+            self._checkouts += 1
+            self._wait_total += waited
+            self._wait_max = max(self._wait_max, waited)
+        return pooled
+
+    def release(self, pooled, broken=False):
+        """Returns a connection to the pool (or closes it if the pool is full or it is broken)."""
+        if not broken:
+            try:
+                # A streamed SELECT abandoned half-way leaves rows on the wire;
+                # such a connection cannot be reused.
+                if pooled.conn.unread_result:
+                    broken = True
+                # Never hand a half-finished transaction to the next borrower.
+                # (Callers use start_transaction() rather than toggling
+                # autocommit, so checking in_transaction costs no round trip.)
+                elif pooled.conn.in_transaction:
+                    pooled.conn.rollback()
+            except mysql.connector.Error:
+                broken = True
+
+        with self._cond:
+            self._checked_out -= 1
+            keep = not broken and len(self._idle) < self.size
+            if keep:
+                self._idle.append(pooled)
+            self._cond.notify()
+
+        if not keep:
+            self._discard(pooled)
+
+    @contextmanager
+    def connection(self):
+        pooled = self.acquire()
+        broken = False
+        try:
+            yield pooled.conn
+        except mysql.connector.errors.OperationalError:
+            broken = True
+            raise
+        except mysql.connector.errors.InterfaceError:
+            broken = True
+            raise
+        finally:
+            self.release(pooled, broken=broken)
+
+    def stats(self):
+        """Snapshot of pool sizing data: utilisation, wait times and churn."""
+        with self._cond:
+            capacity = self.size + self.max_overflow
+            return {
+                "size": self.size,
+                "max_overflow": self.max_overflow,
+                "idle": len(self._idle),
+                "checked_out": self._checked_out,
+                "peak_checked_out": self._peak_checked_out,
+                "utilisation": round(self._checked_out / capacity, 3) if capacity else 0.0,
+                "checkouts": self._checkouts,
+                "timeouts": self._timeouts,
+                "connects": self._connects,
+                "recycled": self._recycled,
+                "failed_pings": self._failed_pings,
+                "wait_avg_ms": round(1000 * self._wait_total / self._checkouts, 3) if self._checkouts else 0.0,
+                "wait_max_ms": round(1000 * self._wait_max, 3),
+            }
+
+
+# --------------------------
+# Process-wide pool
+# --------------------------
+pool = ConnectionPool(
+    DB_CONFIG,
+    size=DB_POOL_SIZE,
+    max_overflow=DB_POOL_MAX_OVERFLOW,
+    timeout=DB_POOL_TIMEOUT,
+    recycle=DB_POOL_RECYCLE,
+    pre_ping=DB_POOL_PRE_PING,
+)
+
+
+def get_db():
+    """
+    Borrows a pooled MySQL connection for the duration of a `with` block.
+
+        with get_db() as db:
+            cursor = db.cursor()
+            ...
+    """
+    return pool.connection()
+
+
+def pool_stats():
+    return pool.stats()
@@ -1,11 +1,12 @@
 # email_handler.py
-import smtplib
-from email.mime.text import MIMEText
-from email.mime.multipart import MIMEMultipart
 import os
 import uuid
 import datetime
 
+from metrics import outcome_timer, SMTP_SEND_SECONDS
+# smtplib and email.mime are imported on first send (see providers.py).
+from providers import load_smtplib, load_mime
+
 # Configuration for Email Sending (MUST BE UPDATED FOR PRODUCTION)
 SMTP_SERVER = os.environ.get("SMTP_SERVER", "smtp.gmail.com")
 SMTP_PORT = int(os.environ.get("SMTP_PORT", 587))
@@ -16,7 +17,11 @@ SENDER_EMAIL = os.environ.get("MAIL_USERNAME", "glass418cloudy@gmail.com")
 _raw_password = os.environ.get("MAIL_PASSWORD", "") 
 SENDER_PASSWORD = _raw_password.replace(" ", "") # Safety strip
 
-FRONTEND_URL = os.environ.get("FRONTEND_URL", "http://localhost:5173")
+FRONTEND_URL = os.environ.get("FRONTEND_URL", "http://localhost:8080")
+
+# Set SMTP_STARTTLS=0 for a plain local SMTP stand-in (see bench/smtp_sink.py).
+SMTP_STARTTLS = os.environ.get("SMTP_STARTTLS", "1") == "1"
+SMTP_TIMEOUT = float(os.environ.get("SMTP_TIMEOUT", 20))
 
 # --- HTML Template Generation (omitted for brevity) ---
 def _create_reset_password_html_body(reset_link):
@@ -93,58 +98,123 @@ def _create_reset_password_html_body(reset_link):
     return html
 
 
-def send_reset_email(user_email):
-    """
-    Sends a password reset link to the user.
-    """
-    reset_token = str(uuid.uuid4())
-    print(f"DEBUG: Generated token {reset_token[:8]}... for {user_email}")
-    
-    reset_link = f"{FRONTEND_URL}/reset-password?token={reset_token}"
+def build_reset_email(reset_link):
+    """Returns (subject, plain_text_body, html_body) for a password reset link."""
     subject = "Action Required: Reset Your SilayLearn Password"
     html_body = _create_reset_password_html_body(reset_link)
-    
     plain_text_body = f"""
 Hello,
 You requested a password reset. Please click the link below:
 {reset_link}
 """
-    
-    return _send_email(user_email, subject, plain_text_body, html_body), reset_token
+    return subject, plain_text_body, html_body
 
 
-def _send_email(to_email, subject, plain_text_body, html_body):
-    """Internal function to send emails via SMTP, handling MIME Multipart."""
-    
-    # ⚠️ CHECK CONFIGURATION
+def build_message(to_email, subject, plain_text_body, html_body):
+    """Builds the multipart/alternative message sent for every email."""
+    MIMEText, MIMEMultipart = load_mime()
+    msg = MIMEMultipart('alternative')
+    msg['From'] = SENDER_EMAIL
+    msg['To'] = to_email
+    msg['Subject'] = subject
+
+    msg.attach(MIMEText(plain_text_body, 'plain'))
+    if html_body:
+        msg.attach(MIMEText(html_body, 'html'))
+    return msg
+
+
+def config_error():
+    """Returns an error string if the sender settings still hold placeholder values."""
     if SENDER_EMAIL == "your-email@gmail.com" or SENDER_PASSWORD == "your-app-password":
         print("!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!")
         print("!!! FATAL EMAIL CONFIG ERROR: SENDER_EMAIL or SENDER_PASSWORD uses default placeholder values. Update your .env or the default values in email_handler.py !!!")
         print("!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!")
-        return False, "Email configuration placeholders are still in use."
+        return "Email configuration placeholders are still in use."
+    return None
 
-    try:
-        # ✅ DEBUG PRINT: Attempting to send email with config details
-        print(f"DEBUG: Attempting to connect to SMTP server: {SMTP_SERVER}:{SMTP_PORT} (Sender: {SENDER_EMAIL})")
-        
-        msg = MIMEMultipart('alternative')
-        msg['From'] = SENDER_EMAIL
-        msg['To'] = to_email
-        msg['Subject'] = subject
 
-        msg.attach(MIMEText(plain_text_body, 'plain'))
-        msg.attach(MIMEText(html_body, 'html'))
+class SmtpSession:
+    """
+    A reusable, authenticated SMTP connection.
 
-        server = smtplib.SMTP(SMTP_SERVER, SMTP_PORT)
-        server.starttls()
-        
-        # ✅ DEBUG PRINT: Attempting login
-        print(f"DEBUG: Attempting SMTP login as {SENDER_EMAIL}...")
-        server.login(SENDER_EMAIL, SENDER_PASSWORD)
-        
-        text = msg.as_string()
-        server.sendmail(SENDER_EMAIL, to_email, text)
-        server.quit()
+    connect/STARTTLS/login happen once; send() reuses the connection and
+    reconnects once if the server dropped it in the meantime.
+    """
+
+    def __init__(self, host=None, port=None, starttls=None, timeout=None):
+        self.host = host or SMTP_SERVER
+        self.port = port or SMTP_PORT
+        self.starttls = SMTP_STARTTLS if starttls is None else starttls
+        self.timeout = timeout or SMTP_TIMEOUT
+        self.server = None
+        self.messages_sent = 0
+
+    def connect(self):
+        print(f"DEBUG: Attempting to connect to SMTP server: {self.host}:{self.port} (Sender: {SENDER_EMAIL})")
+        server = load_smtplib().SMTP(self.host, self.port, timeout=self.timeout)
+        try:
+            if self.starttls:
+                server.starttls()
+            if SENDER_PASSWORD:
+                print(f"DEBUG: Attempting SMTP login as {SENDER_EMAIL}...")
+                server.login(SENDER_EMAIL, SENDER_PASSWORD)
+        except Exception:
+            server.close()   # retried with bad credentials, this would leak a socket per attempt
+            raise
+        self.server = server
+        self.messages_sent = 0
+
+    def is_connected(self):
+        return self.server is not None
+
+    def send(self, msg):
+        """Sends one message; raises smtplib exceptions on failure."""
+        smtplib = load_smtplib()
+        with outcome_timer(SMTP_SEND_SECONDS):
+            if self.server is None:
+                self.connect()
+            try:
+                self.server.send_message(msg)
+            except smtplib.SMTPServerDisconnected:
+                self.close()
+                self.connect()
+                self.server.send_message(msg)
+        self.messages_sent += 1
+
+    def close(self):
+        if self.server is None:
+            return
+        try:
+            self.server.quit()
+        except Exception:
+            pass
+        self.server = None
+
+
+def send_reset_email(user_email):
+    """
+    Sends a password reset link to the user.
+    """
+    reset_token = str(uuid.uuid4())
+    print(f"DEBUG: Generated token {reset_token[:8]}... for {user_email}")
+    
+    reset_link = f"{FRONTEND_URL}/reset-password?token={reset_token}"
+    subject, plain_text_body, html_body = build_reset_email(reset_link)
+    
+    return _send_email(user_email, subject, plain_text_body, html_body), reset_token
+
+
+def _send_email(to_email, subject, plain_text_body, html_body):
+    """Internal function to send one email over a fresh SMTP connection."""
+    error = config_error()
+    if error:
+        return False, error
+
+    smtplib = load_smtplib()
+    session = SmtpSession()
+    try:
+        session.send(build_message(to_email, subject, plain_text_body, html_body))
         
         # ✅ DEBUG PRINT: Success message
         print(f"SUCCESS: HTML Email sent to {to_email}")
@@ -156,4 +226,6 @@ def _send_email(to_email, subject, plain_text_body, html_body):
     except Exception as e:
         # ✅ DEBUG PRINT: Failure message
         print(f"ERROR: Failed to send email to {to_email}. Exception: {e}")
-        return False, str(e)
\ No newline at end of file
+        return False, str(e)
+    finally:
+        session.close()
@@ -0,0 +1,89 @@
+# gemini_client.py
+import os
+import threading
+
+# requests and google.genai are imported on first use (see providers.py).
+from providers import load_genai, load_requests
+
+# --------------------------
+# Client configuration
+# --------------------------
+GEMINI_API_KEY = os.environ.get("GEMINI_API_KEY", "")
+GEMINI_MODEL = os.environ.get("GEMINI_MODEL", "gemini-2.5-flash")
+# Point this at a local stand-in (see bench/fake_gemini.py) to measure without the real API.
+GEMINI_API_BASE = os.environ.get("GEMINI_API_BASE", "https://generativelanguage.googleapis.com").rstrip("/")
+GEMINI_HTTP_POOL_SIZE = int(os.environ.get("GEMINI_HTTP_POOL_SIZE", 20))  # keep-alive sockets per worker
+
+_lock = threading.Lock()
+_sdk_client = None
+_http_session = None
+_owner_pid = None
+
+
+def _reset_after_fork():
+    """Drops clients inherited from the parent; their sockets belong to the parent process."""
+    global _sdk_client, _http_session, _owner_pid, _lock
+    _lock = threading.Lock()
+    _sdk_client = None
+    _http_session = None
+    _owner_pid = os.getpid()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def _check_pid():
+    # Belt and braces for servers that fork without running at-fork hooks.
+    if _owner_pid is not None and _owner_pid != os.getpid():
+        _reset_after_fork()
+
+
+def sdk_available():
+    """True when google-genai is installed (imports it on the first call)."""
+    return load_genai()[0] is not None
+
+
+def get_sdk_client():
+    """Returns the worker's shared genai.Client, creating it on first use."""
+    global _sdk_client, _owner_pid
+    genai, genai_types = load_genai()
+    if genai is None:
+        raise RuntimeError("google-genai SDK not installed")
+
+    _check_pid()
+    if _sdk_client is None:
+        with _lock:
+            if _sdk_client is None:
+                kwargs = {"api_key": GEMINI_API_KEY}
+                if GEMINI_API_BASE != "https://generativelanguage.googleapis.com":
+                    kwargs["http_options"] = genai_types.HttpOptions(base_url=GEMINI_API_BASE)
+                _sdk_client = genai.Client(**kwargs)
+                _owner_pid = os.getpid()
+    return _sdk_client
+
+
+def get_http_session():
+    """Returns the worker's shared keep-alive requests.Session for the REST endpoints."""
+    global _http_session, _owner_pid
+    _check_pid()
+    if _http_session is None:
+        with _lock:
+            if _http_session is None:
+                requests = load_requests()
+                session = requests.Session()
+                adapter = requests.adapters.HTTPAdapter(
+                    pool_connections=1,
+                    pool_maxsize=GEMINI_HTTP_POOL_SIZE,
+                    max_retries=0,
+                )
+                session.mount("https://", adapter)
+                session.mount("http://", adapter)
+                _http_session = session
+                _owner_pid = os.getpid()
+    return _http_session
+
+
+def rest_url(path):
+    """Builds a REST endpoint URL, e.g. rest_url("v1/models/gemini-2.5-flash:generateText")."""
+    return f"{GEMINI_API_BASE}/{path.lstrip('/')}"
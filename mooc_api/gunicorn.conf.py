@@ -0,0 +1,83 @@
+# gunicorn.conf.py
+"""
+Production serving for the Flask API:
+
+    pip install gunicorn gevent
+    gunicorn -c gunicorn.conf.py app:app
+
+Each worker process runs the app under gevent. Every request is a greenlet,
+and the Gemini, MySQL (pure-Python driver) and SMTP sockets yield while
+they wait. So one worker holds hundreds of in-flight chat turns, where
+`python app.py` held a handful of threads. GUNICORN_WORKER_CLASS=gthread
+switches to a plain thread pool, for example while debugging a library
+that does not cooperate with gevent.
+"""
+import os
+import multiprocessing
+
+# --------------------------
+# Server configuration
+# --------------------------
+bind = os.environ.get("GUNICORN_BIND", "0.0.0.0:5000")
+worker_class = os.environ.get("GUNICORN_WORKER_CLASS", "gevent")
+# Each worker opens its own MySQL pool; see the connection budget below before raising this.
+workers = int(os.environ.get("WEB_CONCURRENCY", multiprocessing.cpu_count()))
+worker_connections = int(os.environ.get("GUNICORN_WORKER_CONNECTIONS", 500))  # gevent: requests per worker
+threads = int(os.environ.get("GUNICORN_THREADS", 32))                         # gthread: threads per worker
+keepalive = int(os.environ.get("GUNICORN_KEEPALIVE", 5))
+
+# Must outlast the longest chat turn (GEMINI_DEADLINE) plus a streamed reply.
+timeout = int(os.environ.get("GUNICORN_TIMEOUT", 90))
+graceful_timeout = int(os.environ.get("GUNICORN_GRACEFUL_TIMEOUT", 30))
+
+# Load the app in each worker, not the master, so DB pools, SMTP sessions,
+# HTTP sessions and background threads are created after the fork.
+preload_app = False
+
+accesslog = os.environ.get("GUNICORN_ACCESS_LOG", "-")
+errorlog = "-"
+
+# --------------------------
+# App defaults for cooperative workers
+# --------------------------
+# The per-worker limits below are sized for threaded serving. Raise them with
+# the request concurrency, unless they are already set in the environment.
+if worker_class == "gevent":
+    os.environ.setdefault("DB_USE_PURE", "1")
+    os.environ.setdefault("AI_MAX_CONCURRENT", str(min(worker_connections, 200)))
+    os.environ.setdefault("AI_MAX_WAITING", str(worker_connections))
+    os.environ.setdefault("GEMINI_HTTP_POOL_SIZE", os.environ["AI_MAX_CONCURRENT"])
+    os.environ.setdefault("GEMINI_HEDGE_WORKERS", str(2 * int(os.environ["AI_MAX_CONCURRENT"])))
+else:
+    os.environ.setdefault("AI_MAX_CONCURRENT", str(max(1, threads // 2)))  # keep threads free for auth routes
+
+
+# --------------------------
+# MySQL connection budget
+# --------------------------
+# Every worker has its own pool (db_pool.py), so MySQL sees up to
+# workers * (DB_POOL_SIZE + DB_POOL_MAX_OVERFLOW) connections from the API.
+# DB_MAX_CONNECTIONS is the API's share of the server's max_connections
+# (151 by default on MariaDB); leave room for PHP, cron jobs and admin
+# sessions. Unless set, the pools are sized to split it evenly, a third kept
+# open and the rest as overflow.
+DB_MAX_CONNECTIONS = int(os.environ.get("DB_MAX_CONNECTIONS", 100))
+
+_per_worker = max(2, DB_MAX_CONNECTIONS // workers)
+os.environ.setdefault("DB_POOL_SIZE", str(max(1, _per_worker // 3)))
+os.environ.setdefault("DB_POOL_MAX_OVERFLOW", str(max(0, _per_worker - int(os.environ["DB_POOL_SIZE"]))))
+
+_db_ceiling = workers * (int(os.environ["DB_POOL_SIZE"]) + int(os.environ["DB_POOL_MAX_OVERFLOW"]))
+if _db_ceiling > DB_MAX_CONNECTIONS:
+    print(f"WARNING: {workers} workers may open {_db_ceiling} MySQL connections, "
+          f"more than DB_MAX_CONNECTIONS={DB_MAX_CONNECTIONS}; expect 'Too many connections' under load.")
+
+
+# --------------------------
+# Worker hooks
+# --------------------------
+def post_worker_init(worker):
+    # The app is imported by now; load what WARM_UP lists (providers.py) while
+    # the worker already accepts requests, instead of on the first request.
+    import providers
+    providers.warm_up_in_background()
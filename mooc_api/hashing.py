@@ -0,0 +1,171 @@
+# hashing.py
+"""
+bcrypt off the request path.
+
+Hashes run on a small pool of real threads (bcrypt releases the GIL, and under
+gevent this is gevent's native thread pool, so the hub keeps serving). At most
+HASH_QUEUE_MAX jobs may wait; beyond that callers get HashingBusy (503).
+
+The cost factor is BCRYPT_COST, the same variable and default (12) that
+config.php gives register.php and login.php. So every worker and the PHP
+side write, and upgrade to, one cost. To choose a value for a host, run
+this once and set the result in both environments:
+
+    python hashing.py calibrate
+
+It prints the highest cost whose hash takes no more than HASH_TARGET_MS,
+never below HASH_MIN_COST. Hashes are written with the `$2y$` prefix so
+PHP's password_verify accepts them.
+"""
+import os
+import sys
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import bcrypt
+
+# --------------------------
+# Hashing configuration
+# --------------------------
+HASH_WORKERS = int(os.environ.get("HASH_WORKERS", os.cpu_count() or 2))
+HASH_QUEUE_MAX = int(os.environ.get("HASH_QUEUE_MAX", 32))        # jobs waiting for a worker
+HASH_TARGET_MS = float(os.environ.get("HASH_TARGET_MS", 250))     # `calibrate` target per hash
+HASH_MIN_COST = int(os.environ.get("HASH_MIN_COST", 10))          # PHP's password_hash default
+HASH_MAX_COST = int(os.environ.get("HASH_MAX_COST", 14))
+BCRYPT_COST = int(os.environ.get("BCRYPT_COST", 12))              # keep in step with config.php
+
+
+class HashingBusy(Exception):
+    """Raised when the hashing queue is full."""
+
+
+def hash_cost(stored_hash):
+    """Cost factor of a modular-crypt bcrypt hash such as `$2y$10$...`, or 0 if unparsable."""
+    parts = stored_hash.split("$")
+    try:
+        return int(parts[2])
+    except (IndexError, ValueError):
+        return 0
+
+
+def calibrate(target_ms=HASH_TARGET_MS):
+    """Times one hash at HASH_MIN_COST and doubles from there (each cost step doubles the work)."""
+    start = time.perf_counter()
+    bcrypt.hashpw(b"calibration-password", bcrypt.gensalt(HASH_MIN_COST))
+    elapsed_ms = (time.perf_counter() - start) * 1000
+
+    cost = HASH_MIN_COST
+    while cost < HASH_MAX_COST and elapsed_ms * 2 <= target_ms:
+        cost += 1
+        elapsed_ms *= 2
+    return cost, elapsed_ms
+
+
+def _new_executor():
+    try:
+        from gevent import monkey
+        if monkey.is_module_patched("threading"):
+            from gevent.threadpool import ThreadPoolExecutor as NativeThreadPoolExecutor
+            return NativeThreadPoolExecutor(HASH_WORKERS)
+    except ImportError:
+        pass
+    return ThreadPoolExecutor(max_workers=HASH_WORKERS, thread_name_prefix="bcrypt")
+
+
+class PasswordHasher:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._executor = None
+        self._pid = None
+        self.cost = BCRYPT_COST
+
+        self.outstanding = 0
+        self.completed = 0
+        self.rejected = 0
+        self.rehashes = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+        self.run_total = 0.0
+
+    def _get_executor(self):
+        if self._executor is None or self._pid != os.getpid():
+            with self._lock:
+                if self._executor is None or self._pid != os.getpid():
+                    self._executor = _new_executor()
+                    self._pid = os.getpid()
+        return self._executor
+
+    def warm_up(self):
+        """Starts the pool and runs one hash at the configured cost, so the first request does not."""
+        self._get_executor().submit(bcrypt.hashpw, b"warm-up-password", bcrypt.gensalt(self.cost)).result()
+
+    def _run(self, fn, *args):
+        with self._lock:
+            if self.outstanding >= HASH_WORKERS + HASH_QUEUE_MAX:
+                self.rejected += 1
+                raise HashingBusy("Too many password operations in progress.")
+            self.outstanding += 1
+        submitted = time.monotonic()
+
+        def job():
+            started = time.monotonic()
+            result = fn(*args)
+            return result, started - submitted, time.monotonic() - started
+
+        try:
+            result, waited, ran = self._get_executor().submit(job).result()
+        finally:
+            with self._lock:
+                self.outstanding -= 1
+        with self._lock:
+            self.completed += 1
+            self.wait_total += waited
+            self.wait_max = max(self.wait_max, waited)
+            self.run_total += ran
+        return result
+
+    def hash_password(self, password):
+        cost = self.cost
+        hashed = self._run(bcrypt.hashpw, password.encode("utf-8"), bcrypt.gensalt(cost)).decode("utf-8")
+        return "$2y$" + hashed[4:] if hashed.startswith("$2b$") else hashed
+
+    def needs_rehash(self, stored_hash):
+        return hash_cost(stored_hash) < self.cost
+
+    def verify_password(self, password, stored_hash, rehash=True):
+        """
+        Returns (ok, new_hash). new_hash is a fresh hash at the current cost
+        when the password matched a weaker hash; the caller stores it.
+        """
+        ok = self._run(bcrypt.checkpw, password.encode("utf-8"), stored_hash.encode("utf-8"))
+        if ok and rehash and self.needs_rehash(stored_hash):
+            self.rehashes += 1
+            return True, self.hash_password(password)
+        return ok, None
+
+    def stats(self):
+        return {
+            "cost": self.cost,
+            "workers": HASH_WORKERS,
+            "queue_max": HASH_QUEUE_MAX,
+            "outstanding": self.outstanding,
+            "completed": self.completed,
+            "rejected": self.rejected,
+            "rehashes": self.rehashes,
+            "wait_avg_ms": round(1000 * self.wait_total / self.completed, 3) if self.completed else 0.0,
+            "wait_max_ms": round(1000 * self.wait_max, 3),
+            "run_avg_ms": round(1000 * self.run_total / self.completed, 3) if self.completed else 0.0,
+        }
+
+
+hasher = PasswordHasher()
+
+
+if __name__ == "__main__":
+    if sys.argv[1:] != ["calibrate"]:
+        print(__doc__)
+        sys.exit(1)
+    cost, ms = calibrate()
+    print(f"BCRYPT_COST={cost}  (~{ms:.0f} ms per hash on this host, target {HASH_TARGET_MS:.0f} ms; "
+          f"set it for both the Flask workers and PHP)")
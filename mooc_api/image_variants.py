@@ -0,0 +1,271 @@
+# image_variants.py
+"""
+Resized, re-encoded variants of the course thumbnails and instructor portraits.
+
+`python image_variants.py build` reads every image under IMAGE_SOURCE_DIRS
+(relative to MEDIA_ROOT). For each one it writes, at each of IMAGE_WIDTHS
+narrower than the original (plus the original width):
+- a WebP
+- a JPEG or PNG fallback
+
+The work runs on a process pool with one process per core. manifest.json
+in IMAGE_VARIANTS_DIR records each source's SHA-256 and its variants.
+Later builds only re-encode sources whose bytes (or the build settings)
+changed, and they delete variants nothing refers to any more. Pillow is
+needed for building only; serving reads the manifest.
+
+Variant file names carry the source hash. The catalog hands out URLs with
+`?v=<hash>`, and GET /api/images/<source>?w=<px>&v=<hash> answers with the
+smallest variant at least w wide (WebP when the browser accepts it).
+Because `v` pins the bytes, those responses are cached as immutable.
+
+    python image_variants.py build [--force]
+    python image_variants.py status
+"""
+import os
+import sys
+import json
+import time
+import hashlib
+import threading
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from media import MEDIA_ROOT
+
+# --------------------------
+# Image variant configuration
+# --------------------------
+IMAGE_SOURCE_DIRS = [d.strip().strip("/") for d in os.environ.get("IMAGE_SOURCE_DIRS", "courses,instructors").split(",") if d.strip()]
+IMAGE_VARIANTS_DIR = os.path.realpath(os.environ.get("IMAGE_VARIANTS_DIR", os.path.join(MEDIA_ROOT, "variants")))
+IMAGE_WIDTHS = sorted({int(w) for w in os.environ.get("IMAGE_WIDTHS", "160,320,640,960,1280").split(",") if w.strip()})
+IMAGE_WEBP_QUALITY = int(os.environ.get("IMAGE_WEBP_QUALITY", 80))
+IMAGE_JPEG_QUALITY = int(os.environ.get("IMAGE_JPEG_QUALITY", 82))
+IMAGE_BUILD_WORKERS = int(os.environ.get("IMAGE_BUILD_WORKERS", os.cpu_count() or 2))
+IMAGE_MAX_AGE = int(os.environ.get("IMAGE_MAX_AGE", 31536000))    # versioned URLs: one year, immutable
+IMAGE_URL_BASE = os.environ.get("IMAGE_URL_BASE", "http://127.0.0.1:5000/api/images/")
+
+SOURCE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".webp")
+MIMETYPES = {"webp": "image/webp", "jpeg": "image/jpeg", "png": "image/png"}
+MANIFEST_NAME = "manifest.json"
+_MANIFEST_CHECK_INTERVAL = 1.0   # seconds between stat() calls on the manifest
+
+
+def build_settings():
+    """Anything that changes the output bytes; a change rebuilds every source."""
+    return {"widths": IMAGE_WIDTHS, "webp_quality": IMAGE_WEBP_QUALITY, "jpeg_quality": IMAGE_JPEG_QUALITY}
+
+
+def manifest_path():
+    return os.path.join(IMAGE_VARIANTS_DIR, MANIFEST_NAME)
+
+
+def _sha256(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _sources():
+    """{relative source path: absolute path} for every image under IMAGE_SOURCE_DIRS."""
+    found = {}
+    for directory in IMAGE_SOURCE_DIRS:
+        root = os.path.join(MEDIA_ROOT, directory)
+        for dirpath, _, filenames in os.walk(root):
+            for name in filenames:
+                if name.lower().endswith(SOURCE_EXTENSIONS):
+                    path = os.path.join(dirpath, name)
+                    found[os.path.relpath(path, MEDIA_ROOT).replace(os.sep, "/")] = path
+    return found
+
+
+def _read_manifest():
+    try:
+        with open(manifest_path(), encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {"settings": None, "sources": {}}
+
+
+def _write_manifest(manifest):
+    os.makedirs(IMAGE_VARIANTS_DIR, exist_ok=True)
+    tmp = manifest_path() + f".{os.getpid()}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+    os.replace(tmp, manifest_path())   # readers never see a half-written manifest
+
+
+# --------------------------
+# Building (runs in the process pool)
+# --------------------------
+def _build_one(relative, path, digest, settings):
+    """Encodes every variant of one source. Returns its manifest entry."""
+    from PIL import Image, ImageOps
+
+    stem = os.path.splitext(relative)[0]
+    entry = {"sha256": digest, "variants": []}
+    with Image.open(path) as opened:
+        image = ImageOps.exif_transpose(opened)
+        image.load()
+    width, height = image.size
+    has_alpha = image.mode in ("RGBA", "LA") or (image.mode == "P" and "transparency" in image.info)
+    fallback = "png" if has_alpha else "jpeg"
+    entry.update(width=width, height=height)
+
+    for target in sorted({w for w in settings["widths"] if w < width} | {width}):
+        resized = image if target == width else image.resize(
+            (target, max(1, round(height * target / width))), Image.Resampling.LANCZOS)
+        for fmt in ("webp", fallback):
+            name = f"{stem}.{digest[:12]}.{target}.{'jpg' if fmt == 'jpeg' else fmt}"
+            out = os.path.join(IMAGE_VARIANTS_DIR, name)
+            os.makedirs(os.path.dirname(out), exist_ok=True)
+            if fmt == "webp":
+                resized.save(out, "WEBP", quality=settings["webp_quality"], method=6)
+            elif fmt == "jpeg":
+                resized.convert("RGB").save(out, "JPEG", quality=settings["jpeg_quality"],
+                                            optimize=True, progressive=True)
+            else:
+                resized.save(out, "PNG", optimize=True)
+            entry["variants"].append({"width": target, "format": fmt, "file": name, "bytes": os.path.getsize(out)})
+    return entry
+
+
+def build(force=False, workers=IMAGE_BUILD_WORKERS):
+    """Brings the variants in line with the sources. Returns (built, unchanged, removed_files)."""
+    try:
+        import PIL  # noqa: F401 (fail here, not in every pool process)
+    except ImportError:
+        raise SystemExit("Pillow is required to build image variants: pip install Pillow")
+
+    manifest = _read_manifest()
+    settings = build_settings()
+    if manifest.get("settings") != settings:
+        force = True
+    old_sources = manifest.get("sources", {})
+
+    sources = _sources()
+    entries, jobs = {}, []
+    for relative, path in sources.items():
+        digest = _sha256(path)
+        old = old_sources.get(relative)
+        if not force and old and old["sha256"] == digest and all(
+                os.path.exists(os.path.join(IMAGE_VARIANTS_DIR, v["file"])) for v in old["variants"]):
+            entries[relative] = old
+        else:
+            jobs.append((relative, path, digest))
+    unchanged, built = len(entries), 0
+
+    if jobs:
+        with ProcessPoolExecutor(max_workers=max(1, min(workers, len(jobs)))) as pool:
+            futures = {pool.submit(_build_one, relative, path, digest, settings): relative
+                       for relative, path, digest in jobs}
+            for future in as_completed(futures):
+                relative = futures[future]
+                try:
+                    entries[relative] = future.result()
+                    built += 1
+                except Exception as e:   # one unreadable image must not stop the rest
+                    print(f"ERROR: could not build variants of {relative}: {e}")
+                    if relative in old_sources:
+                        entries[relative] = old_sources[relative]   # keep serving the previous variants
+
+    _write_manifest({"settings": settings, "built_at": time.time(), "sources": entries})
+
+    keep = {v["file"] for entry in entries.values() for v in entry["variants"]}
+    removed = 0
+    for dirpath, _, filenames in os.walk(IMAGE_VARIANTS_DIR):
+        for name in filenames:
+            relative = os.path.relpath(os.path.join(dirpath, name), IMAGE_VARIANTS_DIR).replace(os.sep, "/")
+            if relative != MANIFEST_NAME and relative not in keep:
+                os.remove(os.path.join(dirpath, name))
+                removed += 1
+    return built, unchanged, removed
+
+
+# --------------------------
+# Serving
+# --------------------------
+class VariantIndex:
+    """The manifest as the web workers see it; reloaded when the file changes."""
+
+    def __init__(self):
+        self._sources = {}
+        self._mtime = None
+        self._checked = 0.0
+        self._lock = threading.Lock()
+        self.loads = 0
+        self.served = 0
+        self.misses = 0
+
+    def _current(self):
+        now = time.monotonic()
+        if now - self._checked >= _MANIFEST_CHECK_INTERVAL:
+            with self._lock:
+                if now - self._checked >= _MANIFEST_CHECK_INTERVAL:
+                    self._checked = now
+                    try:
+                        mtime = os.stat(manifest_path()).st_mtime_ns
+                    except OSError:
+                        mtime = None
+                    if mtime != self._mtime:
+                        self._sources = _read_manifest().get("sources", {}) if mtime else {}
+                        self._mtime = mtime
+                        self.loads += 1
+        return self._sources
+
+    def version(self):
+        """Changes whenever a build rewrites the manifest (the catalog folds it into its own version)."""
+        self._current()
+        return self._mtime
+
+    def url(self, relative):
+        """Versioned variant URL for a source path, or None if it has no variants."""
+        entry = self._current().get(relative) if relative else None
+        if entry is None:
+            return None
+        return f"{IMAGE_URL_BASE}{relative}?v={entry['sha256'][:12]}"
+
+    def pick(self, relative, width=None, accept_webp=False):
+        """(absolute path, variant, source sha256) best matching `width`, or None."""
+        entry = self._current().get(relative)
+        if entry is None:
+            self.misses += 1
+            return None
+        formats = {v["format"] for v in entry["variants"]}
+        fmt = "webp" if accept_webp and "webp" in formats else next(f for f in ("jpeg", "png", "webp") if f in formats)
+        candidates = sorted((v for v in entry["variants"] if v["format"] == fmt), key=lambda v: v["width"])
+        if width:
+            variant = next((v for v in candidates if v["width"] >= width), candidates[-1])
+        else:
+            variant = candidates[-1]
+        self.served += 1
+        return os.path.join(IMAGE_VARIANTS_DIR, variant["file"]), variant, entry["sha256"]
+
+    def stats(self):
+        sources = self._current()
+        return {
+            "sources": len(sources),
+            "variants": sum(len(entry["variants"]) for entry in sources.values()),
+            "variant_bytes": sum(v["bytes"] for entry in sources.values() for v in entry["variants"]),
+            "manifest_loads": self.loads,
+            "served": self.served,
+            "misses": self.misses,
+        }
+
+
+variants = VariantIndex()
+
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    if args[:1] == ["build"] and set(args[1:]) <= {"--force"}:
+        start = time.perf_counter()
+        built, unchanged, removed = build(force="--force" in args)
+        print(f"Built {built} sources, {unchanged} unchanged, removed {removed} stale files "
+              f"in {time.perf_counter() - start:.1f}s ({IMAGE_VARIANTS_DIR}).")
+    elif args == ["status"]:
+        print(json.dumps(variants.stats(), indent=2))
+    else:
+        print(__doc__)
+        sys.exit(1)
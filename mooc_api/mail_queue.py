@@ -0,0 +1,237 @@
+# mail_queue.py
+"""
+Durable outbound email queue.
+
+Routes call enqueue() with their own cursor, so the email row commits in the
+same transaction as the data it refers to. A MailDispatcher thread in each
+worker claims due rows from `mail_outbox`, sends them over one long-lived
+SMTP connection and retries failures with exponential backoff. It can also
+run as its own process:
+
+    python mail_queue.py
+"""
+import os
+import time
+import uuid
+import socket
+import threading
+
+import mysql.connector
+
+from db_pool import get_db, PoolTimeoutError
+from email_handler import SmtpSession, build_message, config_error
+from providers import load_smtplib
+
+# --------------------------
+# Dispatcher configuration
+# --------------------------
+MAIL_DISPATCHER_ENABLED = os.environ.get("MAIL_DISPATCHER_ENABLED", "1") == "1"  # 0: only enqueue in this process
+MAIL_POLL_INTERVAL = float(os.environ.get("MAIL_POLL_INTERVAL", 5))       # seconds between idle polls
+MAIL_BATCH_SIZE = int(os.environ.get("MAIL_BATCH_SIZE", 20))              # rows claimed per round
+MAIL_MAX_ATTEMPTS = int(os.environ.get("MAIL_MAX_ATTEMPTS", 6))
+MAIL_RETRY_BASE = float(os.environ.get("MAIL_RETRY_BASE", 30))            # first retry delay, doubles per attempt
+MAIL_RETRY_MAX = float(os.environ.get("MAIL_RETRY_MAX", 3600))
+MAIL_CLAIM_TIMEOUT = int(os.environ.get("MAIL_CLAIM_TIMEOUT", 300))       # reclaim rows stuck in 'sending'
+MAIL_SMTP_IDLE_CLOSE = float(os.environ.get("MAIL_SMTP_IDLE_CLOSE", 60))  # close an unused SMTP connection
+
+
+def enqueue(cursor, to_email, subject, plain_text_body, html_body=None):
+    """
+    Adds an email to the outbox using the caller's cursor/transaction and
+    returns its job id. The caller commits; call dispatcher.wake() afterwards.
+    """
+    job_id = str(uuid.uuid4())
+    cursor.execute(
+        "INSERT INTO mail_outbox (job_id, to_email, subject, body_text, body_html) "
+        "VALUES (%s, %s, %s, %s, %s)",
+        (job_id, to_email, subject, plain_text_body, html_body)
+    )
+    return job_id
+
+
+def status(job_id):
+    """Current delivery state of a job, or None if unknown. Never waits on SMTP."""
+    with get_db() as db:
+        cursor = db.cursor(dictionary=True)
+        cursor.execute(
+            "SELECT status, attempts, next_attempt_at, sent_at, last_error FROM mail_outbox WHERE job_id=%s",
+            (job_id,)
+        )
+        row = cursor.fetchone()
+        cursor.close()
+
+    if row is None:
+        return None
+    for key in ("next_attempt_at", "sent_at"):
+        if hasattr(row[key], "isoformat"):
+            row[key] = row[key].isoformat()
+    return row
+
+
+def retry_delay(attempts):
+    """Seconds to wait before the next attempt after `attempts` failures."""
+    return min(MAIL_RETRY_MAX, MAIL_RETRY_BASE * (2 ** max(0, attempts - 1)))
+
+
+class MailDispatcher:
+    def __init__(self):
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+        self._pid = None
+        self._lock = threading.Lock()
+        self._session = SmtpSession()
+        self._last_send = 0.0
+
+        self.sent = 0
+        self.retried = 0
+        self.failed = 0
+        self.connections_opened = 0
+
+    # ---- lifecycle ----
+    def ensure_started(self):
+        """Starts the worker thread in this process if it is not running yet."""
+        if not MAIL_DISPATCHER_ENABLED:
+            return
+        with self._lock:
+            if self._thread is not None and self._pid == os.getpid() and self._thread.is_alive():
+                return
+            # A forked child inherits neither the thread nor a usable SMTP socket.
+            self._session = SmtpSession()
+            self._pid = os.getpid()
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="mail-dispatcher", daemon=True)
+            self._thread.start()
+
+    def wake(self):
+        self.ensure_started()
+        self._wake.set()
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout=10)
+        self._session.close()
+
+    # ---- work loop ----
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                handled = self.process_batch()
+            except (mysql.connector.Error, PoolTimeoutError) as err:
+                print(f"ERROR: mail dispatcher could not read the outbox: {err}")
+                handled = 0
+
+            if handled:
+                continue   # there may be more due rows
+            if self._session.is_connected() and time.monotonic() - self._last_send > MAIL_SMTP_IDLE_CLOSE:
+                self._session.close()
+            self._wake.wait(MAIL_POLL_INTERVAL)
+            self._wake.clear()
+        self._session.close()
+
+    def _claim(self):
+        claim_id = f"{socket.gethostname()[:40]}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        with get_db() as db:
+            cursor = db.cursor(dictionary=True)
+            try:
+                cursor.execute(
+                    "UPDATE mail_outbox SET status='sending', claimed_by=%s, claimed_at=NOW(), attempts=attempts+1 "
+                    "WHERE (status='queued' AND next_attempt_at <= NOW()) "
+                    "   OR (status='sending' AND claimed_at < NOW() - INTERVAL %s SECOND) "
+                    "ORDER BY id LIMIT %s",
+                    (claim_id, MAIL_CLAIM_TIMEOUT, MAIL_BATCH_SIZE)
+                )
+                db.commit()
+                if cursor.rowcount == 0:
+                    return []
+                cursor.execute(
+                    "SELECT id, job_id, to_email, subject, body_text, body_html, attempts "
+                    "FROM mail_outbox WHERE claimed_by=%s AND status='sending' ORDER BY id",
+                    (claim_id,)
+                )
+                return cursor.fetchall()
+            finally:
+                cursor.close()
+
+    def _finish(self, row, error=None):
+        with get_db() as db:
+            cursor = db.cursor()
+            try:
+                if error is None:
+                    cursor.execute(
+                        "UPDATE mail_outbox SET status='sent', sent_at=NOW(), last_error=NULL WHERE id=%s",
+                        (row["id"],)
+                    )
+                elif row["attempts"] >= MAIL_MAX_ATTEMPTS:
+                    cursor.execute(
+                        "UPDATE mail_outbox SET status='failed', last_error=%s WHERE id=%s",
+                        (error[:500], row["id"])
+                    )
+                else:
+                    cursor.execute(
+                        "UPDATE mail_outbox SET status='queued', last_error=%s, "
+                        "next_attempt_at = NOW() + INTERVAL %s SECOND WHERE id=%s",
+                        (error[:500], int(retry_delay(row["attempts"])), row["id"])
+                    )
+                db.commit()
+            finally:
+                cursor.close()
+
+    def process_batch(self):
+        """Claims and sends one batch of due emails. Returns how many rows were handled."""
+        rows = self._claim()
+        for row in rows:
+            error = config_error()
+            if error is None:
+                smtplib = load_smtplib()
+                try:
+                    if not self._session.is_connected():
+                        self.connections_opened += 1
+                    self._session.send(build_message(row["to_email"], row["subject"],
+                                                     row["body_text"], row["body_html"]))
+                    self._last_send = time.monotonic()
+                    print(f"SUCCESS: queued email {row['job_id'][:8]} sent to {row['to_email']}")
+                except smtplib.SMTPAuthenticationError:
+                    error = "SMTP authentication failed. Check MAIL_USERNAME / MAIL_PASSWORD."
+                    self._session.close()
+                except (smtplib.SMTPException, OSError) as e:
+                    error = f"{type(e).__name__}: {e}"
+                    self._session.close()
+
+            if error is None:
+                self.sent += 1
+            elif row["attempts"] >= MAIL_MAX_ATTEMPTS:
+                self.failed += 1
+                print(f"ERROR: giving up on email {row['job_id'][:8]} after {row['attempts']} attempts: {error}")
+            else:
+                self.retried += 1
+                print(f"WARNING: email {row['job_id'][:8]} failed (attempt {row['attempts']}), will retry: {error}")
+            self._finish(row, error)
+        return len(rows)
+
+    def stats(self):
+        return {
+            "running": self._thread is not None and self._thread.is_alive() and self._pid == os.getpid(),
+            "smtp_connected": self._session.is_connected(),
+            "smtp_connections_opened": self.connections_opened,
+            "sent": self.sent,
+            "retried": self.retried,
+            "failed": self.failed,
+        }
+
+
+dispatcher = MailDispatcher()
+
+
+if __name__ == "__main__":
+    # Standalone dispatcher process (set MAIL_DISPATCHER_ENABLED=0 for the web workers).
+    print("Mail dispatcher running. Ctrl+C to stop.")
+    MAIL_DISPATCHER_ENABLED = True
+    dispatcher.ensure_started()
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        dispatcher.stop()
@@ -0,0 +1,169 @@
+# media.py
+"""
+Lesson media files, resolved by lesson_id.
+
+ref_course_lessons.lesson_directory holds a path under the assets root
+(MEDIA_ROOT, the same mooc_assets/ tree the PHP host serves). Each worker
+keeps an index of lesson_id -> (path, size, mtime, ETag, MIME type). It is
+rebuilt only when the course catalog's version moves, so a media request
+does no query and no path resolution. The open file is fstat()ed anyway,
+so a file replaced on disk gets a fresh entry without waiting for a rebuild.
+
+The route in app.py serves the file with conditional and Range support.
+Each request reads through its own file descriptor, so any number of
+partial reads of one file can run concurrently.
+"""
+import os
+import time
+import threading
+import mimetypes
+from collections import namedtuple
+
+from db_pool import get_db
+from catalog import catalog
+
+# --------------------------
+# Media configuration
+# --------------------------
+MEDIA_ROOT = os.path.realpath(os.environ.get(
+    "MEDIA_ROOT", os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "mooc_assets")))
+MEDIA_MAX_AGE = int(os.environ.get("MEDIA_MAX_AGE", 86400))          # seconds browsers reuse a file unasked
+MEDIA_BLOCK_SIZE = int(os.environ.get("MEDIA_BLOCK_SIZE", 256 * 1024))  # read size when the server cannot sendfile
+
+MediaFile = namedtuple("MediaFile", ["lesson_id", "path", "size", "mtime", "etag", "mimetype"])
+
+
+class BoundedFile:
+    """
+    An open file whose reads stop at `end` (exclusive), for serving one byte range.
+    fileno(), seek() and tell() reach the real file, so a server can still
+    sendfile() from it; one that reads instead gets no more than the range.
+    """
+
+    def __init__(self, f, end):
+        self._f = f
+        self._end = end
+
+    def read(self, size=-1):
+        left = self._end - self._f.tell()
+        if left <= 0:
+            return b""
+        return self._f.read(left if size is None or size < 0 else min(size, left))
+
+    def fileno(self):
+        return self._f.fileno()
+
+    def seek(self, *args):
+        return self._f.seek(*args)
+
+    def tell(self):
+        return self._f.tell()
+
+    def close(self):
+        self._f.close()
+
+
+def _resolve(relative_path):
+    """Absolute path of an asset, or None if it is empty or escapes MEDIA_ROOT."""
+    if not relative_path:
+        return None
+    path = os.path.realpath(os.path.join(MEDIA_ROOT, relative_path.lstrip("/\\")))
+    if os.path.commonpath([path, MEDIA_ROOT]) != MEDIA_ROOT:
+        return None
+    return path
+
+
+def _etag(st):
+    # Size plus nanosecond mtime: changes whenever the file's bytes are replaced.
+    return f"{st.st_size:x}-{st.st_mtime_ns:x}"
+
+
+def _entry(lesson_id, path, st):
+    mimetype = mimetypes.guess_type(path)[0] or "application/octet-stream"
+    return MediaFile(lesson_id, path, st.st_size, int(st.st_mtime), _etag(st), mimetype)
+
+
+class MediaIndex:
+    def __init__(self):
+        self._files = {}
+        self._version = None
+        self._lock = threading.Lock()
+
+        self.builds = 0
+        self.build_ms = 0.0
+        self.missing = 0
+        self.served = 0
+        self.stale = 0
+
+    def refresh(self, version=None):
+        """Re-reads lesson paths and stats every file."""
+        start = time.perf_counter()
+        with get_db() as db:
+            cursor = db.cursor()
+            try:
+                cursor.execute("SELECT lesson_id, lesson_directory FROM ref_course_lessons")
+                rows = cursor.fetchall()
+            finally:
+                cursor.close()
+            db.commit()
+
+        files, missing = {}, 0
+        for lesson_id, relative_path in rows:
+            path = _resolve(relative_path)
+            try:
+                st = os.stat(path) if path else None
+            except OSError:
+                st = None
+            if st is None or not os.path.isfile(path):
+                missing += 1
+                continue
+            files[lesson_id] = _entry(lesson_id, path, st)
+
+        self._files = files
+        self._version = version
+        self.missing = missing
+        self.builds += 1
+        self.build_ms = (time.perf_counter() - start) * 1000
+
+    def lookup(self, lesson_id):
+        """The index entry for a lesson, or None. Rebuilds first if the catalog changed."""
+        version = catalog.snapshot().version
+        if version != self._version:
+            with self._lock:
+                if version != self._version:
+                    self.refresh(version)
+        return self._files.get(lesson_id)
+
+    def open(self, lesson_id):
+        """(open binary file, MediaFile) for a lesson, or None if it has no file."""
+        entry = self.lookup(lesson_id)
+        if entry is None:
+            return None
+        try:
+            f = open(entry.path, "rb")
+        except OSError:
+            return None
+        st = os.fstat(f.fileno())
+        if _etag(st) != entry.etag:
+            # Replaced on disk since the last build: describe the file actually opened.
+            entry = _entry(lesson_id, entry.path, st)
+            self._files = {**self._files, lesson_id: entry}
+            self.stale += 1
+        self.served += 1
+        return f, entry
+
+    def stats(self):
+        return {
+            "root": MEDIA_ROOT,
+            "catalog_version": self._version,
+            "files": len(self._files),
+            "bytes": sum(entry.size for entry in self._files.values()),
+            "missing_files": self.missing,
+            "builds": self.builds,
+            "last_build_ms": round(self.build_ms, 3),
+            "served": self.served,
+            "stale_entries": self.stale,
+        }
+
+
+media_index = MediaIndex()
@@ -0,0 +1,202 @@
+# metrics.py
+"""
+In-process metrics with Prometheus text output (GET /metrics).
+
+Histograms and counters are kept per worker process. One observation costs a
+perf_counter() pair, a bisect and a short lock. Gauges are callbacks read at
+scrape time, so the existing stats() dicts (DB pool, AI guard, ...) are
+exported without touching the hot path. Under several gunicorn workers each
+scrape sees one worker; scrape them individually or sum by `pid`.
+
+    with metrics.db_timer("chat_insert"):
+        cursor.execute(...)
+"""
+import os
+import time
+import bisect
+import threading
+from contextlib import contextmanager
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+TOKEN_BUCKETS = (64, 128, 256, 512, 768, 1024, 1536, 2048, 4096, 8192)
+
+
+def _format_labels(names, values, extra=None):
+    pairs = list(zip(names, values))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ""
+    escaped = (str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, v in pairs)
+    return "{" + ",".join(f'{k}="{v}"' for (k, _), v in zip(pairs, escaped)) + "}"
+
+
+def _format_value(value):
+    return repr(float(value)) if not isinstance(value, int) else str(value)
+
+
+class Counter:
+    def __init__(self, name, help_text, label_names=()):
+        self.name = name
+        self.help = help_text
+        self.label_names = tuple(label_names)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labels, amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            items = sorted(self._values.items())
+        for labels, value in items:
+            lines.append(f"{self.name}{_format_labels(self.label_names, labels)} {_format_value(value)}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, help_text, label_names=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.label_names = tuple(label_names)
+        self.buckets = tuple(buckets)
+        self._series = {}   # labels -> [bucket counts..., +Inf count, sum]
+        self._lock = threading.Lock()
+
+    def observe(self, seconds, *labels):
+        index = bisect.bisect_left(self.buckets, seconds)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+            series[index] += 1
+            series[-1] += seconds
+
+    @contextmanager
+    def time(self, *labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, *labels)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            items = sorted((labels, list(series)) for labels, series in self._series.items())
+        for labels, series in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), series):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                lines.append(f"{self.name}_bucket{_format_labels(self.label_names, labels, ('le', le))} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.label_names, labels)} {series[-1]!r}")
+            lines.append(f"{self.name}_count{_format_labels(self.label_names, labels)} {cumulative}")
+        return lines
+
+
+class GaugeCallback:
+    """A gauge whose samples come from fn() -> {label_tuple: value} at scrape time."""
+
+    def __init__(self, name, help_text, label_names, fn):
+        self.name = name
+        self.help = help_text
+        self.label_names = tuple(label_names)
+        self.fn = fn
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} gauge"]
+        try:
+            samples = self.fn()
+        except Exception as e:
+            print(f"ERROR: metrics callback {self.name} failed: {e}")
+            return lines
+        for labels, value in sorted(samples.items()):
+            if isinstance(value, (int, float)) and not isinstance(value, bool):
+                lines.append(f"{self.name}{_format_labels(self.label_names, labels)} {_format_value(value)}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        with self._lock:
+            self._metrics.append(metric)
+        return metric
+
+    def counter(self, name, help_text, label_names=()):
+        return self.register(Counter(name, help_text, label_names))
+
+    def histogram(self, name, help_text, label_names=(), buckets=DEFAULT_BUCKETS):
+        return self.register(Histogram(name, help_text, label_names, buckets))
+
+    def gauge_callback(self, name, help_text, label_names, fn):
+        return self.register(GaugeCallback(name, help_text, label_names, fn))
+
+    def stats_gauge(self, name, help_text, stats_fn):
+        """Exports every numeric field of a stats() dict as name{field="..."}."""
+        return self.gauge_callback(name, help_text, ("field",),
+                                   lambda: {(k,): v for k, v in stats_fn().items()})
+
+    def render(self):
+        with self._lock:
+            metrics = list(self._metrics)
+        lines = [
+            "# HELP mooc_api_process_info Worker that produced this scrape.",
+            "# TYPE mooc_api_process_info gauge",
+            f'mooc_api_process_info{{pid="{os.getpid()}"}} 1',
+        ]
+        for metric in metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+# --------------------------
+# Shared metric families
+# --------------------------
+HTTP_REQUEST_SECONDS = registry.histogram(
+    "http_request_duration_seconds",
+    "Flask request latency until the response is returned (time to first byte for streams).",
+    ("route", "method", "status"),
+)
+DB_STATEMENT_SECONDS = registry.histogram(
+    "db_statement_duration_seconds", "MySQL statement latency by statement family.", ("family",),
+)
+AI_CALL_SECONDS = registry.histogram(
+    "ai_call_duration_seconds", "Gemini call latency by backend and outcome.", ("backend", "outcome"),
+)
+PROMPT_TOKENS = registry.histogram(
+    "prompt_tokens", "Gemini input tokens per call: estimated when built, input and cached as billed.", ("kind",),
+    buckets=TOKEN_BUCKETS,
+)
+SMTP_SEND_SECONDS = registry.histogram(
+    "smtp_send_duration_seconds", "SMTP send latency by outcome (includes reconnects).", ("outcome",),
+)
+
+
+def db_timer(family):
+    """Times one DB statement family, e.g. "chat_insert", "summary_read", "history_read", "token_lookup"."""
+    return DB_STATEMENT_SECONDS.time(family)
+
+
+@contextmanager
+def outcome_timer(histogram, *labels):
+    """Times a call and records it with an extra trailing "ok"/"error" label."""
+    start = time.perf_counter()
+    outcome = "error"
+    try:
+        yield
+        outcome = "ok"
+    finally:
+        histogram.observe(time.perf_counter() - start, *labels, outcome)
+
+
+def render():
+    return registry.render()
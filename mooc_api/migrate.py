@@ -0,0 +1,83 @@
+# migrate.py
+"""
+Applies the SQL files in migrations/ in filename order, once each.
+
+    python migrate.py            # apply pending migrations
+    python migrate.py --status   # list applied / pending files
+
+Applied files are recorded in the `schema_migrations` table. Files may hold
+several statements separated by `;` at the end of a line.
+"""
+import os
+import sys
+
+import mysql.connector
+
+from db_pool import get_db
+
+MIGRATIONS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "migrations")
+
+
+def _statements(sql):
+    statement = []
+    for line in sql.splitlines():
+        stripped = line.strip()
+        if not stripped or stripped.startswith("--"):
+            continue
+        statement.append(line)
+        if stripped.endswith(";"):
+            yield "\n".join(statement).rstrip().rstrip(";")
+            statement = []
+    if statement:
+        yield "\n".join(statement)
+
+
+def _migration_files():
+    return sorted(f for f in os.listdir(MIGRATIONS_DIR) if f.endswith(".sql"))
+
+
+def _applied(cursor):
+    cursor.execute(
+        "CREATE TABLE IF NOT EXISTS `schema_migrations` ("
+        " `filename` varchar(255) NOT NULL PRIMARY KEY,"
+        " `applied_at` timestamp NOT NULL DEFAULT current_timestamp()"
+        ") ENGINE=InnoDB DEFAULT CHARSET=utf8mb4"
+    )
+    cursor.execute("SELECT filename FROM schema_migrations")
+    return {row[0] for row in cursor.fetchall()}
+
+
+def migrate(status_only=False):
+    with get_db() as db:
+        cursor = db.cursor()
+        try:
+            applied = _applied(cursor)
+            for filename in _migration_files():
+                if filename in applied:
+                    print(f"  applied  {filename}")
+                    continue
+                if status_only:
+                    print(f"  pending  {filename}")
+                    continue
+
+                print(f"  applying {filename} ...")
+                with open(os.path.join(MIGRATIONS_DIR, filename), encoding="utf-8") as f:
+                    sql = f.read()
+                # MySQL commits DDL implicitly, so each file should be safe to re-run
+                # (IF NOT EXISTS etc.) in case it fails half-way.
+                for statement in _statements(sql):
+                    cursor.execute(statement)
+                    if cursor.with_rows:
+                        cursor.fetchall()
+                cursor.execute("INSERT INTO schema_migrations (filename) VALUES (%s)", (filename,))
+                db.commit()
+        except mysql.connector.Error as err:
+            print(f"ERROR: migration failed: {err.msg}")
+            return 1
+        finally:
+            cursor.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(migrate(status_only="--status" in sys.argv))
@@ -0,0 +1,25 @@
+-- 001_mail_outbox.sql
+-- Durable queue for outbound email. Rows are written in the same transaction
+-- as the data they announce (e.g. a password reset token) and delivered by
+-- the background dispatcher in mail_queue.py.
+
+CREATE TABLE IF NOT EXISTS `mail_outbox` (
+  `id` bigint(20) UNSIGNED NOT NULL AUTO_INCREMENT,
+  `job_id` char(36) NOT NULL,
+  `to_email` varchar(150) NOT NULL,
+  `subject` varchar(255) NOT NULL,
+  `body_text` mediumtext NOT NULL,
+  `body_html` mediumtext DEFAULT NULL,
+  `status` enum('queued','sending','sent','failed') NOT NULL DEFAULT 'queued',
+  `attempts` int(11) NOT NULL DEFAULT 0,
+  `next_attempt_at` datetime NOT NULL DEFAULT current_timestamp(),
+  `claimed_by` varchar(64) DEFAULT NULL,
+  `claimed_at` datetime DEFAULT NULL,
+  `last_error` varchar(500) DEFAULT NULL,
+  `created_at` timestamp NOT NULL DEFAULT current_timestamp(),
+  `sent_at` datetime DEFAULT NULL,
+  PRIMARY KEY (`id`),
+  UNIQUE KEY `job_id` (`job_id`),
+  KEY `status_next_attempt` (`status`, `next_attempt_at`),
+  KEY `claimed_by` (`claimed_by`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_general_ci;
@@ -0,0 +1,31 @@
+-- 002_mail_campaigns.sql
+-- Bulk course announcements (bulk_mailer.py). `last_user_id` is the resume
+-- cursor: recipients are streamed in users.id order and the cursor advances
+-- after each chunk, so an interrupted campaign continues where it stopped.
+
+CREATE TABLE IF NOT EXISTS `mail_campaigns` (
+  `id` int(11) NOT NULL AUTO_INCREMENT,
+  `course_id` int(11) NOT NULL,
+  `subject` varchar(255) NOT NULL,
+  `body_text` mediumtext NOT NULL,
+  `body_html` mediumtext DEFAULT NULL,
+  `status` enum('pending','running','completed','failed') NOT NULL DEFAULT 'pending',
+  `last_user_id` int(11) NOT NULL DEFAULT 0,
+  `total_sent` int(11) NOT NULL DEFAULT 0,
+  `total_failed` int(11) NOT NULL DEFAULT 0,
+  `last_error` varchar(500) DEFAULT NULL,
+  `created_at` timestamp NOT NULL DEFAULT current_timestamp(),
+  `updated_at` timestamp NOT NULL DEFAULT current_timestamp() ON UPDATE current_timestamp(),
+  `finished_at` datetime DEFAULT NULL,
+  PRIMARY KEY (`id`),
+  KEY `course_id` (`course_id`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_general_ci;
+
+CREATE TABLE IF NOT EXISTS `mail_campaign_failures` (
+  `campaign_id` int(11) NOT NULL,
+  `user_id` int(11) NOT NULL,
+  `email` varchar(150) NOT NULL,
+  `error` varchar(500) NOT NULL,
+  `created_at` timestamp NOT NULL DEFAULT current_timestamp(),
+  PRIMARY KEY (`campaign_id`, `user_id`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_general_ci;
@@ -0,0 +1,5 @@
+-- 003_reset_token_expiry_index.sql
+-- Lets the purge job in reset_tokens.py delete expired rows by an index
+-- range instead of scanning the whole table.
+
+CREATE INDEX IF NOT EXISTS `expires_at` ON `password_reset_tokens` (`expires_at`);
@@ -0,0 +1,28 @@
+-- 004_catalog_version.sql
+-- A single counter bumped by triggers whenever a catalog table changes.
+-- catalog.py polls it and rebuilds its in-memory course snapshot only when
+-- the number moves (ref_courses and ref_instructors have no updated_at).
+
+CREATE TABLE IF NOT EXISTS `catalog_version` (
+  `id` tinyint(3) UNSIGNED NOT NULL,
+  `version` bigint(20) UNSIGNED NOT NULL DEFAULT 0,
+  PRIMARY KEY (`id`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_general_ci;
+
+INSERT IGNORE INTO `catalog_version` (`id`, `version`) VALUES (1, 0);
+
+CREATE TRIGGER IF NOT EXISTS `ref_courses_ai_catalog` AFTER INSERT ON `ref_courses` FOR EACH ROW UPDATE `catalog_version` SET `version` = `version` + 1 WHERE `id` = 1;
+CREATE TRIGGER IF NOT EXISTS `ref_courses_au_catalog` AFTER UPDATE ON `ref_courses` FOR EACH ROW UPDATE `catalog_version` SET `version` = `version` + 1 WHERE `id` = 1;
+CREATE TRIGGER IF NOT EXISTS `ref_courses_ad_catalog` AFTER DELETE ON `ref_courses` FOR EACH ROW UPDATE `catalog_version` SET `version` = `version` + 1 WHERE `id` = 1;
+
+CREATE TRIGGER IF NOT EXISTS `ref_instructors_ai_catalog` AFTER INSERT ON `ref_instructors` FOR EACH ROW UPDATE `catalog_version` SET `version` = `version` + 1 WHERE `id` = 1;
+CREATE TRIGGER IF NOT EXISTS `ref_instructors_au_catalog` AFTER UPDATE ON `ref_instructors` FOR EACH ROW UPDATE `catalog_version` SET `version` = `version` + 1 WHERE `id` = 1;
+CREATE TRIGGER IF NOT EXISTS `ref_instructors_ad_catalog` AFTER DELETE ON `ref_instructors` FOR EACH ROW UPDATE `catalog_version` SET `version` = `version` + 1 WHERE `id` = 1;
+
+CREATE TRIGGER IF NOT EXISTS `ref_course_content_ai_catalog` AFTER INSERT ON `ref_course_content` FOR EACH ROW UPDATE `catalog_version` SET `version` = `version` + 1 WHERE `id` = 1;
+CREATE TRIGGER IF NOT EXISTS `ref_course_content_au_catalog` AFTER UPDATE ON `ref_course_content` FOR EACH ROW UPDATE `catalog_version` SET `version` = `version` + 1 WHERE `id` = 1;
+CREATE TRIGGER IF NOT EXISTS `ref_course_content_ad_catalog` AFTER DELETE ON `ref_course_content` FOR EACH ROW UPDATE `catalog_version` SET `version` = `version` + 1 WHERE `id` = 1;
+
+CREATE TRIGGER IF NOT EXISTS `ref_course_lessons_ai_catalog` AFTER INSERT ON `ref_course_lessons` FOR EACH ROW UPDATE `catalog_version` SET `version` = `version` + 1 WHERE `id` = 1;
+CREATE TRIGGER IF NOT EXISTS `ref_course_lessons_au_catalog` AFTER UPDATE ON `ref_course_lessons` FOR EACH ROW UPDATE `catalog_version` SET `version` = `version` + 1 WHERE `id` = 1;
+CREATE TRIGGER IF NOT EXISTS `ref_course_lessons_ad_catalog` AFTER DELETE ON `ref_course_lessons` FOR EACH ROW UPDATE `catalog_version` SET `version` = `version` + 1 WHERE `id` = 1;
@@ -0,0 +1,9 @@
+-- 005_chat_history_user_id_index.sql
+-- The summary query (WHERE user_id ORDER BY id DESC LIMIT n), history paging
+-- and the archive job all walk one user's rows in id order. A (user_id, id)
+-- index serves them as a range read in order; the old single-column key is
+-- then redundant, and the foreign key can use the new index instead.
+
+CREATE INDEX IF NOT EXISTS `user_id_id` ON `chat_history` (`user_id`, `id`);
+
+DROP INDEX IF EXISTS `user_id` ON `chat_history`;
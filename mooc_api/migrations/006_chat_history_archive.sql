@@ -0,0 +1,19 @@
+-- 006_chat_history_archive.sql
+-- Cold tier for chat_history. chat_archive.py moves old turns here in
+-- per-user chunks: each row holds up to CHAT_ARCHIVE_CHUNK_ROWS turns as
+-- zlib-compressed JSON, covering the id range first_id..last_id.
+-- chat_store.py reads both tiers, so history looks the same to clients.
+
+CREATE TABLE IF NOT EXISTS `chat_history_archive` (
+  `chunk_id` bigint(20) UNSIGNED NOT NULL AUTO_INCREMENT,
+  `user_id` int(11) NOT NULL,
+  `first_id` int(11) NOT NULL,
+  `last_id` int(11) NOT NULL,
+  `row_count` int(11) NOT NULL,
+  `last_created_at` timestamp NULL DEFAULT NULL,
+  `payload` mediumblob NOT NULL,
+  `archived_at` timestamp NOT NULL DEFAULT current_timestamp(),
+  PRIMARY KEY (`chunk_id`),
+  KEY `user_first_id` (`user_id`, `first_id`),
+  CONSTRAINT `chat_history_archive_user_fk` FOREIGN KEY (`user_id`) REFERENCES `users` (`id`) ON DELETE CASCADE
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_general_ci;
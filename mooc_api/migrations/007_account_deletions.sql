@@ -0,0 +1,21 @@
+-- 007_account_deletions.sql
+-- Tombstones for account deletion (account_deletion.py). DELETE /api/auth/delete
+-- writes a row here and returns. While the row is not 'done', chat and login.php
+-- refuse the account, and a background purger deletes the user's rows in
+-- primary-key batches, recording progress here, before deleting the users row.
+-- No foreign key to `users`: the tombstone outlives the account it describes.
+
+CREATE TABLE IF NOT EXISTS `account_deletions` (
+  `user_id` int(11) NOT NULL,
+  `state` enum('pending','running','done') NOT NULL DEFAULT 'pending',
+  `current_table` varchar(64) DEFAULT NULL,
+  `rows_deleted` bigint(20) UNSIGNED NOT NULL DEFAULT 0,
+  `attempts` int(11) NOT NULL DEFAULT 0,
+  `claimed_by` varchar(64) DEFAULT NULL,
+  `claimed_at` datetime DEFAULT NULL,
+  `last_error` varchar(500) DEFAULT NULL,
+  `requested_at` timestamp NOT NULL DEFAULT current_timestamp(),
+  `finished_at` datetime DEFAULT NULL,
+  PRIMARY KEY (`user_id`),
+  KEY `state_claimed_at` (`state`, `claimed_at`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_general_ci;
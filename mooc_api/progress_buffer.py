@@ -0,0 +1,241 @@
+# progress_buffer.py
+"""
+Write-coalescing buffer for learner progress (tra_user_courses).
+
+Each (user, course) pair keeps one pending entry holding the highest
+progress and lessons_finished seen so far, however many updates arrive.
+A background thread writes all pending entries every
+PROGRESS_FLUSH_INTERVAL seconds as one UPDATE ... JOIN per batch. GREATEST()
+keeps the columns monotonic even when several workers flush the same row.
+Reads in this worker go through the buffer, so they see their own writes.
+Remembered values are re-read from MySQL once they are PROGRESS_KNOWN_TTL
+seconds old, so updates flushed by other workers show up too.
+"""
+import os
+import time
+import atexit
+import threading
+from collections import OrderedDict
+
+import mysql.connector
+
+from db_pool import get_db, PoolTimeoutError
+
+# --------------------------
+# Progress buffer configuration
+# --------------------------
+PROGRESS_FLUSH_INTERVAL = float(os.environ.get("PROGRESS_FLUSH_INTERVAL", 2.0))  # seconds between flushes
+PROGRESS_BATCH_SIZE = int(os.environ.get("PROGRESS_BATCH_SIZE", 500))            # rows per UPDATE statement
+PROGRESS_KNOWN_MAX = int(os.environ.get("PROGRESS_KNOWN_MAX", 50000))            # enrollments remembered per worker
+PROGRESS_KNOWN_TTL = float(os.environ.get("PROGRESS_KNOWN_TTL", 5.0))            # seconds before get() re-reads MySQL
+
+
+def clamp_progress(progress, lessons_finished):
+    """Same bounds as update_course_progress.php: progress 0-100, lessons >= 0."""
+    return max(0, min(100, int(progress))), max(0, int(lessons_finished))
+
+
+def _update_rows(cursor, rows):
+    """rows: [(user_id, course_id, progress, lessons_finished)] -> one UPDATE joined to a derived table."""
+    derived = " UNION ALL ".join(
+        ["SELECT %s AS user_id, %s AS course_id, %s AS progress, %s AS lessons_finished"] * len(rows)
+    )
+    cursor.execute(
+        f"UPDATE tra_user_courses AS t JOIN ({derived}) AS v "
+        "ON t.user_id = v.user_id AND t.enrolled_course = v.course_id "
+        "SET t.progress = GREATEST(COALESCE(t.progress, 0), v.progress), "
+        "    t.lessons_finished = GREATEST(t.lessons_finished, v.lessons_finished)",
+        [value for row in rows for value in row]
+    )
+
+
+class ProgressBuffer:
+    def __init__(self, flush_interval=2.0, batch_size=500, known_max=50000, known_ttl=5.0):
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.known_max = known_max
+        self.known_ttl = known_ttl
+
+        self._pending = {}            # (user_id, course_id) -> (progress, lessons_finished)
+        self._known = OrderedDict()   # enrolled pairs -> (last known values, when MySQL was last read), LRU
+        self._cond = threading.Condition()
+        self._flush_lock = threading.Lock()
+        self._stopped = False
+        self._thread = None
+        self._pid = None
+
+        self.updates = 0
+        self.coalesced = 0
+        self.lookups = 0
+        self.batches_written = 0
+        self.rows_written = 0
+        self.write_errors = 0
+
+    def _ensure_thread(self):
+        # Threads do not survive fork; start one lazily in each worker.
+        if self._thread is None or self._pid != os.getpid():
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name="progress-flush", daemon=True)
+            self._thread.start()
+
+    def _remember(self, key, values, read_at=None):
+        if read_at is None:
+            read_at = self._known[key][1] if key in self._known else 0.0
+        self._known[key] = (values, read_at)
+        self._known.move_to_end(key)
+        while len(self._known) > self.known_max:
+            self._known.popitem(last=False)
+
+    def _local(self, key):
+        # _known holds pending values merged with the last MySQL read, so it wins.
+        entry = self._known.get(key)
+        return entry[0] if entry else self._pending.get(key)
+
+    def _load(self, user_id, course_id):
+        """Reads one enrollment's stored values, or None if the user is not enrolled."""
+        self.lookups += 1
+        with get_db() as db:
+            cursor = db.cursor()
+            try:
+                cursor.execute(
+                    "SELECT COALESCE(progress, 0), lessons_finished FROM tra_user_courses "
+                    "WHERE user_id=%s AND enrolled_course=%s",
+                    (user_id, course_id)
+                )
+                return cursor.fetchone()
+            finally:
+                cursor.close()
+
+    def update(self, user_id, course_id, progress, lessons_finished):
+        """
+        Merges an update into the buffer and returns the values that will be
+        stored, or None when there is no such enrollment. Only the first update
+        for an enrollment this worker has not seen reads from MySQL.
+        """
+        key = (user_id, course_id)
+        progress, lessons_finished = clamp_progress(progress, lessons_finished)
+        read_at = None
+        with self._cond:
+            base = self._local(key)
+        if base is None:
+            read_at = time.monotonic()
+            base = self._load(user_id, course_id)
+            if base is None:
+                return None
+
+        with self._cond:
+            self._ensure_thread()
+            base = self._local(key) or base
+            merged = (max(base[0], progress), max(base[1], lessons_finished))
+            self.updates += 1
+            if key in self._pending:
+                self.coalesced += 1
+            self._pending[key] = merged
+            self._remember(key, merged, read_at)
+            if len(self._pending) >= self.batch_size:
+                self._cond.notify()
+        return merged
+
+    def get(self, user_id, course_id):
+        """
+        (progress, lessons_finished) including unflushed updates, or None if not
+        enrolled. Served from memory while the last MySQL read is under
+        known_ttl seconds old; after that MySQL is read again and overlaid.
+        """
+        key = (user_id, course_id)
+        now = time.monotonic()
+        with self._cond:
+            values = self._local(key)
+            entry = self._known.get(key)
+            if values is not None and entry is not None and now - entry[1] < self.known_ttl:
+                return values
+        stored = self._load(user_id, course_id)
+        with self._cond:
+            if stored is None:
+                self._known.pop(key, None)
+                return None
+            values = self._local(key)
+            if values is not None:
+                stored = (max(stored[0], values[0]), max(stored[1], values[1]))
+            self._remember(key, tuple(stored), now)
+        return tuple(stored)
+
+    def overlay(self, user_id, course_id, progress, lessons_finished):
+        """Combines values read from MySQL with this worker's newer ones (never lowers them)."""
+        with self._cond:
+            values = self._local((user_id, course_id))
+        if values is None:
+            return progress, lessons_finished
+        return max(progress or 0, values[0]), max(lessons_finished or 0, values[1])
+
+    def pending_count(self):
+        with self._cond:
+            return len(self._pending)
+
+    def flush(self):
+        """Writes every pending entry, one UPDATE per batch."""
+        with self._flush_lock:
+            with self._cond:
+                pending, self._pending = self._pending, {}
+            rows = [(u, c, p, l) for (u, c), (p, l) in pending.items()]
+            for start in range(0, len(rows), self.batch_size):
+                batch = rows[start:start + self.batch_size]
+                try:
+                    with get_db() as db:
+                        cursor = db.cursor()
+                        try:
+                            _update_rows(cursor, batch)
+                            db.commit()
+                        finally:
+                            cursor.close()
+                    self.batches_written += 1
+                    self.rows_written += len(batch)
+                except (mysql.connector.Error, PoolTimeoutError) as err:
+                    self.write_errors += 1
+                    print(f"ERROR: progress flush of {len(batch)} rows failed, will retry: {err}")
+                    self._restore(rows[start:])
+                    return
+
+    def _restore(self, rows):
+        # Put unwritten rows back without overwriting anything newer.
+        with self._cond:
+            for u, c, p, l in rows:
+                current = self._pending.get((u, c))
+                self._pending[(u, c)] = (max(p, current[0]), max(l, current[1])) if current else (p, l)
+
+    def _run(self):
+        while True:
+            with self._cond:
+                if not self._stopped and len(self._pending) < self.batch_size:
+                    self._cond.wait(self.flush_interval)
+                stopped = self._stopped
+            self.flush()
+            if stopped:
+                return
+
+    def close(self):
+        with self._cond:
+            self._stopped = True
+            self._cond.notify_all()
+        self.flush()
+
+    def stats(self):
+        return {
+            "pending": self.pending_count(),
+            "known_enrollments": len(self._known),
+            "updates": self.updates,
+            "coalesced": self.coalesced,
+            "lookups": self.lookups,
+            "batches_written": self.batches_written,
+            "rows_written": self.rows_written,
+            "write_errors": self.write_errors,
+        }
+
+
+progress_buffer = ProgressBuffer(
+    flush_interval=PROGRESS_FLUSH_INTERVAL,
+    batch_size=PROGRESS_BATCH_SIZE,
+    known_max=PROGRESS_KNOWN_MAX,
+    known_ttl=PROGRESS_KNOWN_TTL,
+)
+atexit.register(progress_buffer.close)
@@ -0,0 +1,269 @@
+# prompt_builder.py
+"""
+Assembles the Gemini prompt for a chat turn within a token budget.
+
+A prompt has two parts:
+- system: the role and formatting preamble followed by the lesson title. It
+  is identical for every turn in a lesson and goes first, as the system
+  instruction, so the provider can reuse it as a cached prefix.
+- text: the per-turn delta, made of the conversation summary, the
+  learner's message and the preferred language.
+
+Token counts are estimated from the character count (PROMPT_CHARS_PER_TOKEN).
+When system plus text would exceed PROMPT_TOKEN_BUDGET, summary lines are
+dropped longest first, and the oldest of equally long lines goes first. A
+message longer than PROMPT_MESSAGE_MAX_TOKENS is cut down.
+
+When the system part is big enough for Gemini's explicit context caching
+(PROMPT_CACHE_MIN_TOKENS), it is registered once per lesson as a
+cachedContents entry in the background. Later turns then send only the
+cache name and the delta. A shorter system part is still sent first on
+every turn, which is the stable prefix that Gemini's implicit caching
+matches on.
+"""
+import os
+import time
+import hashlib
+import threading
+from collections import namedtuple
+
+from gemini_client import GEMINI_API_KEY, GEMINI_MODEL, get_http_session, rest_url
+from metrics import PROMPT_TOKENS
+
+# --------------------------
+# Prompt configuration
+# --------------------------
+PROMPT_TOKEN_BUDGET = int(os.environ.get("PROMPT_TOKEN_BUDGET", 1500))              # system + text, estimated
+PROMPT_MESSAGE_MAX_TOKENS = int(os.environ.get("PROMPT_MESSAGE_MAX_TOKENS", 1000))  # longer messages are cut
+PROMPT_CHARS_PER_TOKEN = float(os.environ.get("PROMPT_CHARS_PER_TOKEN", 4))
+PROMPT_CACHE_ENABLED = os.environ.get("PROMPT_CACHE_ENABLED", "1") == "1"
+PROMPT_CACHE_MIN_TOKENS = int(os.environ.get("PROMPT_CACHE_MIN_TOKENS", 1024))  # Gemini's explicit-cache minimum
+PROMPT_CACHE_TTL = int(os.environ.get("PROMPT_CACHE_TTL", 3600))                 # seconds a cache entry lives
+PROMPT_CACHE_RETRY = float(os.environ.get("PROMPT_CACHE_RETRY", 300))            # wait after a failed create
+PROMPT_CACHE_MAX_LESSONS = int(os.environ.get("PROMPT_CACHE_MAX_LESSONS", 500))
+
+_CACHE_RENEW_MARGIN = 60   # stop handing out an entry this many seconds before it expires
+
+PREAMBLE = """You are the MOOC Lesson AI Assistant integrated into an educational platform.
+
+--- Role ---
+You help Filipino MOOC students by:
+- Answering simply and accurately
+- Giving local Ilonggo examples
+- Providing Filipino/Hiligaynon translations when asked
+- NEVER including sensitive data
+- NEVER exposing raw internal chat logs
+
+Formatting rules:
+- DO NOT use Markdown.
+- DO NOT use bold (** **), italics (* * / _ _), backticks, or code blocks.
+- Output PLAIN TEXT ONLY."""
+
+SUMMARY_HEADER = "--- Student Conversation Summary (for context, privacy-safe) ---"
+
+# system: the cacheable prefix; text: the per-turn delta; cached_content: name of
+# the cache entry holding `system`, or None to send `system` inline.
+Prompt = namedtuple("Prompt", ["system", "text", "cached_content", "estimated_tokens", "trimmed"])
+
+
+def estimate_tokens(text):
+    if not text:
+        return 0
+    return int(len(text) / PROMPT_CHARS_PER_TOKEN) + 1
+
+
+def as_text(prompt):
+    """The whole prompt as one string (for endpoints without a system instruction)."""
+    if isinstance(prompt, str):
+        return prompt
+    return f"{prompt.system}\n\n{prompt.text}"
+
+
+def as_prompt(prompt):
+    """Accepts a Prompt or a plain string (sent as the turn text with no system part)."""
+    if isinstance(prompt, str):
+        return Prompt("", prompt, None, estimate_tokens(prompt), 0)
+    return prompt
+
+
+def _trim_lines(lines, budget):
+    """Drops lines, longest then oldest first, until they fit. Returns (kept, dropped)."""
+    lines = list(lines)
+    tokens = [estimate_tokens(line) for line in lines]
+    total = sum(tokens)
+    dropped = 0
+    while lines and total > budget:
+        index = max(range(len(lines)), key=lambda i: (tokens[i], -i))
+        total -= tokens.pop(index)
+        del lines[index]
+        dropped += 1
+    return lines, dropped
+
+
+# --------------------------
+# Provider-side prefix cache
+# --------------------------
+class PrefixCache:
+    """
+    cachedContents entries for system prefixes, one per lesson and worker.
+
+    lookup() never waits: a prefix without a usable entry is sent inline
+    and its entry is created on a background thread for later turns.
+    """
+
+    def __init__(self, max_entries=500):
+        self.max_entries = max_entries
+        self._entries = {}   # prefix hash -> (cache name or None, usable until / retry after)
+        self._creating = set()
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.created = 0
+        self.failed = 0
+        self.forgotten = 0
+
+    def lookup(self, system):
+        key = hashlib.sha256(f"{GEMINI_MODEL}\n{system}".encode("utf-8")).hexdigest()
+        now = time.time()
+        with self._lock:
+            name, until = self._entries.get(key, (None, 0.0))
+            if name and now < until:
+                self.hits += 1
+                return name
+            self.misses += 1
+            if now < until or key in self._creating:
+                return None   # failed recently, or already being created
+            self._creating.add(key)
+        threading.Thread(target=self._create, args=(key, system), name="prompt-cache", daemon=True).start()
+        return None
+
+    def _create(self, key, system):
+        try:
+            name = self._request(system)
+        except Exception as e:
+            print(f"ERROR: could not create Gemini context cache: {e}")
+            entry = (None, time.time() + PROMPT_CACHE_RETRY)
+            self.failed += 1
+        else:
+            entry = (name, time.time() + PROMPT_CACHE_TTL - _CACHE_RENEW_MARGIN)
+            self.created += 1
+        with self._lock:
+            self._creating.discard(key)
+            if len(self._entries) >= self.max_entries and key not in self._entries:
+                self._entries.pop(next(iter(self._entries)))   # oldest entry; it expires server-side
+            self._entries[key] = entry
+
+    def _request(self, system):
+        body = {
+            "model": f"models/{GEMINI_MODEL}",
+            "systemInstruction": {"parts": [{"text": system}]},
+            "ttl": f"{PROMPT_CACHE_TTL}s",
+        }
+        resp = get_http_session().post(rest_url("v1beta/cachedContents") + f"?key={GEMINI_API_KEY}",
+                                       json=body, timeout=10)
+        if resp.status_code != 200:
+            raise RuntimeError(f"HTTP {resp.status_code}: {resp.text[:200]}")
+        return resp.json()["name"]
+
+    def forget(self, name):
+        """Drops an entry the provider no longer knows (expired or deleted early)."""
+        with self._lock:
+            for key, (entry_name, _) in list(self._entries.items()):
+                if entry_name == name:
+                    del self._entries[key]
+                    self.forgotten += 1
+
+    def stats(self):
+        with self._lock:
+            live = sum(1 for name, until in self._entries.values() if name and time.time() < until)
+        return {"entries": live, "hits": self.hits, "misses": self.misses,
+                "created": self.created, "failed": self.failed, "forgotten": self.forgotten}
+
+
+# --------------------------
+# Prompt assembly
+# --------------------------
+class PromptBuilder:
+    def __init__(self, budget=1500, message_max_tokens=1000, prefix_cache=None):
+        self.budget = budget
+        self.message_max_tokens = message_max_tokens
+        self.prefix_cache = prefix_cache
+        self._lock = threading.Lock()
+
+        self.builds = 0
+        self.trimmed_lines = 0
+        self.truncated_messages = 0
+        self.estimated_tokens = 0
+        self.input_tokens = 0
+        self.cached_tokens = 0
+        self.usage_reports = 0
+
+    def system_for(self, lesson_title):
+        return f"{PREAMBLE}\n\nLesson: {lesson_title}"
+
+    def build(self, lesson_title, summary, user_msg, language):
+        """Returns the Prompt for one turn; `summary` is the newline-joined context lines."""
+        system = self.system_for(lesson_title)
+
+        max_chars = int(self.message_max_tokens * PROMPT_CHARS_PER_TOKEN)
+        truncated = len(user_msg) > max_chars
+        if truncated:
+            user_msg = user_msg[:max_chars]
+
+        head = f"{SUMMARY_HEADER}\n"
+        tail = f"\n\nUser says:\n{user_msg}\n\nPreferred language: {language}"
+        fixed = estimate_tokens(system) + estimate_tokens(head) + estimate_tokens(tail)
+        lines, dropped = _trim_lines(summary.split("\n") if summary else [], self.budget - fixed)
+        text = head + "\n".join(lines) + tail
+
+        cached_content = None
+        if self.prefix_cache is not None and estimate_tokens(system) >= PROMPT_CACHE_MIN_TOKENS:
+            cached_content = self.prefix_cache.lookup(system)
+
+        estimated = estimate_tokens(system) + estimate_tokens(text)
+        with self._lock:
+            self.builds += 1
+            self.trimmed_lines += dropped
+            self.truncated_messages += truncated
+            self.estimated_tokens += estimated
+        PROMPT_TOKENS.observe(estimated, "estimated")
+        return Prompt(system, text, cached_content, estimated, dropped)
+
+    def record_usage(self, input_tokens, cached_tokens=0):
+        """Token counts Gemini reported for one call (usage metadata)."""
+        if not input_tokens:
+            return
+        with self._lock:
+            self.usage_reports += 1
+            self.input_tokens += input_tokens
+            self.cached_tokens += cached_tokens or 0
+        PROMPT_TOKENS.observe(input_tokens, "input")
+        PROMPT_TOKENS.observe(cached_tokens or 0, "cached")
+
+    def forget_cache(self, name):
+        if self.prefix_cache is not None and name:
+            self.prefix_cache.forget(name)
+
+    def stats(self):
+        with self._lock:
+            stats = {
+                "builds": self.builds,
+                "budget_tokens": self.budget,
+                "avg_estimated_tokens": round(self.estimated_tokens / self.builds, 1) if self.builds else 0,
+                "trimmed_lines": self.trimmed_lines,
+                "truncated_messages": self.truncated_messages,
+                "usage_reports": self.usage_reports,
+                "avg_input_tokens": round(self.input_tokens / self.usage_reports, 1) if self.usage_reports else 0,
+                "cached_token_ratio": round(self.cached_tokens / self.input_tokens, 3) if self.input_tokens else 0,
+            }
+        if self.prefix_cache is not None:
+            stats.update({f"cache_{k}": v for k, v in self.prefix_cache.stats().items()})
+        return stats
+
+
+prompt_builder = PromptBuilder(
+    budget=PROMPT_TOKEN_BUDGET,
+    message_max_tokens=PROMPT_MESSAGE_MAX_TOKENS,
+    prefix_cache=PrefixCache(PROMPT_CACHE_MAX_LESSONS) if PROMPT_CACHE_ENABLED else None,
+)
@@ -0,0 +1,130 @@
+# providers.py
+"""
+Lazily loaded client libraries for the AI and mail providers.
+
+google.genai, requests, smtplib and the email.mime classes are imported on
+first use instead of when a worker starts, so a worker that never serves a
+chat turn or sends mail never pays for them. Every module gets them from
+here, so each is imported once per process.
+
+warm_up() loads what WARM_UP lists ahead of the first request:
+- "ai": the HTTP session and SDK client
+- "mail": smtplib and the MIME classes
+- "hashing": the bcrypt pool and one hash
+
+gunicorn.conf.py calls it after each fork.
+"""
+import os
+import time
+import threading
+
+WARM_UP = [part.strip() for part in os.environ.get("WARM_UP", "hashing").split(",") if part.strip()]
+
+_lock = threading.Lock()
+_loaded = {}
+
+
+def _load(name, loader):
+    try:
+        return _loaded[name]
+    except KeyError:
+        pass
+    with _lock:
+        if name not in _loaded:
+            _loaded[name] = loader()
+        return _loaded[name]
+
+
+def _import_genai():
+    try:
+        from google import genai
+        from google.genai import types
+        return genai, types
+    except Exception:   # the SDK is optional; the REST path works without it
+        return None, None
+
+
+def _import_requests():
+    import requests
+    return requests
+
+
+def _import_smtplib():
+    import smtplib
+    return smtplib
+
+
+def _import_mime():
+    from email.mime.text import MIMEText
+    from email.mime.multipart import MIMEMultipart
+    return MIMEText, MIMEMultipart
+
+
+def load_genai():
+    """(genai, genai_types), or (None, None) when google-genai is not installed."""
+    return _load("genai", _import_genai)
+
+
+def load_requests():
+    return _load("requests", _import_requests)
+
+
+def load_smtplib():
+    return _load("smtplib", _import_smtplib)
+
+
+def load_mime():
+    """(MIMEText, MIMEMultipart)"""
+    return _load("mime", _import_mime)
+
+
+def loaded():
+    return sorted(_loaded)
+
+
+# --------------------------
+# Warm-up
+# --------------------------
+def _warm_ai():
+    import gemini_client
+    gemini_client.get_http_session()
+    if gemini_client.sdk_available():
+        gemini_client.get_sdk_client()
+
+
+def _warm_mail():
+    load_smtplib()
+    load_mime()
+
+
+def _warm_hashing():
+    from hashing import hasher
+    hasher.warm_up()
+
+
+_WARMERS = {"ai": _warm_ai, "mail": _warm_mail, "hashing": _warm_hashing}
+
+
+def warm_up(parts=None):
+    """Prepares `parts` (default WARM_UP) now rather than on first use. Returns {part: ms}."""
+    timings = {}
+    for part in WARM_UP if parts is None else parts:
+        warmer = _WARMERS.get(part)
+        if warmer is None:
+            print(f"WARNING: unknown warm-up part {part!r} (expected one of {', '.join(_WARMERS)})")
+            continue
+        start = time.perf_counter()
+        try:
+            warmer()
+        except Exception as e:   # warm-up is an optimisation; the first request retries
+            print(f"ERROR: warm-up of {part} failed: {e}")
+            continue
+        timings[part] = round((time.perf_counter() - start) * 1000, 1)
+    if timings:
+        print(f"INFO: warm-up done in pid {os.getpid()}: {timings}")
+    return timings
+
+
+def warm_up_in_background(parts=None):
+    """Runs warm_up() on a daemon thread so the worker starts serving straight away."""
+    threading.Thread(target=warm_up, args=(parts,), name="warm-up", daemon=True).start()
@@ -0,0 +1,369 @@
+# rate_limit.py
+"""
+Per-user and per-IP token buckets for the chat routes, shared by all workers.
+
+Every chat turn takes one token from the learner's bucket and one from the
+client IP's bucket. A bucket holds up to *_BURST tokens and refills at
+*_PER_MIN tokens a minute. If either bucket is empty the request is refused
+with 429 and a Retry-After, before it touches MySQL or Gemini.
+
+Bucket state lives in a store selected by RATE_LIMIT_STORE:
+- `shm` (default): a fixed-size hash table in a memory-mapped file
+  (RATE_LIMIT_SHM_PATH, in /dev/shm where available). Every worker on the
+  host maps the same file. Each stripe of slots is guarded by an fcntl
+  byte-range lock across processes, plus a thread lock within the process.
+  The kernel drops the lock if a worker dies holding it. A check costs a
+  few microseconds.
+- `redis`: one atomic Lua script per check, for workers spread over
+  several hosts (RATE_LIMIT_REDIS_URL; needs the `redis` package).
+- `memory`: a per-process dict, for single-process development.
+"""
+import os
+import math
+import time
+import fcntl
+import mmap
+import struct
+import hashlib
+import tempfile
+import threading
+from collections import namedtuple
+
+# --------------------------
+# Rate limit configuration
+# --------------------------
+RATE_LIMIT_ENABLED = os.environ.get("RATE_LIMIT_ENABLED", "1") == "1"
+RATE_LIMIT_USER_BURST = float(os.environ.get("RATE_LIMIT_USER_BURST", 10))       # chat turns in a row
+RATE_LIMIT_USER_PER_MIN = float(os.environ.get("RATE_LIMIT_USER_PER_MIN", 20))   # sustained turns per minute
+RATE_LIMIT_IP_BURST = float(os.environ.get("RATE_LIMIT_IP_BURST", 30))           # higher: classrooms share one IP
+RATE_LIMIT_IP_PER_MIN = float(os.environ.get("RATE_LIMIT_IP_PER_MIN", 60))
+RATE_LIMIT_TRUSTED_PROXIES = int(os.environ.get("RATE_LIMIT_TRUSTED_PROXIES", 0))  # reverse proxies adding X-Forwarded-For
+RATE_LIMIT_STORE = os.environ.get("RATE_LIMIT_STORE", "shm")
+RATE_LIMIT_SHM_PATH = os.environ.get("RATE_LIMIT_SHM_PATH", os.path.join(
+    "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir(), "mooc_api_rate_limit"))
+RATE_LIMIT_SHM_SLOTS = int(os.environ.get("RATE_LIMIT_SHM_SLOTS", 65536))        # buckets tracked (24 bytes each)
+RATE_LIMIT_REDIS_URL = os.environ.get("RATE_LIMIT_REDIS_URL", "redis://localhost:6379/0")
+
+Rule = namedtuple("Rule", ["burst", "rate"])   # rate in tokens per second
+
+USER_RULE = Rule(RATE_LIMIT_USER_BURST, RATE_LIMIT_USER_PER_MIN / 60.0)
+IP_RULE = Rule(RATE_LIMIT_IP_BURST, RATE_LIMIT_IP_PER_MIN / 60.0)
+
+
+class RateLimited(Exception):
+    """Raised when a bucket is empty; retry_after is in whole seconds."""
+
+    def __init__(self, scope, retry_after):
+        super().__init__(f"rate limit exceeded ({scope})")
+        self.scope = scope
+        self.retry_after = max(1, int(math.ceil(retry_after)))
+
+
+def _refill(tokens, last, now, rule):
+    if last <= 0:
+        return rule.burst   # never seen: a full bucket
+    return min(rule.burst, tokens + max(0.0, now - last) * rule.rate)
+
+
+def _key_hash(key):
+    # 0 marks an empty slot, so never hand it out.
+    return int.from_bytes(hashlib.blake2b(key.encode("utf-8"), digest_size=8).digest(), "little") or 1
+
+
+# --------------------------
+# Stores
+# --------------------------
+class MemoryStore:
+    """Buckets in a dict; only correct with a single worker process."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._buckets = {}
+
+    def take(self, checks):
+        """
+        checks: [(key, Rule)]. Takes one token from every bucket, or from none.
+        Returns (0, None) or (seconds until a token is available, refused key).
+        """
+        now = time.monotonic()
+        with self._lock:
+            states = [_refill(*self._buckets.get(key, (0.0, 0.0)), now, rule) for key, rule in checks]
+            wait, refused = _shortfall(checks, states)
+            if refused is None:
+                for (key, rule), tokens in zip(checks, states):
+                    self._buckets[key] = (tokens - 1, now)
+                if len(self._buckets) > RATE_LIMIT_SHM_SLOTS:
+                    self._evict_full(now)
+            return wait, refused
+
+    def _evict_full(self, now):
+        # Idle for an hour means refilled long ago, and a full bucket is the same as no bucket.
+        for key, (tokens, last) in list(self._buckets.items()):
+            if now - last > 3600:
+                del self._buckets[key]
+
+    def close(self):
+        pass
+
+
+def _shortfall(checks, states):
+    wait, refused = 0.0, None
+    for (key, rule), tokens in zip(checks, states):
+        if tokens < 1:
+            need = (1 - tokens) / rule.rate if rule.rate > 0 else 3600.0
+            if need > wait:
+                wait, refused = need, key
+    return wait, refused
+
+
+class SharedMemoryStore:
+    """
+    Open-addressed hash table in a memory-mapped file shared by every worker.
+
+    Slot: key hash (u64, 0 = empty), tokens (f64), last refill (f64, CLOCK_MONOTONIC,
+    which is one clock for all processes on the host). A key probes up to
+    _PROBE slots inside its stripe. When they all hold other keys, the least
+    recently used of them is reused; that key starts from a full bucket if
+    it comes back.
+    """
+    _MAGIC = b"MOOCRL01"
+    _HEADER = struct.Struct("<8sII")   # magic, slots, stripe size
+    _SLOT = struct.Struct("<Qdd")
+    _STRIPE = 64
+    _PROBE = 8
+
+    def __init__(self, path=RATE_LIMIT_SHM_PATH, slots=RATE_LIMIT_SHM_SLOTS):
+        self.slots = max(self._STRIPE, slots - slots % self._STRIPE)
+        # The table size is part of the name, so workers started with another
+        # RATE_LIMIT_SHM_SLOTS never resize a file that running workers have mapped.
+        self.path = f"{path}.{self.slots}"
+        self.stripes = self.slots // self._STRIPE
+        self.size = self._HEADER.size + self.slots * self._SLOT.size
+        self._pid = None
+        self._open()
+
+    def _open(self):
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            fcntl.lockf(fd, fcntl.LOCK_EX)   # whole file, while checking the layout
+            try:
+                header = os.pread(fd, self._HEADER.size, 0)
+                if len(header) < self._HEADER.size or self._HEADER.unpack(header) != (self._MAGIC, self.slots, self._STRIPE) \
+                        or os.fstat(fd).st_size != self.size:
+                    os.ftruncate(fd, 0)
+                    os.ftruncate(fd, self.size)   # zero-filled: every slot empty
+                    os.pwrite(fd, self._HEADER.pack(self._MAGIC, self.slots, self._STRIPE), 0)
+            finally:
+                fcntl.lockf(fd, fcntl.LOCK_UN)
+            self._map = mmap.mmap(fd, self.size, mmap.MAP_SHARED, mmap.PROT_READ | mmap.PROT_WRITE)
+        except Exception:
+            os.close(fd)
+            raise
+        self._fd = fd
+        # fcntl locks belong to the process, so threads in it also need a lock per stripe.
+        self._thread_locks = [threading.Lock() for _ in range(min(self.stripes, 256))]
+        self._pid = os.getpid()
+
+    def _check_pid(self):
+        if self._pid != os.getpid():
+            # Forked: the mapping is still shared, but thread locks may have been held by the parent.
+            self._thread_locks = [threading.Lock() for _ in range(len(self._thread_locks))]
+            self._pid = os.getpid()
+
+    def _offset(self, slot):
+        return self._HEADER.size + slot * self._SLOT.size
+
+    def _lock_stripes(self, stripes):
+        """Locks the given stripes (sorted, so no two lockers wait on each other); returns what to unlock."""
+        thread_locks = [self._thread_locks[i] for i in sorted({s % len(self._thread_locks) for s in stripes})]
+        held_threads, held_files = [], []
+        try:
+            for lock in thread_locks:
+                lock.acquire()
+                held_threads.append(lock)
+            for stripe in stripes:
+                fcntl.lockf(self._fd, fcntl.LOCK_EX, self._STRIPE * self._SLOT.size, self._offset(stripe * self._STRIPE))
+                held_files.append(stripe)
+        except BaseException:
+            self._unlock_stripes((held_threads, held_files))
+            raise
+        return held_threads, held_files
+
+    def _unlock_stripes(self, held):
+        held_threads, held_files = held
+        for stripe in held_files:
+            fcntl.lockf(self._fd, fcntl.LOCK_UN, self._STRIPE * self._SLOT.size, self._offset(stripe * self._STRIPE))
+        for lock in reversed(held_threads):
+            lock.release()
+
+    def _find(self, key_hash):
+        """Slot for key_hash inside its (locked) stripe, and its current tokens and last."""
+        stripe = key_hash % self.stripes
+        base = stripe * self._STRIPE
+        start = (key_hash >> 32) % self._STRIPE
+        victim = None
+        for i in range(self._PROBE):
+            slot = base + (start + i) % self._STRIPE
+            stored, tokens, last = self._SLOT.unpack_from(self._map, self._offset(slot))
+            if stored == key_hash:
+                return slot, tokens, last
+            if stored == 0:
+                return slot, 0.0, 0.0
+            if victim is None or last < victim[1]:
+                victim = (slot, last)
+        return victim[0], 0.0, 0.0   # least recently used bucket in the probe window
+
+    def take(self, checks):
+        """Same contract as MemoryStore.take, atomic across every process mapping the file."""
+        self._check_pid()
+        hashes = [_key_hash(key) for key, _ in checks]
+        held = self._lock_stripes(sorted({h % self.stripes for h in hashes}))
+        try:
+            now = time.monotonic()
+            found = [self._find(h) for h in hashes]
+            states = [_refill(tokens, last, now, rule) for (_, tokens, last), (_, rule) in zip(found, checks)]
+            wait, refused = _shortfall(checks, states)
+            if refused is None:
+                for h, (slot, _, _), tokens in zip(hashes, found, states):
+                    self._SLOT.pack_into(self._map, self._offset(slot), h, tokens - 1, now)
+            return wait, refused
+        finally:
+            self._unlock_stripes(held)
+
+    def close(self):
+        self._map.close()
+        os.close(self._fd)
+
+
+class RedisStore:
+    """Buckets as Redis hashes, updated by one Lua script per check (works across hosts)."""
+
+    _SCRIPT = """
+local now = redis.call('TIME')
+now = tonumber(now[1]) + tonumber(now[2]) / 1000000
+local tokens, wait, refused = {}, 0, 0
+for i = 1, #KEYS do
+  local burst, rate = tonumber(ARGV[2 * i - 1]), tonumber(ARGV[2 * i])
+  local state = redis.call('HMGET', KEYS[i], 't', 'ts')
+  local t = tonumber(state[1])
+  if t == nil then t = burst else t = math.min(burst, t + math.max(0, now - tonumber(state[2])) * rate) end
+  tokens[i] = t
+  if t < 1 and (1 - t) / rate > wait then wait, refused = (1 - t) / rate, i end
+end
+if refused > 0 then return {refused, tostring(wait)} end
+for i = 1, #KEYS do
+  local burst, rate = tonumber(ARGV[2 * i - 1]), tonumber(ARGV[2 * i])
+  redis.call('HSET', KEYS[i], 't', tokens[i] - 1, 'ts', now)
+  redis.call('PEXPIRE', KEYS[i], math.ceil(burst / rate * 1000))
+end
+return {0, '0'}
+"""
+
+    def __init__(self, url=RATE_LIMIT_REDIS_URL):
+        import redis   # optional dependency, only needed for this store
+        self._client = redis.Redis.from_url(url, socket_timeout=0.05)
+        self._script = self._client.register_script(self._SCRIPT)
+
+    def take(self, checks):
+        args = []
+        for _, rule in checks:
+            args.extend((rule.burst, rule.rate))
+        refused, wait = self._script(keys=[f"mooc_api:rl:{key}" for key, _ in checks], args=args)
+        return (float(wait), checks[int(refused) - 1][0]) if int(refused) else (0.0, None)
+
+    def close(self):
+        self._client.close()
+
+
+def _new_store(kind):
+    if kind == "memory":
+        return MemoryStore()
+    if kind == "redis":
+        return RedisStore()
+    if kind == "shm":
+        return SharedMemoryStore()
+    raise ValueError(f"unknown RATE_LIMIT_STORE {kind!r} (expected shm, redis or memory)")
+
+
+# --------------------------
+# Limiter
+# --------------------------
+class RateLimiter:
+    def __init__(self, store=RATE_LIMIT_STORE):
+        self._kind = store
+        self._store = None
+        self._lock = threading.Lock()
+
+        self.allowed = 0
+        self.limited = {"user": 0, "ip": 0}
+        self.store_errors = 0
+        self.check_seconds = 0.0
+        self.check_max = 0.0
+
+    def _get_store(self):
+        if self._store is None:
+            with self._lock:
+                if self._store is None:
+                    try:
+                        self._store = _new_store(self._kind)
+                    except (OSError, ImportError) as e:
+                        print(f"ERROR: rate limit store {self._kind!r} unavailable ({e}); using per-process buckets.")
+                        self._store = MemoryStore()
+        return self._store
+
+    def check(self, user_id, ip):
+        """Takes a token for the user and the IP, or raises RateLimited without taking either."""
+        if not RATE_LIMIT_ENABLED:
+            return
+        checks = [(f"u:{user_id}", USER_RULE)]
+        if ip:
+            checks.append((f"ip:{ip}", IP_RULE))
+
+        start = time.perf_counter()
+        try:
+            wait, refused = self._get_store().take(checks)
+        except Exception as e:   # a broken store must not take chat down: fail open
+            self.store_errors += 1
+            print(f"ERROR: rate limit check failed: {e}")
+            return
+        finally:
+            elapsed = time.perf_counter() - start
+            self.check_seconds += elapsed
+            self.check_max = max(self.check_max, elapsed)
+
+        if refused is None:
+            self.allowed += 1
+            return
+        scope = "user" if refused.startswith("u:") else "ip"
+        self.limited[scope] += 1
+        raise RateLimited(scope, wait)
+
+    def stats(self):
+        checks = self.allowed + sum(self.limited.values())
+        return {
+            "enabled": RATE_LIMIT_ENABLED,
+            "store": type(self._store).__name__ if self._store else self._kind,
+            "user_burst": USER_RULE.burst,
+            "user_per_min": RATE_LIMIT_USER_PER_MIN,
+            "ip_burst": IP_RULE.burst,
+            "ip_per_min": RATE_LIMIT_IP_PER_MIN,
+            "allowed": self.allowed,
+            "limited_user": self.limited["user"],
+            "limited_ip": self.limited["ip"],
+            "store_errors": self.store_errors,
+            "check_avg_us": round(self.check_seconds / checks * 1e6, 1) if checks else None,
+            "check_max_us": round(self.check_max * 1e6, 1),
+        }
+
+
+def client_ip(remote_addr, forwarded_for):
+    """The client address, skipping RATE_LIMIT_TRUSTED_PROXIES hops of X-Forwarded-For."""
+    if RATE_LIMIT_TRUSTED_PROXIES > 0 and forwarded_for:
+        hops = [hop.strip() for hop in forwarded_for.split(",") if hop.strip()]
+        if len(hops) >= RATE_LIMIT_TRUSTED_PROXIES:
+            return hops[-RATE_LIMIT_TRUSTED_PROXIES]
+    return remote_addr
+
+
+limiter = RateLimiter()
+
@@ -0,0 +1,194 @@
+# reply_cache.py
+import os
+import re
+import time
+import json
+import hashlib
+import threading
+from collections import OrderedDict
+
+from ai_handler import is_error_reply
+
+# --------------------------
+# Cache configuration
+# --------------------------
+REPLY_CACHE_ENABLED = os.environ.get("REPLY_CACHE_ENABLED", "1") == "1"
+REPLY_CACHE_BACKEND = os.environ.get("REPLY_CACHE_BACKEND", "memory")   # "memory" or "redis"
+REPLY_CACHE_URL = os.environ.get("REPLY_CACHE_URL", "redis://localhost:6379/0")
+REPLY_CACHE_TTL = int(os.environ.get("REPLY_CACHE_TTL", 6 * 3600))       # seconds
+REPLY_CACHE_MAX_ENTRIES = int(os.environ.get("REPLY_CACHE_MAX_ENTRIES", 2048))
+REPLY_CACHE_MAX_WORDS = int(os.environ.get("REPLY_CACHE_MAX_WORDS", 20))  # longer messages are too specific to share
+
+# Words that point back at earlier turns ("tell me more about it"). A message
+# containing any of them depends on the conversation, so its answer is not shared.
+FOLLOW_UP_WORDS = {
+    "it", "its", "that", "this", "these", "those", "they", "them", "their",
+    "he", "she", "him", "her", "again", "more", "above", "previous", "earlier",
+    "last", "before", "continue", "else", "also", "another", "same", "said",
+    "mentioned", "instead", "too", "then", "next",
+}
+
+_PUNCTUATION = re.compile(r"[^\w\s]", re.UNICODE)
+_SPACES = re.compile(r"\s+")
+
+
+def normalize_message(message):
+    """Lowercases, strips punctuation and collapses whitespace: "What is  Batchoy?!" -> "what is batchoy"."""
+    text = _PUNCTUATION.sub(" ", (message or "").lower())
+    return _SPACES.sub(" ", text).strip()
+
+
+def is_context_free(message):
+    """True when the answer to `message` should not depend on the learner's earlier turns."""
+    words = normalize_message(message).split()
+    if not words or len(words) > REPLY_CACHE_MAX_WORDS:
+        return False
+    return not any(word in FOLLOW_UP_WORDS for word in words)
+
+
+def is_cacheable_reply(reply):
+    # Replies that describe a failure must never be served to other learners.
+    return not is_error_reply(reply)
+
+
+def cache_key(lesson_title, language, message):
+    raw = json.dumps([lesson_title or "", language or "", normalize_message(message)])
+    return "reply:" + hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+# --------------------------
+# Backends
+# --------------------------
+class InProcessBackend:
+    """LRU dictionary with per-entry expiry. Used for tests, local runs and single-worker setups."""
+
+    def __init__(self, max_entries=2048):
+        self.max_entries = max_entries
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.evictions = 0
+
+    def get(self, key):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return None
+            value, expires_at = entry
+            if expires_at <= now:
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl):
+        with self._lock:
+            self._data[key] = (value, time.monotonic() + ttl)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def size(self):
+        with self._lock:
+            return len(self._data)
+
+
+class RedisBackend:
+    """
+    Shared cache for several workers. Redis handles expiry; configure the
+    server with `maxmemory-policy allkeys-lru` for LRU eviction.
+    """
+
+    def __init__(self, url):
+        import redis  # optional dependency, only needed for the shared backend
+        self._client = redis.Redis.from_url(url, socket_timeout=0.05, socket_connect_timeout=0.05)
+        self.evictions = 0
+
+    def get(self, key):
+        try:
+            value = self._client.get(key)
+        except Exception as e:
+            print(f"WARNING: reply cache read failed: {e}")
+            return None
+        return value.decode("utf-8") if value is not None else None
+
+    def set(self, key, value, ttl):
+        try:
+            self._client.set(key, value.encode("utf-8"), ex=ttl)
+        except Exception as e:
+            print(f"WARNING: reply cache write failed: {e}")
+
+    def size(self):
+        try:
+            return self._client.dbsize()
+        except Exception:
+            return None
+
+
+# --------------------------
+# Cache front-end
+# --------------------------
+class ReplyCache:
+    def __init__(self, backend, ttl=REPLY_CACHE_TTL, enabled=True):
+        self.backend = backend
+        self.ttl = ttl
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.skipped = 0   # turns that depended on conversation context
+
+    def key_for(self, lesson_title, language, message):
+        """Returns the cache key for a turn, or None when the turn must not use the cache."""
+        if not self.enabled:
+            return None
+        if not is_context_free(message):
+            with self._lock:
+                self.skipped += 1
+            return None
+        return cache_key(lesson_title, language, message)
+
+    def get(self, key):
+        value = self.backend.get(key)
+        with self._lock:
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return value
+
+    def put(self, key, reply):
+        if not is_cacheable_reply(reply):
+            return
+        self.backend.set(key, reply, self.ttl)
+        with self._lock:
+            self.stores += 1
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "enabled": self.enabled,
+                "backend": type(self.backend).__name__,
+                "hits": self.hits,
+                "misses": self.misses,
+                "stores": self.stores,
+                "skipped_contextual": self.skipped,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+                "entries": self.backend.size(),
+                "evictions": self.backend.evictions,
+            }
+
+
+def _make_backend():
+    if REPLY_CACHE_BACKEND == "redis":
+        try:
+            return RedisBackend(REPLY_CACHE_URL)
+        except ImportError:
+            print("WARNING: redis package not installed; using the in-process reply cache.")
+    return InProcessBackend(REPLY_CACHE_MAX_ENTRIES)
+
+
+reply_cache = ReplyCache(_make_backend(), ttl=REPLY_CACHE_TTL, enabled=REPLY_CACHE_ENABLED)
@@ -0,0 +1,210 @@
+# reset_tokens.py
+"""
+Password reset tokens.
+
+RESET_TOKEN_MODE=db (default) stores a random UUID in `password_reset_tokens`.
+RESET_TOKEN_MODE=signed issues `<user_id>.<expires>.<fingerprint>.<signature>`.
+The signature is an HMAC-SHA256 under RESET_TOKEN_SECRET, and the fingerprint
+is taken from the user's current password hash. Checking such a token is pure
+CPU. It is redeemed by a single UPDATE that only matches while the password
+hash is unchanged, so it works once and needs no table. Tokens of either
+form are accepted whichever mode is issuing.
+
+Expired DB tokens are deleted in small batches by a background purger, or by:
+
+    python reset_tokens.py purge
+"""
+import os
+import sys
+import hmac
+import time
+import uuid
+import base64
+import hashlib
+import datetime
+import threading
+from collections import namedtuple
+
+import mysql.connector
+
+from db_pool import get_db, PoolTimeoutError
+from metrics import db_timer
+
+# --------------------------
+# Token configuration
+# --------------------------
+RESET_TOKEN_MODE = os.environ.get("RESET_TOKEN_MODE", "db")               # db | signed
+RESET_TOKEN_SECRET = os.environ.get("RESET_TOKEN_SECRET", "")            # same value on every worker
+RESET_TOKEN_TTL = int(os.environ.get("RESET_TOKEN_TTL", 3600))           # seconds a link stays valid
+RESET_TOKEN_PURGE_INTERVAL = float(os.environ.get("RESET_TOKEN_PURGE_INTERVAL", 3600))  # 0 disables the purger
+RESET_TOKEN_PURGE_BATCH = int(os.environ.get("RESET_TOKEN_PURGE_BATCH", 1000))
+
+FINGERPRINT_CHARS = 16
+
+# token: what the user sent; fingerprint: set for signed tokens only
+Claim = namedtuple("Claim", ["user_id", "token", "fingerprint"])
+
+if RESET_TOKEN_MODE == "signed" and not RESET_TOKEN_SECRET:
+    print("WARNING: RESET_TOKEN_MODE=signed needs RESET_TOKEN_SECRET; issuing DB tokens instead.")
+    RESET_TOKEN_MODE = "db"
+
+
+def _fingerprint(password_hash):
+    # Must match LEFT(SHA2(password, 256), 16) in consume().
+    return hashlib.sha256(password_hash.encode("utf-8")).hexdigest()[:FINGERPRINT_CHARS]
+
+
+def _sign(payload):
+    mac = hmac.new(RESET_TOKEN_SECRET.encode("utf-8"), payload.encode("utf-8"), hashlib.sha256).digest()
+    return base64.urlsafe_b64encode(mac).rstrip(b"=").decode("ascii")
+
+
+def is_signed(token):
+    return token.count(".") == 3
+
+
+def issue(cursor, user_id, password_hash):
+    """
+    Returns a new reset token for the user. In DB mode the row is inserted
+    with the caller's cursor, so it commits with the caller's transaction.
+    """
+    if RESET_TOKEN_MODE == "signed":
+        payload = f"{user_id}.{int(time.time()) + RESET_TOKEN_TTL}.{_fingerprint(password_hash)}"
+        return f"{payload}.{_sign(payload)}"
+
+    token = str(uuid.uuid4())
+    expires_at = datetime.datetime.now() + datetime.timedelta(seconds=RESET_TOKEN_TTL)
+    cursor.execute(
+        "INSERT INTO password_reset_tokens (user_id, token, expires_at) VALUES (%s, %s, %s)",
+        (user_id, token, expires_at)
+    )
+    return token
+
+
+def check(token):
+    """
+    Returns a Claim for a token that is well-formed and unexpired, else None.
+    Signed tokens are checked without touching the database. Whether a signed
+    token was already used only shows up in consume().
+    """
+    if is_signed(token):
+        if not RESET_TOKEN_SECRET:
+            return None
+        payload, _, signature = token.rpartition(".")
+        if not hmac.compare_digest(_sign(payload), signature):
+            return None
+        user_id, expires, fingerprint = payload.split(".")
+        try:
+            if int(expires) < time.time():
+                return None
+            return Claim(int(user_id), token, fingerprint)
+        except ValueError:
+            return None
+
+    with get_db() as db:
+        cursor = db.cursor()
+        try:
+            with db_timer("token_lookup"):
+                cursor.execute(
+                    "SELECT user_id FROM password_reset_tokens WHERE token=%s AND expires_at > NOW()",
+                    (token,)
+                )
+                row = cursor.fetchone()
+        finally:
+            cursor.close()
+    return Claim(row[0], token, None) if row else None
+
+
+def consume(cursor, claim, new_password_hash):
+    """
+    Sets the new password and uses up the token, inside the caller's
+    transaction. Returns False if the token was used or expired meanwhile.
+    """
+    if claim.fingerprint is not None:
+        cursor.execute(
+            "UPDATE users SET password=%s WHERE id=%s AND LEFT(SHA2(password, 256), %s)=%s",
+            (new_password_hash, claim.user_id, FINGERPRINT_CHARS, claim.fingerprint)
+        )
+        return cursor.rowcount == 1
+
+    cursor.execute(
+        "DELETE FROM password_reset_tokens WHERE token=%s AND expires_at > NOW()",
+        (claim.token,)
+    )
+    if cursor.rowcount == 0:
+        return False
+    cursor.execute("UPDATE users SET password=%s WHERE id=%s", (new_password_hash, claim.user_id))
+    # Other links sent to this user are now stale as well.
+    cursor.execute("DELETE FROM password_reset_tokens WHERE user_id=%s", (claim.user_id,))
+    return True
+
+
+def purge_expired(batch_size=RESET_TOKEN_PURGE_BATCH):
+    """Deletes expired token rows in short transactions. Returns how many went."""
+    total = 0
+    while True:
+        with get_db() as db:
+            cursor = db.cursor()
+            try:
+                cursor.execute(
+                    "DELETE FROM password_reset_tokens WHERE expires_at < NOW() ORDER BY expires_at LIMIT %s",
+                    (batch_size,)
+                )
+                deleted = cursor.rowcount
+                db.commit()
+            finally:
+                cursor.close()
+        total += deleted
+        if deleted < batch_size:
+            return total
+
+
+class TokenPurger:
+    """Runs purge_expired() every RESET_TOKEN_PURGE_INTERVAL seconds in each worker."""
+
+    def __init__(self):
+        self._thread = None
+        self._pid = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self.runs = 0
+        self.purged = 0
+
+    def ensure_started(self):
+        if RESET_TOKEN_PURGE_INTERVAL <= 0:
+            return
+        with self._lock:
+            if self._thread is not None and self._pid == os.getpid() and self._thread.is_alive():
+                return
+            self._pid = os.getpid()
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="reset-token-purger", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        while not self._stop.wait(RESET_TOKEN_PURGE_INTERVAL):
+            try:
+                deleted = purge_expired()
+            except (mysql.connector.Error, PoolTimeoutError) as err:
+                print(f"ERROR: could not purge expired reset tokens: {err}")
+                continue
+            self.runs += 1
+            self.purged += deleted
+            if deleted:
+                print(f"INFO: purged {deleted} expired password reset tokens")
+
+    def stats(self):
+        return {"mode": RESET_TOKEN_MODE, "purge_runs": self.runs, "purged": self.purged}
+
+
+purger = TokenPurger()
+
+
+if __name__ == "__main__":
+    if sys.argv[1:] != ["purge"]:
+        print(__doc__)
+        sys.exit(1)
+    print(f"Purged {purge_expired()} expired password reset tokens.")
@@ -12,7 +12,7 @@ type CourseFromApi = {
   course_thumbnail_url?: string | null; // ✅ from get_courses.php (like CoursePreview)
 };
 
-const API_URL = "http://localhost/mooc_api/get_courses.php";
+const API_URL = "http://127.0.0.1:5000/api/courses";
 
 const CategoriesSection = () => {
   const [dbCourses, setDbCourses] = useState<CourseFromApi[]>([]);
@@ -5,17 +5,19 @@ import Reveal from "@/components/home/Reveal";
 import TiltCard from "@/components/home/TiltCard";
 import SectionSeparator from "@/components/home/SectionSeparator";
 import { useEffect, useMemo, useState } from "react";
+import { imageVariant } from "@/lib/images";
 
 type CourseFromApi = {
   course_id: number;
   course_title: string;
   course_category: string | null;
   course_thumbnail_url?: string | null;
+  course_thumbnail_variants_url?: string | null;
   instructor_name?: string | null;
   course_price: number;
 };
 
-const API_URL = "http://localhost/mooc_api/get_courses.php";
+const API_URL = "http://127.0.0.1:5000/api/courses";
 
 const FeaturedCourses = () => {
   const [dbCourses, setDbCourses] = useState<CourseFromApi[]>([]);
@@ -39,7 +41,7 @@ const FeaturedCourses = () => {
       id: String(c.course_id),
       title: c.course_title,
       instructor: c.instructor_name ?? "Unknown Instructor",
-      image: c.course_thumbnail_url ?? null,
+      image: imageVariant(c.course_thumbnail_variants_url, 400) ?? c.course_thumbnail_url ?? null,
       rating: 4.8,
       students: 1250,
       duration: "Self-paced",
@@ -0,0 +1,10 @@
+// Resized course and instructor images served by the Flask API (mooc_api/image_variants.py).
+// `variantsUrl` is the catalog's *_variants_url field; it is null until the variants are built.
+export function imageVariant(
+  variantsUrl: string | null | undefined,
+  cssWidth: number,
+): string | null {
+  if (!variantsUrl) return null;
+  const dpr = typeof window !== "undefined" ? window.devicePixelRatio || 1 : 1;
+  return `${variantsUrl}&w=${Math.ceil(cssWidth * Math.min(dpr, 2))}`;
+}
@@ -49,7 +49,7 @@ type CourseStripFromApi = {
   course_thumbnail_url?: string | null;
 };
 
-const COURSES_API_URL = "http://localhost/mooc_api/get_courses.php";
+const COURSES_API_URL = "http://127.0.0.1:5000/api/courses";
 
 
 function PremiumTiltCard({
@@ -11,6 +11,7 @@ import ReviewCard from "@/components/ReviewCard";
 import { useAuth } from "@/contexts/AuthContext";
 import tourismImage from "@/assets/course-tourism.jpg";
 import LiquidEther from "@/components/ui/liquidether";
+import { imageVariant } from "@/lib/images";
 
 // Types (Preserved)
 type Lesson = {
@@ -20,7 +21,7 @@ type Lesson = {
 };
 
 // const API_URL = "http://localhost/mooc_api/get_courses.php"; //
-const API_URL = "http://localhost/mooc_api/get_courses.php";
+const API_URL = "http://127.0.0.1:5000/api/courses";
 const ENROLL_COURSE_URL = "http://localhost/mooc_api/enroll_course.php"; //
 const CREATE_COMMENT_URL = "http://localhost/mooc_api/create_comment.php"; //
 const GET_COMMENTS_URL   = "http://localhost/mooc_api/get_comments.php"; //
@@ -75,9 +76,11 @@ interface CourseFromApi {
   course_price: number;
   course_category: string | null;
   course_thumbnail_url?: string | null;
+  course_thumbnail_variants_url?: string | null;
   instructor_name?: string | null;
   instructor_bio?: string | null; 
   instructor_image_url?: string | null;
+  instructor_image_variants_url?: string | null;
   instructor_title?: string | null;  
   course_contents?: CourseContentFromApi[];
   course_overview?: CourseOverviewFromApi[];
@@ -243,8 +246,8 @@ const objectivesFromDb =
     title: db.course_title,
     instructor: db.instructor_name ?? "Unknown Instructor",
     instructorBio: db.instructor_bio ?? "Passionate educator dedicated to Filipino heritage.",
-    image: db.course_thumbnail_url ?? tourismImage,
-    instructorImage: db.instructor_image_url ?? undefined,
+    image: imageVariant(db.course_thumbnail_variants_url, 960) ?? db.course_thumbnail_url ?? tourismImage,
+    instructorImage: imageVariant(db.instructor_image_variants_url, 56) ?? db.instructor_image_url ?? undefined,
     instructorTitle: db.instructor_title ?? undefined,
     rating: Number(averageRating.toFixed(1)),
     students: 1250, // Placeholder or DB field
@@ -10,6 +10,7 @@ import cookingImage from "@/assets/course-cooking.jpg";
 import agricultureImage from "@/assets/course-agriculture.jpg";
 import craftsImage from "@/assets/course-crafts.jpg";
 import LiquidEther from "@/components/ui/liquidether";
+import { imageVariant } from "@/lib/images";
 
 // === Types for data from your PHP/MySQL API ===
 interface CourseFromApi {
@@ -27,6 +28,7 @@ interface CourseFromApi {
   // ⭐ from backend
   course_thumbnail?: string | null;
   course_thumbnail_url?: string | null;
+  course_thumbnail_variants_url?: string | null;
 }
 
 // === Type used by your UI cards ===
@@ -46,7 +48,7 @@ interface CourseCard {
 const categories = ["All", "Tourism", "Cooking", "Language", "History"];
 
 // adjust base URL if your folder name / path is different
-const API_URL = "http://localhost/mooc_api/get_courses.php";
+const API_URL = "http://127.0.0.1:5000/api/courses";
 
 const Courses = () => {
   const [courses, setCourses] = useState<CourseCard[]>([]);
@@ -79,7 +81,7 @@ const Courses = () => {
             title: c.course_title,
             instructor: c.instructor_name ?? "Unknown Instructor",
             // ⭐ primary: DB thumbnail URL; fallback: local placeholder
-            image: c.course_thumbnail_url ?? fallbackImage,
+            image: imageVariant(c.course_thumbnail_variants_url, 400) ?? c.course_thumbnail_url ?? fallbackImage,
             rating: Number(4.8.toFixed(1)),
             students: 0,
             duration: "8 hours",
@@ -13,7 +13,7 @@ import LiquidEther from "@/components/ui/liquidether";
 // 🔹 Same shape as whatever your mockEnrollments use
 type Enrollment = (typeof mockEnrollments)[number];
 
-const ENROLLMENTS_API = "http://localhost/mooc_api/get_user_enrollments.php";
+const ENROLLMENTS_API = "http://127.0.0.1:5000/api/enrollments";
 
 const Dashboard = () => {
   const { user } = useAuth();
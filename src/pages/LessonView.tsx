@@ -45,8 +45,9 @@ import { cn } from "@/lib/utils";
 /* TYPES & CONFIG                               */
 /* -------------------------------------------------------------------------- */
 
-const API_URL = "http://localhost/mooc_api/get_courses.php";
-const UPDATE_PROGRESS_API = "http://localhost/mooc_api/update_course_progress.php";
+const API_URL = "http://127.0.0.1:5000/api/courses";
+const UPDATE_PROGRESS_API = "http://127.0.0.1:5000/api/progress";
+const LESSON_MEDIA_API = "http://127.0.0.1:5000/api/media/lessons";
 
 // NEW: Avatar Map definition (Matches the keys and icons from AvatarSelector.tsx)
 // NOTE: The 'bgClass' values (e.g., bg-secondary) must be correctly defined in your CSS/Tailwind config to render colors.
@@ -238,7 +239,7 @@ export default function LessonView() {
               title: lesson.lesson_title,
               duration: lesson.lesson_duration ?? "",
               type: (lesson.lesson_type ?? "video") as Lesson["type"],
-              videoUrl: lesson.lesson_directory_url ?? null,
+              videoUrl: lesson.lesson_directory_url ? `${LESSON_MEDIA_API}/${lesson.lesson_id}` : null,
             })),
           })),
         };
@@ -359,17 +360,80 @@ export default function LessonView() {
     setChatInput("");
     setIsTyping(true);
 
+    // Streams the reply over Server-Sent Events so text appears as soon as Gemini starts answering.
+    let reply = "";
+    let failed = false;
     try {
-      const res = await axios.post("http://127.0.0.1:5000/chat", {
-        user_id: currentUserId,
-        message: userMessage,
-        lesson_title: currentLesson?.title ?? "",
-        language: "en",
+      const res = await fetch("http://127.0.0.1:5000/chat/stream", {
+        method: "POST",
+        headers: { "Content-Type": "application/json" },
+        body: JSON.stringify({
+          user_id: currentUserId,
+          message: userMessage,
+          lesson_title: currentLesson?.title ?? "",
+          language: "en",
+        }),
       });
-      const reply = res.data.reply || "No response";
-      setChatMessages((prev) => [...prev, { sender: "assistant", text: reply }]);
+      if (res.status === 403 || res.status === 429 || res.status === 503) {
+        // Account being deleted, rate limited or AI busy: show the server's message
+        // (for 429/503, Retry-After says when to try again).
+        const body = await res.json().catch(() => null);
+        const text = body?.reply?.replace(/^Error: /, "") ?? "Roxy is busy right now. Please try again shortly.";
+        setChatMessages((prev) => [...prev, { sender: "assistant", text }]);
+        return;
+      }
+      if (!res.ok || !res.body) throw new Error(`HTTP ${res.status}`);
+
+      const reader = res.body.getReader();
+      const decoder = new TextDecoder();
+      let buffer = "";
+
+      while (true) {
+        const { done, value } = await reader.read();
+        if (done) break;
+        buffer += decoder.decode(value, { stream: true });
+
+        const events = buffer.split("\n\n");
+        buffer = events.pop() ?? "";
+
+        for (const evt of events) {
+          const lines = evt.split("\n");
+          const eventName = lines.find((line) => line.startsWith("event:"))?.slice(6).trim();
+          const dataLine = lines.find((line) => line.startsWith("data:"));
+          if (!dataLine) continue;
+          const payload = JSON.parse(dataLine.slice(5));
+
+          if (eventName === "error") {
+            // A failure is its own message, never more of the answer.
+            const text = (payload.message ?? "Error connecting to Roxy AI.").replace(/^Error: /, "");
+            setIsTyping(false);
+            setChatMessages((prev) => [...prev, { sender: "assistant", text }]);
+            failed = true;
+            continue;
+          }
+
+          const chunk: string | undefined = payload.text;
+          if (!chunk) continue;
+
+          const isFirstChunk = reply === "";
+          reply += chunk;
+          const snapshot = reply;
+          if (isFirstChunk) setIsTyping(false);
+          setChatMessages((prev) =>
+            isFirstChunk
+              ? [...prev, { sender: "assistant", text: snapshot }]
+              : [...prev.slice(0, -1), { sender: "assistant", text: snapshot }]
+          );
+        }
+      }
+
+      if (!reply && !failed) {
+        setChatMessages((prev) => [...prev, { sender: "assistant", text: "No response" }]);
+      }
     } catch (err) {
-      setChatMessages((prev) => [...prev, { sender: "assistant", text: "Error connecting to Roxy AI." }]);
+      if (!reply && !failed) {
+        setChatMessages((prev) => [...prev, { sender: "assistant", text: "Error connecting to Roxy AI." }]);
+      }
     } finally {
       setIsTyping(false);
       isSendingRef.current = false;
@@ -36,7 +36,7 @@ type CourseReview = {
 };
 
 // ✅ data coming from PHP/MySQL
-const API_URL = "http://localhost/mooc_api/get_courses.php";
+const API_URL = "http://127.0.0.1:5000/api/courses";
 
 
 